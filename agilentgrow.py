@@ -2,14 +2,27 @@
 from __future__ import division
 from sys import stdout, exit
 import argparse
-from time import time, sleep
+import os
 
-#somehow the import must be in that order
-from devices.Agilent33220A import get_devices
-from devices.Agilent33220A import Agilent33220A
+from devices import get_driver, report_startup
+from devices.discovery import discovery, VISA
+from devices.sockethelper import is_socket_address
+from devices.instrumentation import Tracer, write_trace
+from runner.checkpoint import Checkpoint
+from runner.compiler import Protocol, three_stages, resolution
+from runner.protofile import read_protocol, BinaryProtocol
+from runner.recorder import Recorder, default_log
+from runner.remote import Client
+from runner.statusfeed import StatusFeed, default_feed
+from runner.execute import ProtocolRun
+from runner.orchestra import Orchestrator, FINISHED, STOPPED, FAILED
+from runner.ramps import ramps, LINEAR
+from runner.scheduler import DeadlineScheduler, POLICIES, CATCHUP
 
 
-def update_disp(device, mesg, u, f, t):
+CHECKPOINT = 'agilentgrow.ckpt'
+
+def update_disp(device, mesg, u, f, t, tostdout=True):
     if u:
         u = '%.2f'%u
     else:
@@ -22,8 +35,9 @@ def update_disp(device, mesg, u, f, t):
     line1 = "%s - %s"%(mesg, T)
     line2 = '%s Vpp | %s Hz'%(u,f)
     device.set_display(line1, line2)
-    line = line2+' | %s'%T
-    update_stdout(line)
+    if tostdout:
+        line = line2+' | %s'%T
+        update_stdout(line)
     
 def update_stdout(line):
     blank = ' '*40
@@ -36,16 +50,18 @@ def grow_3stages():
     optparser = argparse.ArgumentParser(description=
     "Grow vesicles in 3 stages.", epilog='(Defaults) are for high salinity.')
     optparser.add_argument('-l', '--list', action='store_true', 
-        help='List available devices and exit')
-    if len(get_devices()) == 0:
+        help='List available devices with their models and exit')
+    # one cached enumeration, devices are identified only for --list
+    available = discovery.addresses([VISA])
+    if len(available) == 0:
         defaultdevice = None
     else:
-        defaultdevice = get_devices()[0]
-        if defaultdevice == 'no devices':
-            defaultdevice = None
-    optparser.add_argument('device', choices=get_devices(),
-        default=defaultdevice,
-        help='Device code to connect with (first found)', nargs='?')
+        defaultdevice = available[0]
+    optparser.add_argument('device', default=defaultdevice, nargs='*',
+        help='Device code(s) to connect with (first found), '
+        'the protocol runs on all of them at once; one of %s '
+        'or a raw socket address TCPIP::host::5025::SOCKET'
+        %', '.join(available))
     optparser.add_argument('-u1', type=float, default=0.1,
         help='Initial voltage, Vpp (0.1)')
     optparser.add_argument('-u2', type=float, default=2.5,
@@ -62,11 +78,51 @@ def grow_3stages():
         help='Duration of detachment stage, min (30)')
     optparser.add_argument('-dt', type=int, default=5, 
         help='Update interval of values/displays, sec (5)')
+    optparser.add_argument('--ramp', choices=ramps(), default=LINEAR,
+        help='Shape of voltage/frequency ramps (%s)'%LINEAR)
+    optparser.add_argument('--adaptive', action='store_true',
+        help='Update values only when they have moved by the tolerance, '
+        'at most every -dt sec')
+    optparser.add_argument('--tolerance', type=float, nargs=2,
+        metavar=('DU', 'DF'),
+        help='Tolerance of adaptive stages, Vpp and Hz '
+        '(resolution of the device)')
+    optparser.add_argument('--policy', choices=POLICIES, default=CATCHUP,
+        help='What to do with overdue steps when falling behind (catchup)')
+    optparser.add_argument('-P', '--protocol', metavar='FILE',
+        help='Run the protocol from FILE (CSV, or binary *.pfg read from disk '
+        'as it runs) instead of the three stages')
+    optparser.add_argument('-p', '--pulse', type=float, metavar='MS',
+        help='Instead of growing, apply a single pulse of MS ms '
+        'at -f1 and -u2 and exit')
+    optparser.add_argument('--resume', action='store_true',
+        help='Resume the protocol where an interrupted run of it stopped')
+    optparser.add_argument('--checkpoint', metavar='FILE', 
+        default=CHECKPOINT,
+        help='File to save the progress of a single device run to '
+        '(%s)'%CHECKPOINT)
+    optparser.add_argument('--verify', type=float, metavar='SEC',
+        help='Check the commands of every step for errors, reading them '
+        'from the device every SEC s')
+    optparser.add_argument('--log', metavar='FILE', default=default_log(),
+        help='Record every applied setpoint, output switch, pulse and error '
+        'with timestamps to FILE (default from PYFUNCGEN_RUNLOG)')
+    optparser.add_argument('--feed', metavar='FILE', default=default_feed(),
+        help='Publish the live status of the run to FILE, shared memory '
+        'for other programs (see runner.statusfeed)')
+    optparser.add_argument('--daemon', action='store_true',
+        help='Run the protocol in the device daemon (python -m runner.daemon), '
+        'Ctrl-C leaves it running there')
+    optparser.add_argument('--trace', metavar='FILE',
+        help='Time the communication with devices and write the trace to FILE '
+        '(Chrome trace format for *.json, JSON lines otherwise)')
     
     args = optparser.parse_args()
     
     if args.list:
-        print get_devices()
+        report_startup()
+        for info in discovery.devices([VISA]):
+            print info
         exit(0)
 
     Ustart = args.u1
@@ -78,75 +134,278 @@ def grow_3stages():
     Tdetach = args.t3
     Trez = args.dt
     
-    if args.device:
-        fg = Agilent33220A(args.device)
-    else:
+    devices = args.device
+    if isinstance(devices, basestring):
+        devices = [devices]
+    for device in devices:
+        if device not in available and not is_socket_address(device):
+            optparser.error('unknown device %s'%device)
+    if not devices:
         print 'No device present.'
         exit(0)
-    fg.connect()
+    if args.tolerance:
+        tolerance = args.tolerance
+    else:
+        tolerance = resolution(get_driver('Agilent33220A'))
+    try:
+        if args.protocol:
+            rows = read_protocol(args.protocol)
+        else:
+            rows = three_stages(Ustart, Uend, Fmain, Fdetach, Tgrow, Trest, 
+                                Tdetach, Trez, args.ramp, args.adaptive)
+        protocol = Protocol(rows, lazy=isinstance(rows, BinaryProtocol),
+                            tolerance=tolerance, mindt=Trez)
+    except (ValueError, IOError), err:
+        print err
+        exit(1)
+    if protocol.saved:
+        print 'Adaptive steps: %i instead of %i, %i commands saved'%(
+              protocol.Nstates, protocol.Ngrid, protocol.saved)
+    if args.daemon:
+        if isinstance(rows, BinaryProtocol):
+            # the daemon reads it from the disk as it runs
+            source = {'file':os.path.abspath(args.protocol)}
+        else:
+            source = {'rows':rows}
+        grow_daemon(devices, source, args.policy, tolerance, Trez, 
+                    args.verify)
+        return
+    if args.trace:
+        tracers = [Tracer(device) for device in devices]
+    else:
+        tracers = [None]*len(devices)
+    recorder = None
+    if args.log:
+        recorder = Recorder(args.log)
+    feed = None
+    if args.feed:
+        feed = StatusFeed(args.feed)
+    # the driver is imported only now that it is needed
+    Agilent33220A = get_driver('Agilent33220A').load()
+    report_startup()
+    if args.pulse:
+        pulse_each(Agilent33220A, devices, Fmain, Uend, args.pulse/1000, 
+                   tracers, recorder)
+        save_trace(args.trace, tracers)
+        close_log(recorder)
+        return
+    if len(devices) > 1:
+        if args.resume:
+            print 'Runs on several devices can not be resumed'
+            exit(1)
+        grow_many(Agilent33220A, devices, protocol, args.policy, Trez, 
+                  tracers, recorder, args.verify, feed)
+        save_trace(args.trace, tracers)
+        close_log(recorder)
+        return
+    
+    fg = Agilent33220A(devices[0])
     if not fg.dev:
-        print 'could not connect to device %s'%fg.devname
+        print 'could not connect to device %s'%devices[0]
         exit(0)
+    fg.tracer = tracers[0]
+    fg.connect()
     
-    #growing stage
-    if Tgrow:
-        stage = 'Growing'
-        print '\n'+stage
-        Ngrow = Tgrow*60//Trez
-        StepUgrow = (Uend-Ustart)/Ngrow
-        U = [Ustart+i*StepUgrow for i in range(Ngrow+1)]
-        fg.apply(Fmain, Ustart)
-        fg.output = True
-        for i, u in enumerate(U):
-            fg.apply(Fmain, u)
-            Tremain = Tgrow*60-i*Trez
-            update_disp(fg, stage, u, Fmain, Tremain)
-            sleep(Trez)
-    
-    #resting stage
-    if Trest:
-        fg.apply(Fmain, Uend)
-        fg.output = True
-        stage = 'Resting'
-        print '\n'+stage
-        Nrest = Trest*60//Trez
-        for i in range(Nrest):
-            Tremain = Trest*60-i*Trez
-            update_disp(fg, stage, Uend, Fmain, Tremain)
-            sleep(Trez)
-        
-    #detachment stage
-    if Tdetach:
-        fg.apply(Fmain, Uend)
-        fg.output = True
-        stage = 'Detaching'
-        print '\n'+stage
-        Ndetach = Tdetach*60//Trez
-        StepFdetach = (Fdetach-Fmain)/Ndetach
-        F = [Fmain+i*StepFdetach for i in range(Ndetach+1)]
-        for i, f in enumerate(F):
-            fg.freq = f
-            Tremain = Tdetach*60-i*Trez
-            update_disp(fg, stage, Uend, f, Tremain)
-            sleep(Trez)
+    shown = [None]
+    def show(state):
+        if state.stage != shown[0]:
+            shown[0] = state.stage
+            print '\n'+state.stage
+        update_disp(fg, state.stage, state.u, state.f, state.tremain)
+    log = None
+    if recorder:
+        log = recorder.device(0)
+        log.event(devices[0])
+    checkpoint = Checkpoint(args.checkpoint)
+    index, elapsed = 0, None
+    if args.resume:
+        index, elapsed = checkpoint.resume_point(protocol)
+        if elapsed is None:
+            print 'No interrupted run of this protocol to resume'
+            fg.disconnect()
+            fg.close()
+            close_log(recorder)
+            exit(1)
+        print 'Resuming at %i:%02i'%(elapsed//60, elapsed%60)
+    sched = DeadlineScheduler(args.policy)
+    if feed:
+        feed = feed.device(devices[0])
+    run = ProtocolRun(fg, protocol, sched, display=show, log=log,
+                      checkpoint=checkpoint, verify=args.verify, feed=feed)
+    try:
+        run.validate()
+    except ValueError, err:
+        print err
+        fg.disconnect()
+        fg.close()
+        close_log(recorder)
+        exit(1)
+    stats = run.run(index, elapsed=elapsed)
     
     #after-counter
     stage = 'Finished'
     print '\n'+stage
     fg.output = False
+    if log:
+        log.output(False)
+    print 'Timing: %s'%stats
+    report_errors(run.deviceerrors, args.verify)
+    save_trace(args.trace, tracers)
+    close_log(recorder)
     print "Hit Ctrl-C to stop"
-    start = time()
+    sched.start()
+    offset = 0
     while True:
         try:
-            sleep(Trez)
-            T = time() - start
-            update_disp(fg, stage, None, None, T)
+            offset += Trez
+            sched.wait(offset)
+            update_disp(fg, stage, None, None, offset)
         except KeyboardInterrupt:
             break
     fg.clear_display()
     fg.disconnect()
     fg.close()
     
+def report_errors(errors, verify):
+    """Print the errors found by checking the steps"""
+    if verify is None:
+        return
+    print 'Device errors: %i'%len(errors)
+    for err in errors:
+        print '  %s'%err
+    
+def save_trace(filename, tracers):
+    """Print statistics of the communication and write the trace"""
+    if filename:
+        for tracer in tracers:
+            print tracer.report()
+        write_trace(filename, tracers)
+        print 'Trace written to %s'%filename
+    
+def close_log(recorder):
+    if recorder:
+        recorder.close()
+        print 'Run log written to %s'%recorder.filename
+    
+def pulse_each(devclass, devices, f, u, duration, tracers, recorder=None):
+    """Apply a pulse with every device in turn, print how long it was"""
+    for number, (address, tracer) in enumerate(zip(devices, tracers)):
+        fg = devclass(address)
+        if not fg.dev:
+            print 'could not connect to device %s'%address
+            continue
+        fg.tracer = tracer
+        fg.connect()
+        # not apply(), it would turn the output on
+        fg.output = False
+        with fg.batch():
+            fg.freq = f
+            fg.ampl = u
+        result = fg.pulse(duration)
+        print '%s: pulse %s'%(address, result)
+        if recorder:
+            log = recorder.device(number)
+            log.event(address)
+            log.pulse(result)
+        fg.disconnect()
+        fg.close()
+    
+def grow_daemon(devices, source, policy, tolerance, Trez, verify=None):
+    """Run the protocol in the daemon, showing its progress until it ends"""
+    try:
+        client = Client()
+    except IOError, err:
+        print 'The device daemon is not running (%s)'%err
+        exit(1)
+    states = dict((device, None) for device in devices)
+    def show(event):
+        if event['device'] not in states:
+            return
+        if event['event'] == 'step':
+            T = event['tremain']
+            update_stdout('%s: %s %.2f Vpp | %.2f Hz | %i:%02i'%(
+                          event['device'], event['stage'], event['u'], 
+                          event['f'], T//60, T%60))
+        elif event['event'] == 'run':
+            states[event['device']] = event
+    client.subscribe(show)
+    for device in devices:
+        try:
+            client.call('run', address=device, policy=policy, 
+                        tolerance=tolerance, mindt=Trez, verify=verify, 
+                        **source)
+        except Exception, err:
+            print '%s: %s'%(device, err)
+            states.pop(device)
+    sched = DeadlineScheduler()
+    sched.start()
+    offset = 0
+    done = (FINISHED, STOPPED, FAILED)
+    try:
+        while (not client.closed and 
+               [event for event in states.values() 
+                if not event or event['state'] not in done]):
+            offset += 1
+            sched.wait(offset)
+    except KeyboardInterrupt:
+        print '\nLeft running in the daemon, see python -m runner.daemon status'
+        client.close()
+        return
+    print '\nFinished'
+    for device, event in sorted(states.items()):
+        if event:
+            print '%s: %s, %s'%(device, event['state'], 
+                                event['error'] or event['stats'])
+            report_errors(event['deviceerrors'], verify)
+    client.close()
+    
+def grow_many(devclass, devices, protocol, policy, Trez, tracers, 
+              recorder=None, verify=None, feed=None):
+    """Run the protocol on several devices at once"""
+    def show(fg, state):
+        update_disp(fg, state.stage, state.u, state.f, state.tremain, False)
+    orchestra = Orchestrator(policy, display=show, recorder=recorder,
+                             verify=verify, feed=feed)
+    for address, tracer in zip(devices, tracers):
+        orchestra.add_device(devclass, address, protocol, tracer)
+    orchestra.start()
+    sched = DeadlineScheduler()
+    sched.start()
+    offset = 0
+    try:
+        while orchestra.alive():
+            offset += Trez
+            sched.wait(offset)
+            update_stdout(' | '.join([str(item) 
+                                      for item in orchestra.statuses]))
+    except KeyboardInterrupt:
+        orchestra.stop()
+        orchestra.join()
+    print '\nFinished'
+    for status in orchestra.statuses:
+        print '%s: %s, %s'%(status.name, status.state, 
+                            status.error or status.stats)
+        report_errors(status.deviceerrors, verify)
+    # a device which failed does not keep the others on
+    for channel in orchestra.channels:
+        fg = channel.fg
+        if not fg:
+            continue
+        try:
+            fg.output = False
+            if channel.log:
+                channel.log.output(False)
+            fg.clear_display()
+            fg.disconnect()
+        except Exception, err:
+            print '%s: could not switch off (%s)'%(channel.status.name, err)
+            if channel.log:
+                channel.log.error(err)
+        try:
+            fg.close()
+        except Exception:
+            pass
+    
 if __name__=='__main__':
     grow_3stages()
 
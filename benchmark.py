@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of protocol execution against simulated function generators.
+
+Measures how fast and how accurately protocols are driven through
+the device drivers, with the simulated instruments of devices.simulator
+delaying every transfer by a configurable latency:
+    three_stages - grow_3stages-like run in compressed time;
+    csv - large protocol loaded from a CSV file and run as fast as possible;
+    apply - the apply() / apply_formatted() hot paths of every driver;
+    socket - the Agilent 33220A over raw TCP sockets to local stand-in
+        servers (devices.sockethelper): pipelined writes, queries,
+        reopening pooled connections and querying many instruments at once.
+Results (commands per second, per-step latency, jitter and drift) are
+written as JSON, and can be compared against those of a previous version:
+    python benchmark.py -o new.json --compare old.json
+
+"""
+from __future__ import division
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from sys import exit
+
+from devices.simulator import (ENVVAR, LatencyModel, SimulatedAgilent33220A,
+                               SimulatedTGA1230)
+# never touch real instruments while benchmarking
+os.environ.setdefault(ENVVAR, '')
+
+from devices.Agilent33220A import Agilent33220A
+from devices.TtiTga1230 import TtiTga1230
+from devices.instrumentation import Tracer, write_trace
+from devices.sockethelper import (serve, SocketInstrument, ConnectionPool,
+                                  query_all)
+from agilentgrow import update_disp
+from runner.compiler import Protocol, three_stages
+from runner.execute import ProtocolRun, planner
+from runner.protofile import read_csv, write_csv, convert_rows
+from runner.scheduler import DeadlineScheduler, POLICIES, CATCHUP, monotonic
+
+SCENARIOS = ('three_stages', 'csv', 'apply', 'socket')
+DEVICES = ('Agilent33220A', 'TtiTga1230')
+# results which are settings of a benchmark rather than its outcome
+SETTINGS = ('count', 'calls', 'rows', 'steps', 'instruments')
+RESOLUTION = 1e-4 # s, smaller differences of times are noise
+
+
+def open_device(name, model, tracers=None):
+    """Driver of the named device talking to a simulated instrument
+
+    If a list of tracers is given, the device gets a new one appended to it.
+    """
+    if name == 'Agilent33220A':
+        fg = Agilent33220A('benchmark')
+        fg.dev = SimulatedAgilent33220A('benchmark', model)
+    else:
+        fg = TtiTga1230('SIM1')
+        fg.dev = SimulatedTGA1230('SIM1', model)
+    if tracers is not None:
+        fg.tracer = Tracer(name)
+        tracers.append(fg.tracer)
+    fg.connect()
+    model.reset_counters()
+    return fg
+
+
+def summary(values):
+    """Distribution of times, in seconds"""
+    if not values:
+        return {'count':0}
+    values = sorted(values)
+    n = len(values)
+    def percentile(p):
+        return values[min(n - 1, int(p*n))]
+    return {'count':n,
+            'mean':sum(values)/n,
+            'p50':percentile(0.5),
+            'p95':percentile(0.95),
+            'p99':percentile(0.99),
+            'max':values[-1],
+            }
+
+
+def traffic(model, wall):
+    """Communication done during wall seconds"""
+    return {'commands':model.commands,
+            'transfers':model.transfers,
+            'bytes':model.nbytes,
+            'commands_per_s':model.commands/wall if wall else None,
+            'transfers_per_s':model.transfers/wall if wall else None,
+            }
+
+
+def timed_run(fg, protocol, policy, display=None):
+    """Run the protocol timing every step, return the results"""
+    run = ProtocolRun(fg, protocol, DeadlineScheduler(policy), display)
+    run.validate()
+    latencies = []
+    wall = monotonic()
+    t = monotonic()
+    run.start()
+    latencies.append(monotonic() - t)
+    while True:
+        run.scheduler.wait(run.nextoffset())
+        t = monotonic()
+        if not run.step():
+            break
+        latencies.append(monotonic() - t)
+    wall = monotonic() - wall
+    result = run.scheduler.stats.as_dict()
+    result['wall'] = wall
+    result['step_latency'] = summary(latencies)
+    return result
+
+
+def bench_three_stages(args, model):
+    """Three-stage growing protocol with display updates, in real time"""
+    T = args.duration/3/60
+    protocol = Protocol(three_stages(0.1, 2.5, 500, 50, T, T, T, args.dt))
+    results = {}
+    for name in args.devices:
+        fg = open_device(name, model, args.tracers)
+        def show(state):
+            update_disp(fg, state.stage, state.u, state.f, state.tremain,
+                        False)
+        result = timed_run(fg, protocol, args.policy, show)
+        result.update(traffic(model, result['wall']))
+        results[name] = result
+    return results
+
+
+def bench_csv(args, model):
+    """Large protocol from CSV file, all steps overdue at once"""
+    rows = []
+    for i in range(args.rows):
+        u1 = 0.1 + 2.0*i/args.rows
+        rows.append(['stage %i'%i, '%g'%(1e-6*args.points), '%.4f'%u1,
+                     '%g'%(500 + i), '%.4f'%(u1 + 0.01), '%g'%(600 + i),
+                     '%i'%args.points, 'lin'])
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'protocol.csv')
+        write_csv(filename, rows)
+        t = monotonic()
+        protocol = Protocol(convert_rows(read_csv(filename)))
+        loadtime = monotonic() - t
+    finally:
+        shutil.rmtree(tmpdir)
+    results = {'rows':args.rows, 'steps':protocol.Nstates, 'load':loadtime}
+    for name in args.devices:
+        fg = open_device(name, model, args.tracers)
+        t = monotonic()
+        ProtocolRun(fg, protocol).validate()
+        validatetime = monotonic() - t
+        result = timed_run(fg, protocol, CATCHUP)
+        result['validate'] = validatetime
+        result['steps_per_s'] = result['steps']/result['wall']
+        result.update(traffic(model, result['wall']))
+        results[name] = result
+    return results
+
+
+def bench_apply(args, model):
+    """Setting frequency and amplitude by the drivers, value after value"""
+    results = {}
+    for name in args.devices:
+        fg = open_device(name, model, args.tracers)
+        result = {}
+        for method in ('apply', 'apply_formatted'):
+            model.reset_counters()
+            latencies = []
+            wall = monotonic()
+            for i in range(args.calls):
+                # values differ every call, so the cache never suppresses them
+                f = 100.0 + i
+                u = 0.1 + (i % 100)*0.01
+                if method == 'apply':
+                    t = monotonic()
+                    fg.apply(f, u)
+                else:
+                    fstr = fg.freqacc%f
+                    ustr = fg.amplacc%u
+                    t = monotonic()
+                    fg.apply_formatted(fstr, ustr)
+                latencies.append(monotonic() - t)
+            wall = monotonic() - wall
+            item = {'calls':args.calls,
+                    'wall':wall,
+                    'calls_per_s':args.calls/wall,
+                    'latency':summary(latencies),
+                    }
+            item.update(traffic(model, wall))
+            result[method] = item
+        results[name] = result
+    return results
+
+
+def bench_socket(args, model):
+    """Agilent 33220A over raw sockets, to servers on localhost"""
+    servers = [serve(instrument=SimulatedAgilent33220A('socket %i'%i, model))
+               for i in range(args.servers)]
+    try:
+        address = servers[0].address
+        fg = Agilent33220A(address)
+        if args.tracers is not None:
+            fg.tracer = Tracer('socket')
+            args.tracers.append(fg.tracer)
+        fg.connect()
+        results = {}
+        model.reset_counters()
+        wall = monotonic()
+        for i in range(args.calls):
+            fg.apply(100.0 + i, 0.1 + (i % 100)*0.01)
+        # writes do not wait, the reply comes when all were performed
+        fg.ask('*OPC?')
+        wall = monotonic() - wall
+        item = {'calls':args.calls, 'wall':wall,
+                'calls_per_s':args.calls/wall}
+        item.update(traffic(model, wall))
+        results['apply'] = item
+        latencies = []
+        for i in range(args.calls):
+            t = monotonic()
+            fg.ask('FREQ?')
+            latencies.append(monotonic() - t)
+        results['ask'] = {'calls':args.calls, 'latency':summary(latencies)}
+        fg.close()
+        # opening an instrument, with connections pooled and without
+        for name, pool in (('reopen_pooled', ConnectionPool()),
+                           ('reopen_new', ConnectionPool(maxidle=0))):
+            latencies = []
+            for i in range(args.calls//10):
+                t = monotonic()
+                SocketInstrument(address, pool=pool).close()
+                latencies.append(monotonic() - t)
+            pool.close()
+            results[name] = {'latency':summary(latencies)}
+        instruments = [SocketInstrument(server.address)
+                       for server in servers]
+        rounds = max(1, args.calls//10)
+        t = monotonic()
+        for i in range(rounds):
+            for instrument in instruments:
+                instrument.ask('*IDN?')
+        sequential = (monotonic() - t)/rounds
+        t = monotonic()
+        for i in range(rounds):
+            query_all(instruments, '*IDN?')
+        parallel = (monotonic() - t)/rounds
+        for instrument in instruments:
+            instrument.close()
+        results['query_all'] = {'instruments':len(instruments),
+                                'sequential':sequential,
+                                'parallel':parallel,
+                                }
+    finally:
+        for server in servers:
+            server.stop()
+    return results
+
+
+def leaves(tree, prefix=''):
+    """Flatten nested dicts of results into (path, number) pairs"""
+    for key, value in sorted(tree.items()):
+        path = prefix + key
+        if isinstance(value, dict):
+            for item in leaves(value, path + '/'):
+                yield item
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def compare(results, baseline, threshold):
+    """List results worse than baseline by more than threshold (fraction)
+
+    Rates (*_per_s) are better when higher, all other values
+    (times, numbers of commands) when lower.
+    """
+    old = dict(leaves(baseline['benchmarks']))
+    worse = []
+    for path, value in leaves(results['benchmarks']):
+        if path not in old or path.rsplit('/', 1)[-1] in SETTINGS:
+            continue
+        if path.endswith('_per_s'):
+            degradation = old[path] - value
+        else:
+            degradation = value - old[path]
+            if isinstance(value, float) and degradation < RESOLUTION:
+                continue
+        if degradation > threshold*abs(old[path]):
+            worse.append((path, old[path], value))
+    return worse
+
+
+def benchmark():
+    optparser = argparse.ArgumentParser(description=
+        "Benchmark protocol execution against simulated devices.")
+    optparser.add_argument('scenarios', nargs='*',
+        help='Benchmarks to run: %s (all)'%', '.join(SCENARIOS))
+    optparser.add_argument('-d', '--device', dest='devices',
+        action='append', choices=DEVICES,
+        help='Device driver to benchmark, may be repeated (all)')
+    optparser.add_argument('--latency', type=float, default=0.002,
+        help='Simulated latency of every transfer, s (0.002)')
+    optparser.add_argument('--jitter', type=float, default=0.0005,
+        help='Standard deviation of the latency, s (0.0005)')
+    optparser.add_argument('--seed', type=int, default=1,
+        help='Seed of the random latencies (1)')
+    optparser.add_argument('--policy', choices=POLICIES, default=CATCHUP,
+        help='Scheduling policy of the three-stage run (catchup)')
+    optparser.add_argument('--duration', type=float, default=6,
+        help='Duration of the three-stage run, s (6)')
+    optparser.add_argument('-dt', type=float, default=0.05,
+        help='Step interval of the three-stage run, s (0.05)')
+    optparser.add_argument('--rows', type=int, default=100,
+        help='Number of rows of the CSV protocol (100)')
+    optparser.add_argument('--points', type=int, default=20,
+        help='Number of points in every CSV row (20)')
+    optparser.add_argument('--calls', type=int, default=500,
+        help='Number of calls of every apply method (500)')
+    optparser.add_argument('--servers', type=int, default=4,
+        help='Number of stand-in instruments of the socket benchmark (4)')
+    optparser.add_argument('-o', '--output',
+        help='File to write results to (stdout)')
+    optparser.add_argument('--trace', metavar='FILE',
+        help='Write the trace of all device transfers to FILE')
+    optparser.add_argument('--compare', metavar='BASELINE',
+        help='Results of a previous version to check for regressions')
+    optparser.add_argument('--threshold', type=float, default=0.1,
+        help='Relative degradation reported as regression (0.1)')
+    args = optparser.parse_args()
+    if not args.scenarios:
+        args.scenarios = list(SCENARIOS)
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            optparser.error('unknown benchmark %s'%scenario)
+    if not args.devices:
+        args.devices = list(DEVICES)
+    args.tracers = [] if args.trace else None
+
+    benchmarks = {'three_stages':bench_three_stages,
+                  'csv':bench_csv,
+                  'apply':bench_apply,
+                  'socket':bench_socket,
+                  }
+    results = {'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python':platform.python_version(),
+               'platform':platform.platform(),
+               'numpy':planner is not None,
+               'model':{'latency':args.latency, 'jitter':args.jitter,
+                        'seed':args.seed},
+               'benchmarks':{},
+               }
+    for scenario in args.scenarios:
+        model = LatencyModel(args.latency, args.jitter, seed=args.seed)
+        sys.stderr.write('running %s...\n'%scenario)
+        results['benchmarks'][scenario] = benchmarks[scenario](args, model)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+    if args.trace:
+        write_trace(args.trace, args.tracers)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        worse = compare(results, baseline, args.threshold)
+        for path, old, new in worse:
+            sys.stderr.write('regression: %s %g -> %g\n'%(path, old, new))
+        if worse:
+            exit(1)
+
+if __name__ == '__main__':
+    benchmark()
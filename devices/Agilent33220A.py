@@ -1,14 +1,74 @@
 """Abstracts the Agilent Function Generator 33220A, pyVISA-based
 
+Devices at raw socket addresses ('TCPIP::host::5025::SOCKET') are talked to
+over TCP directly, see devices.sockethelper; pyVISA is then not imported.
+
 Warning: voltage/offset range is set as for 50 Ohm output load!
 
+The state of the instrument (frequency, amplitude, offset, output)
+is cached in the driver. Setting a value writes it through to the instrument
+unless the formatted value is the same as the cached one, reading a value
+does not query the instrument. The cache is re-read from the instrument
+on connect(), on refresh(), and every syncinterval seconds if that is set.
+
+Transfers to the instrument are timed if a Tracer from devices.instrumentation
+is assigned to the tracer attribute.
+
+Frequency ramps can be performed by the sweep engine of the instrument
+(sweep()), with no communication during the ramp.
+Arbitrary waveforms are uploaded from NumPy arrays as binary blocks
+(upload()). Pulses are bursts of cycles counted by the instrument (pulse()).
+
+Commands can be checked for errors with no round trip of their own
+(check() and errors(), see devices.errorqueue); the checks are pipelined
+with the commands over raw sockets.
+
 """
+import time
+from collections import deque
+
+from sockethelper import is_socket_address, SocketInstrument, get_sockets
+from transaction import Transaction, CommandQueue
+from binblock import binblock, waveform_codes
+from pulse import PulseResult, timed_pulse, BURST
+from errorqueue import parse_error, CheckedError, NOERROR, QUEUESIZE
 
-from visahelper import get_devices, instrument
+# queries and conversions for the cached state
+QUERIES = {'freq':("FREQ?", float),
+           'ampl':("VOLT?", float),
+           'offset':("VOLT:OFFS?", float),
+           'output':("OUTP?", int),
+           'sweep':("SWE:STAT?", int),
+           'mode':("FUNC?", str.strip),
+           'trigger':("TRIG:SOUR?", str.strip),
+           }
+SWEEPSPACINGS = ('LIN', 'LOG')
+# waveforms with no cycles to count in a burst
+NOBURSTMODES = ('DC', 'NOIS')
+# time to wait for a burst beyond its length, s
+BURSTMARGIN = 0.01
+# completion and the first error of the commands before it
+CHECKQUERY = "*OPC?;:SYST:ERR?"
+
+def get_devices():
+    """VISA devices and socket addresses configured in the environment"""
+    from visahelper import get_devices
+    return get_devices() + get_sockets()
+
+def instrument(devname):
+    """Instrument at the address, VISA or raw socket"""
+    if is_socket_address(devname):
+        return SocketInstrument(devname)
+    from visahelper import instrument
+    return instrument(devname)
 
 class Agilent33220A(object):
-    """Represents an Agilent 33220A function generator"""
-    def __init__(self, devname):
+    """Represents an Agilent 33220A function generator
+    
+    syncinterval - period to re-read the cached state from the instrument, s;
+        None (default) reads it only on connect() and refresh()
+    """
+    def __init__(self, devname, syncinterval=None):
         try:
             self.dev = instrument(devname)
         except:
@@ -21,14 +81,166 @@ class Agilent33220A(object):
         self.ampldigits = 4
         self.amplacc = "%%.%if"%self.ampldigits
         self.offsetacc = "%%.%if"%self.ampldigits
+        self.syncinterval = syncinterval
+        self.cache = {}
+        self.synctime = 0
+        self.queue = CommandQueue()
+        self.tracer = None
+        self.supports_sweep = True
+        self.sweeptimerange = (1e-3, 500) # s
+        self.arbpoints = (1, 65536)
+        self.arbmaxcode = 8191
+        self.burstcycles = (1, 50000)
+        # tags of checks sent, whose replies are not read yet,
+        # and of those queued in a transaction
+        self.checks = deque()
+        self.queuedchecks = []
+        self.checked = []
+    
+    def write(self, cmd):
+        """Send a command, or queue it if a transaction is open"""
+        if self.queue.active:
+            self.queue.commands.append(cmd)
+        else:
+            self._devwrite(cmd)
+    
+    def ask(self, query):
+        """Query the instrument, sending queued commands first"""
+        self._send(self.queue.take())
+        # replies of checks come first
+        self._collect()
+        if self.tracer is None:
+            return self.dev.ask(query)
+        return self.tracer.call('ask', query, self.dev.ask, query)
+    
+    def _devwrite(self, cmd):
+        if self.tracer is None:
+            self.dev.write(cmd)
+        else:
+            self.tracer.call('write', cmd, self.dev.write, cmd)
+    
+    def _devwrite_raw(self, data):
+        """Write binary data as is, a string or a bytearray"""
+        write = getattr(self.dev, 'write_raw', self.dev.write)
+        if not getattr(self.dev, 'buffers', False):
+            # pyVISA takes strings only
+            data = str(data)
+        if self.tracer is None:
+            write(data)
+        else:
+            self.tracer.call('write', data, write, data)
+    
+    def _devread(self):
+        if self.tracer is None:
+            return self.dev.read()
+        return self.tracer.call('read', '', self.dev.read)
+    
+    def _send(self, commands):
+        """Send commands as one compound command"""
+        if commands:
+            # common (*) commands are separated by ';' only, 
+            # others need ':' to start at the root of the command tree
+            cmd = commands[0]
+            for item in commands[1:]:
+                if item.startswith('*'):
+                    cmd += ';' + item
+                else:
+                    cmd += ';:' + item
+            checks, self.queuedchecks = self.queuedchecks, []
+            self._devwrite(cmd)
+            self.checks.extend(checks)
+    
+    def batch(self):
+        """Transaction sending all commands issued within as one write"""
+        return Transaction(self)
+    
+    def begin(self):
+        self.queue.begin()
+    
+    def commit(self):
+        self._send(self.queue.end())
+    
+    def rollback(self):
+        """Discard queued commands, forgetting the state they were to set"""
+        self.queue.rollback()
+        self.queuedchecks = []
+        self.cache = {}
+    
+    def _get_pipelined(self):
+        return getattr(self.dev, 'pipelined', False)
+    pipelined = property(_get_pipelined, None, None,
+        "Whether replies are queued by the transport, so checks are pipelined")
+    
+    def check(self, tag=None):
+        """Check the commands sent so far, and those of the transaction
+        
+        tag - what the errors of the commands are mapped to (a step index)
+        The check is sent along with the commands and its reply is read
+        by errors(), so it does not wait for the instrument.
+        In a transaction with no commands queued there is nothing to check.
+        """
+        if self.queue.active and not self.queue.commands:
+            return
+        if not self.pipelined:
+            # the error queue is read by errors()
+            self.checks.append(tag)
+        elif self.queue.active:
+            self.write(CHECKQUERY)
+            self.queuedchecks.append(tag)
+        else:
+            self._devwrite(CHECKQUERY)
+            self.checks.append(tag)
+    
+    def _collect(self):
+        """Read the replies of the checks sent, keeping the errors"""
+        if not self.pipelined:
+            return
+        while self.checks:
+            tag = self.checks.popleft()
+            # '1;<error>' - the reply of *OPC? comes first
+            reply = self._devread().partition(';')[2]
+            code, message = parse_error(reply)
+            if code != NOERROR:
+                self.checked.append(CheckedError(code, message, tag))
+    
+    def errors(self):
+        """Errors of the checked commands, as devices.errorqueue.CheckedError
+        
+        Reads the replies of the checks, and the error queue if needed:
+        always if the transport is not pipelined, and if a check found
+        an error (there may be more of them).
+        Errors left in the queue are mapped to all checks since
+        the previous call, or to the last check which found an error.
+        """
+        self._send(self.queue.take())
+        if self.pipelined:
+            self._collect()
+            found, self.checked = self.checked, []
+            if not found:
+                return found
+            first = last = found[-1].last
+        else:
+            found = []
+            tags = list(self.checks)
+            self.checks.clear()
+            first = tags[0] if tags else None
+            last = tags[-1] if tags else None
+        for i in range(QUEUESIZE):
+            code, message = parse_error(self.ask("SYST:ERR?"))
+            if code == NOERROR:
+                break
+            found.append(CheckedError(code, message, first, last))
+        return found
     
     def whoami(self):
-        return self.dev.ask("*IDN?")
+        return self.ask("*IDN?")
         
     def reset(self):
-        self.dev.write("*RST")
+        self.write("*RST")
+        self.cache = {}
         
     def close(self):
+        self.checks.clear()
         self.dev.close()
         
     def _get_modes(self):
@@ -36,18 +248,51 @@ class Agilent33220A(object):
     modes = property(_get_modes, None, None, "Supported output modes")
     
     def connect(self):
-        self.dev.write("SYST:COMM:RLST REM")
+        self.write("SYST:COMM:RLST REM")
+        self.refresh()
+    
+    def refresh(self):
+        """Re-read the cached state from the instrument"""
+        self.synctime = time.time()
+        self.cache = {}
+        for key in QUERIES:
+            self._query(key)
+    
+    def _query(self, key):
+        """Ask the instrument for a value and cache it"""
+        query, convert = QUERIES[key]
+        value = convert(self.ask(query))
+        self.cache[key] = value
+        return value
+    
+    def _read(self, key):
+        """Get a value from the cache, asking the instrument if needed"""
+        if self.syncinterval is not None:
+            if time.time() - self.synctime > self.syncinterval:
+                self.refresh()
+        try:
+            return self.cache[key]
+        except KeyError:
+            return self._query(key)
+    
+    def _changed(self, key, acc, valstr):
+        """Check if the formatted value differs from the cached one"""
+        return key not in self.cache or acc%self.cache[key] != valstr
     
     def disconnect(self):
-        self.dev.write("SYST:COMM:RLST LOC")
+        self.write("SYST:COMM:RLST LOC")
     
     def _set_output(self, value):
+        value = int(bool(value))
+        if self.cache.get('output') == value:
+            return
         if value:
-            self.dev.write("OUTP ON")
+            self.write("OUTP ON")
         else:
-            self.dev.write("OUTP OFF")
+            self.write("OUTP OFF")
+        self.cache['output'] = value
     def _get_output(self):
-        return int(self.dev.ask("OUTP?"))
+        return self._read('output')
     output = property(_get_output, _set_output, None, "State of the device output")
     
     def _clip_freq(self, f):
@@ -80,48 +325,201 @@ class Agilent33220A(object):
     def _set_freq(self, f):
         f = self._clip_freq(f)
         fstr = self.freqacc%f
-        self.dev.write("FREQ %s"%fstr)
+        if self._read('sweep'):
+            self.stop_sweep()
+        if self._changed('freq', self.freqacc, fstr):
+            self.write("FREQ %s"%fstr)
+            self.cache['freq'] = float(fstr)
     def _get_freq(self):
-        return float(self.dev.ask("FREQ?"))
+        return self._read('freq')
     freq = property(_get_freq, _set_freq, None, "Field frequency")
     
     def _set_ampl(self, u):
         u = self._clip_ampl(u)
         ustr = self.amplacc%u
-        self.dev.write("VOLT %s"%ustr)
+        if self._changed('ampl', self.amplacc, ustr):
+            self.write("VOLT %s"%ustr)
+            self.cache['ampl'] = float(ustr)
     def _get_ampl(self):
-        return float(self.dev.ask("VOLT?"))
+        return self._read('ampl')
     ampl = property(_get_ampl, _set_ampl, None, "Field amplitude")
 
     def _set_offset(self, offset):
         offset = self._clip_offset(offset)
         offsetstr = self.offsetacc%offset
-        self.dev.write("VOLT:OFFS %s"%offsetstr)
+        if self._changed('offset', self.offsetacc, offsetstr):
+            self.write("VOLT:OFFS %s"%offsetstr)
+            self.cache['offset'] = float(offsetstr)
     def _get_offset(self):
-        return float(self.dev.ask("VOLT:OFFS?"))
+        return self._read('offset')
     offset = property(_get_offset, _set_offset, None, "Field DC Offset")
     
     def apply(self, f, u=None, offset=None, mode='SIN'):
         if mode.upper() in self.modes:
             f = self._clip_freq(f)
-            cmd = mode.upper() + ' '+ self.freqacc%f
+            fstr = self.freqacc%f
+            ustr = offstr = None
             if u:
                 u = self._clip_ampl(u)
-                cmd += ', '
-                cmd += self.amplacc%u
+                ustr = self.amplacc%u
                 if offset:
                     offset = self._clip_offset(offset)
-                    cmd += ', '
-                    cmd += self.offsetacc%offset
-            self.dev.write("APPL:%s"%cmd)
+                    offstr = self.offsetacc%offset
+            self._apply(mode.upper(), fstr, ustr, offstr)
+    
+    def apply_formatted(self, fstr, ustr, mode='SIN'):
+        """Apply already clipped and formatted frequency and amplitude"""
+        self._apply(mode, fstr, ustr)
+    
+    def _apply(self, mode, fstr, ustr=None, offstr=None):
+        """Send APPLy command unless it changes nothing
         
+        Omitted amplitude and offset keep their present values, 
+        APPLy turns the output on.
+        """
+        changed = (self.cache.get('mode') != mode or 
+                   not self.cache.get('output') or
+                   self.cache.get('sweep', 1) or
+                   self._changed('freq', self.freqacc, fstr))
+        cmd = "APPL:%s %s"%(mode, fstr)
+        if ustr is not None:
+            changed = changed or self._changed('ampl', self.amplacc, ustr)
+            cmd += ', %s'%ustr
+            if offstr is not None:
+                changed = (changed or 
+                           self._changed('offset', self.offsetacc, offstr))
+                cmd += ', %s'%offstr
+        if not changed:
+            return
+        self.write(cmd)
+        self.cache['mode'] = mode
+        self.cache['output'] = 1
+        # APPLy also turns sweep off
+        self.cache['sweep'] = 0
+        self.cache['freq'] = float(fstr)
+        if ustr is not None:
+            self.cache['ampl'] = float(ustr)
+        if offstr is not None:
+            self.cache['offset'] = float(offstr)
+        
+    def sweep(self, fstart, fstop, duration, spacing='LIN', u=None):
+        """Sweep the frequency from fstart to fstop once, in duration s
+        
+        spacing - 'LIN' or 'LOG'
+        u - amplitude to sweep at, the present one by default
+        The sweep starts right away (or when a transaction is committed)
+        and turns the output on. Setting the frequency or applying values
+        turns the sweep off.
+        """
+        spacing = spacing.upper()
+        if spacing not in SWEEPSPACINGS:
+            raise ValueError('Unknown sweep spacing %s'%spacing)
+        tmin, tmax = self.sweeptimerange
+        if not tmin <= duration <= tmax:
+            raise ValueError('Sweep time must be within %g and %g s'%(
+                             tmin, tmax))
+        fstart = self.freqacc%self._clip_freq(fstart)
+        fstop = self.freqacc%self._clip_freq(fstop)
+        with self.batch():
+            if u is None:
+                self._apply('SIN', fstart)
+            else:
+                self._apply('SIN', fstart, self.amplacc%self._clip_ampl(u))
+            self.write("SWE:SPAC %s"%spacing)
+            self.write("SWE:TIME %.3f"%duration)
+            self.write("FREQ:STAR %s"%fstart)
+            self.write("FREQ:STOP %s"%fstop)
+            self.write("TRIG:SOUR BUS")
+            self.write("SWE:STAT ON")
+            self.write("*TRG")
+        self.cache['sweep'] = 1
+        self.cache['trigger'] = 'BUS'
+        # the frequency changes during the sweep
+        self.cache.pop('freq', None)
+    
+    def stop_sweep(self):
+        """Turn the sweep off"""
+        self.write("SWE:STAT OFF")
+        self.cache['sweep'] = 0
+        self.cache.pop('freq', None)
+    
+    def pulse(self, duration=None, ncycles=None):
+        """Apply the present waveform for duration s or for ncycles cycles
+        
+        The pulse is a triggered burst of whole cycles counted by 
+        the instrument, a duration is rounded to them. Pulses of waveforms
+        with no cycles (DC, noise) or of more cycles than a burst can have
+        are timed by the host instead (devices.pulse.timed_pulse).
+        Blocks until the pulse is over, the output is left off,
+        the burst mode off and the trigger source as it was.
+        Returns a devices.pulse.PulseResult.
+        """
+        if (duration is None) == (ncycles is None):
+            raise ValueError('Either duration or number of cycles must be given')
+        if self._read('sweep'):
+            self.stop_sweep()
+        f = self.freq
+        mode = self._read('mode')
+        trigger = self._read('trigger')
+        nmin, nmax = self.burstcycles
+        if ncycles is None:
+            ncycles = max(nmin, int(round(duration*f)))
+            if mode in NOBURSTMODES or ncycles > nmax:
+                return timed_pulse(self, duration)
+        elif mode in NOBURSTMODES:
+            raise ValueError('No cycles to count in %s mode'%mode)
+        elif not nmin <= ncycles <= nmax:
+            raise ValueError('Burst must have %i to %i cycles'%(nmin, nmax))
+        width = ncycles / f
+        if duration is None:
+            duration = width
+        self.output = False
+        with self.batch():
+            self.write("BURS:MODE TRIG")
+            self.write("BURS:NCYC %i"%ncycles)
+            self.write("TRIG:SOUR BUS")
+            self.write("BURS:STAT ON")
+            self.write("OUTP ON")
+            self.write("*TRG")
+        time.sleep(width + BURSTMARGIN)
+        # the output idles between bursts, turning the burst mode off 
+        # with the output on would start the continuous waveform
+        with self.batch():
+            self.write("OUTP OFF")
+            self.write("BURS:STAT OFF")
+            if trigger != 'BUS':
+                self.write("TRIG:SOUR %s"%trigger)
+        self.cache['trigger'] = trigger
+        return PulseResult(duration, width, method=BURST, ncycles=ncycles)
+    
+    def upload(self, wave):
+        """Load an arbitrary waveform into volatile memory and output it
+        
+        wave - NumPy array of 1 to 65536 points, either floats within -1..1
+            or integer DAC codes within -8191..8191
+        The waveform is sent as one binary block of little-endian integers.
+        Frequency and amplitude are kept; use apply() with mode='USER'
+        to change them, other modes switch back to a standard waveform.
+        """
+        codes = waveform_codes(wave, self.arbmaxcode)
+        nmin, nmax = self.arbpoints
+        if not nmin <= len(codes) <= nmax:
+            raise ValueError('Waveform must have %i to %i points'%(nmin, nmax))
+        # queued commands go first, binary data are written on their own
+        self._send(self.queue.take())
+        self._devwrite_raw(binblock(codes, '<i2',
+                                    "FORM:BORD SWAP;:DATA:DAC VOLATILE,"))
+        self.write("FUNC:USER VOLATILE")
+        self.write("FUNC USER")
+        self.cache['mode'] = 'USER'
+    
     def clear_display(self):
-        self.dev.write("DISP:TEXT:CLE")
+        self.write("DISP:TEXT:CLE")
     
     def set_display(self, *lines):
         if len(lines) == 1:
             text = lines[0]
         else:
             text = '\r'.join(lines)
-        self.dev.write("DISP:TEXT '%s'"%text)
+        self.write("DISP:TEXT '%s'"%text)
 
@@ -3,33 +3,62 @@
 Created on Thu Mar 29 12:01:38 2012
 
 @author: Pavlo Shchelokovskyy
-"""
 
-import time
-import serial
+Replies of the device are read up to their terminator as soon as they 
+arrive, either while waiting for them or by a background reader thread.
+The state of the device (frequency, amplitude, offset, output) is tracked
+locally, or read back from the device on every access in readback mode.
+"""
 
 from serialhelper import list_serial as get_devices
+from serialhelper import open_serial, LineReader
+from transaction import Transaction, CommandQueue
+from binblock import binblock, waveform_codes
+from pulse import timed_pulse
 
 class TtiTga1230(object):
     """Represents a TTI TGA1230 function generator
 
     May as well work for other devices of the same manufacturer.   
     """
-    def __init__(self, port, **kwargs):
-        """kwargs are for serial.Serial object"""
+    def __init__(self, port, readback=False, background=False, 
+                 replytimeout=1.0, **kwargs):
+        """kwargs are for serial.Serial object
+        
+        readback - query the device for its state instead of tracking it
+        background - read replies of the device in a background thread
+        replytimeout - time to wait for a reply, s
+        """
         self.portconfigs = kwargs
-        # these settings are needed for communication to work
-        self.portconfigs['xonxoff'] = True
+        # software flow control is needed for communication to work,
+        # unless hardware flow control is used (needed for upload())
+        self.portconfigs.setdefault('xonxoff', not kwargs.get('rtscts'))
+        # reads return as soon as data arrive, the timeout only limits 
+        # how long a read may block
+        self.portconfigs.setdefault('timeout', 0.1)
         
         self.port = port
         self.dev = None
+        self.reader = None
+        self.readback = readback
+        self.background = background
+        self.replytimeout = replytimeout
+        self.queue = CommandQueue()
+        # devices.instrumentation.Tracer timing the transfers, if set
+        self.tracer = None
+        # no sweep engine usable for protocols, ramps are done by the host
+        self.supports_sweep = False
         
         #these are the specs of TTI1230
         self.minampl = 5e-3
         self.maxampl = 20.0 # into 50 Ohm load
         self.ampldigits = 4
         self.freqdigits = 4 # worst case, for square, for others 7
+        self.freqacc = "%%.%if"%self.freqdigits
+        self.amplacc = "%%.%if"%self.ampldigits
         self.freqrange = (1e-3, 10e6) # for sine-like
+        self.arbpoints = (4, 65536)
+        self.arbmaxcode = 2047 # 12-bit
 #        self.freqrange = (1.0e-3, 15e6) # for square
 #        self.freqrange = (1.0e-3, 100e3) # for triangle, ramp and sin(x)/x        
 
@@ -59,16 +88,68 @@ class TtiTga1230(object):
     
     def connect(self):
         if not bool(self.dev):
-            self.dev = serial.Serial(self.port, **self.portconfigs)
+            self.dev = open_serial(self.port, **self.portconfigs)
+        if self.reader is None or self.reader.port is not self.dev:
+            self.reader = LineReader(self.dev, background=self.background)
           
     def write(self, string):
-        if bool(self.dev):
-            self.dev.write("%s\n"%string)
+        if self.queue.active:
+            self.queue.commands.append(string)
+        elif bool(self.dev):
+            self._devwrite("%s\n"%string)
+    
+    def batch(self):
+        """Transaction sending all commands issued within as one write"""
+        return Transaction(self)
+    
+    def begin(self):
+        self.queue.begin()
+    
+    def commit(self):
+        commands = self.queue.end()
+        if commands and bool(self.dev):
+            self._devwrite("".join(["%s\n"%cmd for cmd in commands]))
+    
+    def _devwrite(self, data):
+        if self.tracer is None:
+            self.dev.write(data)
+        else:
+            self.tracer.call('write', data, self.dev.write, data)
+    
+    def rollback(self):
+        self.queue.rollback()
+        
+    def query(self, cmd, timeout=None):
+        """Send a query and return the reply without terminator
         
-    def read(self):
+        Commands queued by an open transaction are sent along.
+        Waits for the reply at most timeout s (replytimeout by default),
+        raises IOError if it does not arrive.
+        """
+        if not bool(self.dev):
+            return None
+        if timeout is None:
+            timeout = self.replytimeout
+        data = "".join(["%s\n"%item for item in self.queue.take() + [cmd]])
+        self.reader.flush()
+        if self.tracer is None:
+            return self._ask(data, timeout)
+        return self.tracer.call('ask', data, self._ask, data, timeout)
+    
+    def _ask(self, data, timeout):
+        self.dev.write(data)
+        return self.reader.readline(timeout)
+        
+    def read(self, timeout=0):
+        """Next reply of the device, '' if none arrives within timeout s"""
         if bool(self.dev):
-            text = self.dev.read(self.dev.inWaiting())
-            return text.replace('\r\n', '')
+            try:
+                if self.tracer is None:
+                    return self.reader.readline(timeout)
+                return self.tracer.call('read', '', self.reader.readline, 
+                                        timeout)
+            except IOError:
+                return ''
         
     def disconnect(self):
         if bool(self.dev):
@@ -76,16 +157,23 @@ class TtiTga1230(object):
     
     def close(self):
         if bool(self.dev):
+            if self.reader is not None:
+                self.reader.stop()
+                self.reader = None
             self.dev.close()
             self.dev = None
         
     def whoami(self):
         """Internal device name"""
         if bool(self.dev):
-            self.write("*IDN?")
-            #pause needed for device to form response
-            time.sleep(0.06)
-            return self.read()
+            return self.query("*IDN?")
+    
+    def refresh(self):
+        """Read the state of the device into the locally tracked one"""
+        self.freqstate = float(self.query("WAVFREQ?"))
+        self.amplstate = float(self.query("AMPL?"))
+        self.offsetstate = float(self.query("DCOFFS?"))
+        self.outputstate = self.query("OUTPUT?").upper() == "ON"
     
     def set_display(self, *lines):
         """Dummy function, since device does not support it"""
@@ -109,6 +197,8 @@ class TtiTga1230(object):
             self.write("output OFF")
         self.outputstate = bool(value)
     def _get_output(self):
+        if self.readback:
+            self.outputstate = self.query("OUTPUT?").upper() == "ON"
         return self.outputstate
     output = property(_get_output, _set_output, None, "State of the device output")
     
@@ -117,6 +207,8 @@ class TtiTga1230(object):
         self.write("WAVFREQ %s"%f)
         self.freqstate = f
     def _get_freq(self):
+        if self.readback:
+            self.freqstate = float(self.query("WAVFREQ?"))
         return self.freqstate
     freq = property(_get_freq, _set_freq, None, "Field frequency")
     
@@ -125,14 +217,18 @@ class TtiTga1230(object):
         self.write("AMPL %s"%u)
         self.amplstate = u
     def _get_ampl(self):
+        if self.readback:
+            self.amplstate = float(self.query("AMPL?"))
         return self.amplstate
     ampl = property(_get_ampl, _set_ampl, None, "Field amplitude")
     
     def _set_offset(self, u):
-        u = self._set_offset(u)
+        u = self._clip_offset(u)
         self.write("DCOFFS %s"%u)
         self.offsetstate = u
     def _get_offset(self):
+        if self.readback:
+            self.offsetstate = float(self.query("DCOFFS?"))
         return self.offsetstate
     offset = property(_get_offset, _set_offset, None, "Field DC offset")
 
@@ -148,23 +244,69 @@ class TtiTga1230(object):
     def _clip_ampl(self, u):
         if u < self.minampl:
             return self.minampl
-        elif self.offset + u/2 > self.maxampl:
-            return 2*(self.maxampl - self.offset)
-        elif self.offset - u/2 < -self.maxampl:
-            return 2*(self.maxampl + self.offset)
+        elif self.offsetstate + u/2 > self.maxampl:
+            return 2*(self.maxampl - self.offsetstate)
+        elif self.offsetstate - u/2 < -self.maxampl:
+            return 2*(self.maxampl + self.offsetstate)
         else:
             return u
     
     def _clip_offset(self, offset):
-        if offset + self.ampl/2 > self.maxampl:
-            return self.maxampl - self.ampl/2
-        elif offset - self.ampl/2 < -self.maxampl:
-            return self.ampl/2 - self.maxampl
+        if offset + self.amplstate/2 > self.maxampl:
+            return self.maxampl - self.amplstate/2
+        elif offset - self.amplstate/2 < -self.maxampl:
+            return self.amplstate/2 - self.maxampl
         else:
             return offset
             
+    def upload(self, wave, name='PYFUNCGN'):
+        """Load an arbitrary waveform into the device and output it
+        
+        wave - NumPy array of 4 to 65536 points, either floats within -1..1
+            or integer codes within -2047..2047
+        name - name of the waveform in the device memory
+        The waveform is defined (ARBDEF), sent as one binary block 
+        of big-endian integers (ARBDATA) and selected for output (MODE ARB).
+        Needs hardware flow control (port opened with rtscts=True),
+        as binary data may contain XON/XOFF characters.
+        """
+        codes = waveform_codes(wave, self.arbmaxcode)
+        nmin, nmax = self.arbpoints
+        if not nmin <= len(codes) <= nmax:
+            raise ValueError('Waveform must have %i to %i points'%(nmin, nmax))
+        message = binblock(codes, '>i2', "ARBDATA %s,"%name, "\n")
+        if self.portconfigs.get('xonxoff') and ('\x11' in message or 
+                                                '\x13' in message):
+            raise IOError('Waveform data conflict with XON/XOFF flow control,'
+                          ' open the port with rtscts=True')
+        if not bool(self.dev):
+            return
+        # the block is written on its own, not joined with other commands
+        commands = self.queue.take() + ["ARBDEF %s,%i"%(name, len(codes))]
+        self._devwrite("".join(["%s\n"%cmd for cmd in commands]))
+        self._devwrite(message)
+        self.write("ARB %s"%name)
+        self.mode = "ARB"
+    
+    def pulse(self, duration):
+        """Apply the present waveform for duration s, timed by the host
+        
+        Blocks until the pulse is over, the output is left off.
+        Returns a devices.pulse.PulseResult with the measured length.
+        """
+        return timed_pulse(self, duration)
+    
     def apply(self, f, u):
-        self.freq = f
-        self.ampl = u
+        with self.batch():
+            self.freq = f
+            self.ampl = u
+    
+    def apply_formatted(self, fstr, ustr):
+        """Apply already clipped and formatted frequency and amplitude"""
+        with self.batch():
+            self.write("WAVFREQ %s"%fstr)
+            self.write("AMPL %s"%ustr)
+        self.freqstate = float(fstr)
+        self.amplstate = float(ustr)
     
     
\ No newline at end of file
@@ -1,5 +1,20 @@
 """Devices supported by pyFuncGen project.
 
+Drivers are registered here by name, with the class implementing them
+and their capabilities. A driver and its transport library (pyVISA, 
+pySerial) are imported only when a device of that type is used, 
+so listing the drivers and their capabilities costs nothing::
+
+    from devices import get_driver
+    driver = get_driver('Agilent33220A')
+    driver.freqrange, driver.modes, driver.display  # nothing imported yet
+    devclass = driver.load()    # imports the driver module and pyVISA
+    addresses = driver.get_devices()
+
+Import times of drivers and other startup phases are recorded, 
+see startup_report(); the programs print it when the PYFUNCGEN_TIMING
+environment variable is set.
+
 Extending
 =========
 
@@ -7,7 +22,9 @@ It should be fairly possible to add support to other devices approximately
 as follows:
 
 - create a Python module in this package named as your device, 
-  and add this name to the ``implemented`` list inside this very file.
+  and register it with ``register()`` at the bottom of this very file,
+  giving its capabilities (they must match those of the class;
+  ``DriverInfo.check()`` compares them with an instance).
 - your new device module must expose for import:
   
   - a function ``get_devices``, that must return the list of available possibly 
@@ -19,7 +36,155 @@ as follows:
     attributes and methods that need to be iplemented.
 
 """
+import os
+from timeit import default_timer as timer
+
+VISA = 'visa'
+SERIAL = 'serial'
+TIMINGVAR = 'PYFUNCGEN_TIMING'
+
+_started = timer()
+timings = []
+
+
+def record(what, seconds):
+    """Record the duration of a startup phase"""
+    timings.append((what, seconds))
+
+
+def mark(what):
+    """Record the time from the first import of this package until now"""
+    record(what, timer() - _started)
+
+
+def startup_report():
+    """Recorded startup timings, one per line"""
+    return '\n'.join(['%-40s %8.1f ms'%(what, seconds*1e3) 
+                      for what, seconds in timings])
+
+
+def report_startup(what='ready'):
+    """Mark the end of startup and print the timings if asked for"""
+    mark(what)
+    if os.environ.get(TIMINGVAR):
+        print startup_report()
+
+
+class DriverInfo(object):
+    """Registered driver, imported only when loaded
+    
+    name - name of the driver, the same as of its module and class
+    transport - VISA or SERIAL
+    idn - part of the model name the devices report to *IDN?
+    display - whether the device has a display to show protocol progress
+    sweep - whether frequency ramps can be done by the device (sweep())
+    arb - range of the number of points of arbitrary waveforms the device
+        accepts (upload()), None if it does not
+    burst - whether pulses are bursts counted by the device (pulse()),
+        rather than timed by the host
+    freqrange, minampl, maxampl, freqdigits, ampldigits, modes - 
+        as the attributes of the driver class
+    """
+    def __init__(self, name, transport, idn, freqrange, minampl, maxampl, 
+                 freqdigits, ampldigits, modes, display, sweep, arb=None,
+                 burst=False):
+        self.name = name
+        self.transport = transport
+        self.idn = idn
+        self.freqrange = freqrange
+        self.minampl = minampl
+        self.maxampl = maxampl
+        self.freqdigits = freqdigits
+        self.ampldigits = ampldigits
+        self.modes = modes
+        self.display = display
+        self.sweep = sweep
+        self.arb = arb
+        self.burst = burst
+        self.module = None
+    
+    def _import(self):
+        if self.module is None:
+            start = timer()
+            self.module = __import__('devices.%s'%self.name, 
+                                     fromlist=[self.name])
+            record('import %s'%self.name, timer() - start)
+        return self.module
+    
+    def load(self):
+        """Import the driver, return its class"""
+        return getattr(self._import(), self.name)
+    
+    def get_devices(self):
+        """Addresses of available devices, imports the driver"""
+        return self._import().get_devices()
+    
+    def mismatches(self, fg):
+        """Registered capabilities differing from those of a driver instance
+        
+        Returns a list of (name, registered, actual). The display cannot
+        be told from the driver (set_display may be a dummy) and is skipped.
+        """
+        actual = [('freqrange', tuple(fg.freqrange)), 
+                  ('minampl', fg.minampl), ('maxampl', fg.maxampl),
+                  ('freqdigits', fg.freqdigits), 
+                  ('ampldigits', fg.ampldigits),
+                  ('modes', list(fg.modes)),
+                  ('sweep', bool(getattr(fg, 'supports_sweep', False))),
+                  ('arb', getattr(fg, 'arbpoints', None)),
+                  ('burst', hasattr(fg, 'burstcycles'))]
+        registered = dict(vars(self))
+        registered['freqrange'] = tuple(self.freqrange)
+        registered['modes'] = list(self.modes)
+        return [(name, registered[name], value) for name, value in actual
+                if registered[name] != value]
+    
+    def check(self, fg):
+        """Raise ValueError if the registered capabilities are not those
+        of the driver instance fg"""
+        mismatches = self.mismatches(fg)
+        if mismatches:
+            raise ValueError('Capabilities of %s registered wrong: %s'%(
+                self.name, ', '.join(['%s is %r, not %r'%item 
+                                      for item in mismatches])))
+    
+    def __str__(self):
+        return self.name
+
+
+_drivers = []
+implemented = []
+
+
+def register(name, **capabilities):
+    """Register a driver by name with its capabilities (see DriverInfo)"""
+    _drivers.append(DriverInfo(name, **capabilities))
+    implemented.append(name)
+
+
+def drivers():
+    """Registered drivers"""
+    return list(_drivers)
+
+
+def get_driver(name):
+    """Registered driver of the given name, raises KeyError if none"""
+    for info in _drivers:
+        if info.name == name:
+            return info
+    raise KeyError('No driver %s registered'%name)
+
 
-implemented = ['Agilent33220A', 
-               'TtiTga1230',
-               ]
\ No newline at end of file
+register('Agilent33220A', transport=VISA, idn='33220A',
+         freqrange=(1.0e-6, 2.0e7), minampl=1.e-2, maxampl=5,
+         freqdigits=6, ampldigits=4,
+         modes=['SIN', 'SQU', 'RAMP', 'DC', 'NOIS', 'PULS', 'USER'],
+         display=True, sweep=True, arb=(1, 65536),
+         burst=True)
+register('TtiTga1230', transport=SERIAL, idn='TGA12',
+         freqrange=(1e-3, 10e6), minampl=5e-3, maxampl=20.0,
+         freqdigits=4, ampldigits=4,
+         modes=['SINE', 'SQUARE', 'TRIANG', 'DC', 
+                'POSRMP', 'NEGRMP', 'COSINE', 'HAVSIN', 
+                'HAVCOS', 'SINC', 'PULSE', 'PULSTRN', 'ARB', 'SEQ'],
+         display=False, sweep=False, arb=(4, 65536))
\ No newline at end of file
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""IEEE-488.2 definite length arbitrary blocks for binary data transfer.
+
+A block is '#', the number of digits of the length, the length in bytes
+and the data, e.g. '#15hello'. Waveforms are sent as blocks of integers
+taken straight from NumPy arrays, with no formatting of single samples.
+The message carrying a block is allocated once and the samples are
+converted right into it, so it is not copied again on its way to
+a transport which takes buffers (devices.sockethelper, pySerial).
+
+"""
+
+
+def block_header(nbytes):
+    """Header of a block of nbytes"""
+    length = '%i'%nbytes
+    if len(length) > 9:
+        raise ValueError('Block of %i bytes is too long'%nbytes)
+    return '#%i%s'%(len(length), length)
+
+
+def binblock(codes, dtype, prefix='', suffix=''):
+    """Message with a block of the values of an integer array, a bytearray
+
+    dtype sets the size and byte order of samples, e.g. '<i2'.
+    prefix and suffix - text before and after the block in the message,
+        e.g. the command taking the block and the terminator
+    """
+    import numpy
+    codes = numpy.asarray(codes)
+    nbytes = len(codes)*numpy.dtype(dtype).itemsize
+    head = prefix + block_header(nbytes)
+    message = bytearray(len(head) + nbytes + len(suffix))
+    message[:len(head)] = head
+    numpy.frombuffer(message, dtype, len(codes), len(head))[:] = codes
+    message[len(head) + nbytes:] = suffix
+    return message
+
+
+def block_end(text, start):
+    """Index after the end of the block starting at text[start] ('#')
+
+    Raises ValueError if text does not contain the whole block.
+    """
+    try:
+        ndigits = int(text[start + 1])
+        if ndigits == 0:
+            raise ValueError('Indefinite length blocks are not supported')
+        nbytes = int(text[start + 2:start + 2 + ndigits])
+    except (IndexError, ValueError):
+        raise ValueError('Malformed block header')
+    end = start + 2 + ndigits + nbytes
+    if end > len(text):
+        raise ValueError('Incomplete block')
+    return end
+
+
+def parse_binblock(text, start=0):
+    """Data of the block starting at text[start]"""
+    ndigits = int(text[start + 1])
+    return text[start + 2 + ndigits:block_end(text, start)]
+
+
+def waveform_codes(wave, maxcode):
+    """Integer DAC codes of a waveform
+
+    wave - NumPy array (or sequence) of floats within -1..1, scaled to
+        -maxcode..maxcode, or of integers taken as codes
+    Raises ValueError if values are out of range.
+    """
+    import numpy
+    wave = numpy.asarray(wave)
+    if wave.ndim != 1:
+        raise ValueError('Waveform must be one-dimensional')
+    if wave.dtype.kind == 'f':
+        if len(wave) and abs(wave).max() > 1:
+            raise ValueError('Waveform values must be within -1..1')
+        return numpy.rint(wave*maxcode).astype(numpy.int16)
+    if wave.dtype.kind not in 'iu':
+        raise ValueError('Waveform must be of floats or integers')
+    if len(wave) and abs(wave).max() > maxcode:
+        raise ValueError('Waveform codes must be within %i..%i'%(
+                         -maxcode, maxcode))
+    return wave
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Discovery and identification of connected function generators.
+
+VISA resources and serial ports are enumerated in parallel,
+and every device found is asked for its identity (*IDN?) concurrently,
+with a short timeout, so that a silent port does not hold up the others.
+Results are cached for ttl seconds, so repeated calls cost nothing.
+
+Usage:
+    from devices.discovery import discovery, VISA
+    discovery.addresses([VISA])      # as fast as the enumeration
+    for info in discovery.devices():
+        print info                  # e.g. "GPIB0::10 (Agilent 33220A)"
+
+Transport libraries are imported only when their devices are looked for.
+
+"""
+import threading
+import time
+
+from devices import VISA, SERIAL, drivers
+
+TRANSPORTS = (VISA, SERIAL)
+TTL = 30.0 # s
+PROBETIMEOUT = 0.5 # s
+
+
+def list_visa():
+    from visahelper import get_devices
+    from sockethelper import get_sockets
+    return get_devices() + get_sockets()
+
+
+def list_ports():
+    from serialhelper import list_serial
+    return list_serial()
+
+
+def probe_visa(address, timeout):
+    """Identity of the VISA (or raw socket) instrument"""
+    from sockethelper import is_socket_address, SocketInstrument
+    if is_socket_address(address):
+        dev = SocketInstrument(address, timeout=timeout)
+    else:
+        from visahelper import instrument
+        dev = instrument(address, timeout=timeout)
+    try:
+        return dev.ask('*IDN?').strip()
+    finally:
+        dev.close()
+
+
+def probe_serial(address, timeout):
+    """Identity of the device on the serial port"""
+    from serialhelper import open_serial, LineReader
+    port = open_serial(address, timeout=min(timeout, 0.1), xonxoff=True)
+    try:
+        port.write('*IDN?\n')
+        return LineReader(port).readline(timeout).strip()
+    finally:
+        port.close()
+
+
+ENUMERATORS = {VISA:list_visa, SERIAL:list_ports}
+PROBES = {VISA:probe_visa, SERIAL:probe_serial}
+
+
+def run_parallel(jobs, timeout=None):
+    """Call functions in parallel, return results by key
+
+    jobs is a dict of {key: (function, args)}. Results of functions
+    which raised or did not finish within timeout s are missing.
+    """
+    results = {}
+    def run(key, func, args):
+        try:
+            results[key] = func(*args)
+        except Exception:
+            pass
+    threads = []
+    for key, (func, args) in jobs.items():
+        thread = threading.Thread(target=run, args=(key, func, args),
+                                  name='discovery of %s'%(key,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    for thread in threads:
+        if deadline is None:
+            thread.join()
+        else:
+            thread.join(max(0, deadline - time.time()))
+    return dict(results)
+
+
+class DeviceInfo(object):
+    """Device found at an address, with its identity if known"""
+    def __init__(self, address, transport, idn=None):
+        self.address = address
+        self.transport = transport
+        self.idn = idn
+
+    def _get_model(self):
+        if not self.idn:
+            return None
+        fields = [item.strip() for item in self.idn.split(',')]
+        return ' '.join(fields[:2])
+    model = property(_get_model, None, None, "Maker and model, if identified")
+
+    def _get_driver(self):
+        model = self.model
+        if model is None:
+            return None
+        for driver in drivers():
+            if driver.idn in model.upper():
+                return driver.name
+    driver = property(_get_driver, None, None,
+                      "Name of the driver for the device, if supported")
+
+    def __str__(self):
+        if self.model:
+            return '%s (%s)'%(self.address, self.model)
+        return self.address
+
+
+class Discovery(object):
+    """Cached enumeration and identification of devices
+
+    ttl - time to keep the results, s
+    timeout - time to wait for the identity of a device, s
+    """
+    def __init__(self, ttl=TTL, timeout=PROBETIMEOUT):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.found = {}
+        self.idns = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """Forget everything, the next call looks for devices again"""
+        with self.lock:
+            self.found = {}
+            self.idns = {}
+
+    def _fresh(self, cache, key):
+        return key in cache and time.time() - cache[key][0] < self.ttl
+
+    def addresses(self, transports=TRANSPORTS, refresh=False):
+        """Addresses of devices, without identification"""
+        return [info.address for info in self.devices(transports, refresh,
+                                                      probe=False)]
+
+    def devices(self, transports=TRANSPORTS, refresh=False, probe=True,
+                exclude=()):
+        """Devices found with the given transports, as DeviceInfo
+
+        refresh - look for devices and identify them again,
+            even if cached results are not yet expired
+        probe - identify the devices which were not yet identified
+        exclude - addresses not to probe (e.g. those already in use)
+        """
+        if refresh:
+            self.invalidate()
+        with self.lock:
+            jobs = dict((transport, (ENUMERATORS[transport], ()))
+                        for transport in transports
+                        if not self._fresh(self.found, transport))
+        if jobs:
+            found = run_parallel(jobs)
+            now = time.time()
+            with self.lock:
+                for transport in jobs:
+                    self.found[transport] = (now, found.get(transport, []))
+        with self.lock:
+            devices = [DeviceInfo(address, transport)
+                       for transport in transports
+                       for address in self.found[transport][1]]
+            jobs = {}
+            if probe:
+                for info in devices:
+                    if (info.address not in exclude and
+                        not self._fresh(self.idns, info.address)):
+                        jobs[info.address] = (PROBES[info.transport],
+                                              (info.address, self.timeout))
+        if jobs:
+            idns = run_parallel(jobs, self.timeout)
+            now = time.time()
+            with self.lock:
+                for address in jobs:
+                    self.idns[address] = (now, idns.get(address))
+        with self.lock:
+            for info in devices:
+                if info.address in self.idns:
+                    info.idn = self.idns[info.address][1]
+        return devices
+
+
+# shared by all users, so that the cache is common
+discovery = Discovery()
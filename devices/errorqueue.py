@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Errors reported by instruments in their SCPI error queue.
+
+Commands are checked without waiting for the instrument: a driver
+supporting checks sends "*OPC?;:SYST:ERR?" along with the commands
+of a step (check()), and reads the replies later, many at once
+(errors()). Every reply tells the first error of the commands before it,
+so the error is mapped to the step which caused it.
+Where the transport can not queue replies (e.g. VISA over GPIB),
+no query is sent with the commands; the error queue is read by errors()
+instead, and its errors are mapped to the steps checked since
+the previous call.
+
+"""
+
+NOERROR = 0
+QUEUESIZE = 20 # errors the instrument keeps
+
+
+def parse_error(reply):
+    """Code and message of an error queue entry like '-222,"Data out of range"'
+
+    Raises ValueError if the reply is not such an entry.
+    """
+    code, _, message = reply.strip().partition(',')
+    try:
+        code = int(code)
+    except ValueError:
+        raise ValueError('Not an error queue entry: %r'%reply)
+    return code, message.strip().strip('"')
+
+
+class CheckedError(object):
+    """Error of checked commands
+
+    code, message - as reported by the instrument
+    first, last - tags (step indexes) of the checks the error may belong to,
+        the same when it is known which one caused it
+    """
+    def __init__(self, code, message, first, last=None):
+        self.code = code
+        self.message = message
+        self.first = first
+        if last is None:
+            last = first
+        self.last = last
+
+    def __str__(self):
+        if self.first == self.last:
+            where = 'step %s'%self.first
+        else:
+            where = 'steps %s-%s'%(self.first, self.last)
+        return 'Error %i "%s" at %s'%(self.code, self.message, where)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Timing of the communication with a device.
+
+A Tracer assigned to the tracer attribute of a driver times every
+transfer to the instrument (writes, queries and reads), keeping
+latency histograms, counts and bytes for every type of command,
+and a timestamped trace of the latest transfers.
+Drivers check their tracer for None before every transfer only,
+so there is no other cost when tracing is off.
+
+Usage:
+    fg.tracer = Tracer('generator')
+    ...
+    print fg.tracer.report()
+    write_trace('run.json', [fg.tracer])
+
+The trace is written in Chrome trace format (open it in chrome://tracing
+or https://ui.perfetto.dev) if the file name ends with .json,
+and as JSON lines otherwise.
+
+"""
+from __future__ import division
+import json
+import threading
+from bisect import bisect_left
+from collections import deque
+from timeit import default_timer as timer
+
+from binblock import block_end
+
+# upper limits of histogram bins, s; slower transfers fall into the last bin
+BINS = [1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3,
+        1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+MAXEVENTS = 100000
+
+
+def command_type(text):
+    """Headers of the commands in a compound command, e.g. 'APPL:SIN;DISP:TEXT'
+
+    '-' for transfers without command (reading a reply).
+    """
+    headers = []
+    for line in text.replace('\n', ';').split(';'):
+        header = line.strip().split(' ', 1)[0].lstrip(':').upper()
+        if header and header not in headers:
+            headers.append(header)
+    return ';'.join(headers) or '-'
+
+
+class TransferStats(object):
+    """Number, bytes and latency histogram of one type of transfers"""
+    def __init__(self):
+        self.count = 0
+        self.nbytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0]*(len(BINS) + 1)
+
+    def add(self, duration, nbytes):
+        self.count += 1
+        self.nbytes += nbytes
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.histogram[bisect_left(BINS, duration)] += 1
+
+    def _get_mean(self):
+        if self.count:
+            return self.total / self.count
+        return 0.0
+    mean = property(_get_mean, None, None, "Mean latency, s")
+
+    def percentile(self, p):
+        """Upper limit of the histogram bin containing the p-th fraction"""
+        limit = p*self.count
+        done = 0
+        for i, n in enumerate(self.histogram):
+            done += n
+            if done >= limit and n:
+                if i < len(BINS):
+                    return BINS[i]
+                return self.max
+        return 0.0
+
+    def as_dict(self):
+        return {'count':self.count,
+                'bytes':self.nbytes,
+                'mean':self.mean,
+                'p95':self.percentile(0.95),
+                'max':self.max,
+                'histogram':dict(('<%g'%limit, n) for limit, n
+                                 in zip(BINS + [float('inf')], self.histogram)
+                                 if n),
+                }
+
+
+class Tracer(object):
+    """Recorder of transfers to one device
+
+    Keeps statistics of all transfers by operation ('write', 'ask', 'read')
+    and type of command, and the trace of the latest maxevents transfers.
+    May be shared by threads.
+    """
+    def __init__(self, name='device', maxevents=MAXEVENTS):
+        self.name = name
+        self.stats = {}
+        self.events = deque(maxlen=maxevents)
+        self.lock = threading.Lock()
+
+    def call(self, op, text, func, *args):
+        """Perform func(*args), recording it as a transfer of the text"""
+        start = timer()
+        reply = None
+        try:
+            reply = func(*args)
+            return reply
+        finally:
+            nbytes = len(text)
+            if isinstance(reply, basestring):
+                nbytes += len(reply)
+            self.record(op, text, start, timer() - start, nbytes)
+
+    def record(self, op, text, start, duration, nbytes):
+        """Record a transfer which took duration s starting at start"""
+        i = text.find('#')
+        if i >= 0 and text[i + 1:i + 2].isdigit():
+            # binary block, only its size is recorded
+            try:
+                end = block_end(text, i)
+            except ValueError:
+                end = len(text)
+            text = '%s#<%i bytes>%s'%(text[:i], end - i, text[end:])
+        key = (op, command_type(text))
+        with self.lock:
+            try:
+                stats = self.stats[key]
+            except KeyError:
+                stats = self.stats[key] = TransferStats()
+            stats.add(duration, nbytes)
+            self.events.append((start, duration, op, text, nbytes))
+
+    def clear(self):
+        with self.lock:
+            self.stats = {}
+            self.events.clear()
+
+    def summary(self):
+        """Statistics as a dict of {operation: {command type: dict}}"""
+        summary = {}
+        with self.lock:
+            for (op, kind), stats in self.stats.items():
+                summary.setdefault(op, {})[kind] = stats.as_dict()
+        return summary
+
+    def report(self):
+        """Statistics as a table for printing"""
+        lines = ['%s:'%self.name,
+                 '%-6s %-24s %7s %9s %9s %9s %9s'%('op', 'command', 'count',
+                 'mean, ms', 'p95, ms', 'max, ms', 'bytes')]
+        with self.lock:
+            items = sorted(self.stats.items())
+        for (op, kind), stats in items:
+            lines.append('%-6s %-24s %7i %9.2f %9.2f %9.2f %9i'%(op, kind[:24],
+                         stats.count, stats.mean*1e3,
+                         stats.percentile(0.95)*1e3, stats.max*1e3,
+                         stats.nbytes))
+        return '\n'.join(lines)
+
+
+def write_trace(filename, tracers):
+    """Write the traces of several devices to one file
+
+    Chrome trace format for *.json files, JSON lines
+    (one transfer per line, times in s) for all others.
+    """
+    events = []
+    for tid, tracer in enumerate(tracers):
+        with tracer.lock:
+            events.extend((item, tid, tracer.name) for item in tracer.events)
+    events.sort()
+    t0 = events and events[0][0][0] or 0
+    with open(filename, 'w') as f:
+        if filename.lower().endswith('.json'):
+            trace = [{'name':'thread_name', 'ph':'M', 'pid':1, 'tid':tid,
+                      'args':{'name':tracer.name}}
+                     for tid, tracer in enumerate(tracers)]
+            for (start, duration, op, text, nbytes), tid, name in events:
+                trace.append({'name':command_type(text), 'cat':op, 'ph':'X',
+                              'pid':1, 'tid':tid,
+                              'ts':(start - t0)*1e6, 'dur':duration*1e6,
+                              'args':{'command':text, 'bytes':nbytes}})
+            json.dump({'traceEvents':trace, 'displayTimeUnit':'ms'}, f)
+        else:
+            for (start, duration, op, text, nbytes), tid, name in events:
+                f.write(json.dumps({'t':start - t0, 'duration':duration,
+                                    'device':name, 'op':op,
+                                    'command':text, 'bytes':nbytes}) + '\n')
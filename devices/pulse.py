@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Pulses of the field, applied by switching the output on for a while.
+
+Drivers of instruments with a burst mode produce pulses of a whole number
+of cycles in hardware, so their length does not depend on the host or on
+the communication. Others fall back on timed_pulse(), where the host
+switches the output on and off and measures how long the pulse was.
+Both return a PulseResult.
+
+"""
+from __future__ import division
+import time
+from timeit import default_timer as timer
+
+BURST = 'burst'
+HOST = 'host'
+
+
+class PulseResult(object):
+    """Length of a pulse, as requested and as produced
+
+    requested - length asked for, s
+    width - length of the pulse, s, estimated for host-timed pulses
+    uncertainty - how far the real length may be from the estimate, s
+    method - BURST or HOST
+    ncycles - number of cycles of a burst pulse
+    """
+    def __init__(self, requested, width, uncertainty=0.0, method=HOST,
+                 ncycles=None):
+        self.requested = requested
+        self.width = width
+        self.uncertainty = uncertainty
+        self.method = method
+        self.ncycles = ncycles
+
+    def _get_error(self):
+        return self.width - self.requested
+    error = property(_get_error, None, None,
+                     "Difference of the pulse length from the requested one, s")
+
+    def __str__(self):
+        if self.method == BURST:
+            return 'burst of %i cycles, %.3f ms (%+.3f ms)'%(self.ncycles,
+                   self.width*1e3, self.error*1e3)
+        return 'host-timed, %.1f ms (%+.1f +- %.1f ms)'%(self.width*1e3,
+               self.error*1e3, self.uncertainty*1e3)
+
+
+def timed_pulse(device, duration):
+    """Switch the output of the device on for duration s, timed by the host
+
+    Each switch is taken to happen halfway through its command,
+    the uncertainty of the length is half of the two command times.
+    Must not be called within a transaction.
+    """
+    device.output = False
+    start = timer()
+    device.output = True
+    on = timer()
+    # switching off takes about as long as switching on, so the command
+    # is started duration s after the previous one to end it in time
+    time.sleep(max(0, start + duration - timer()))
+    offstart = timer()
+    device.output = False
+    off = timer()
+    width = (offstart + off)/2 - (start + on)/2
+    uncertainty = ((on - start) + (off - offstart))/2
+    return PulseResult(duration, width, uncertainty)
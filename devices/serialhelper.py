@@ -5,11 +5,154 @@ Created on Sat Oct 06 22:37:19 2012
 @author: Pavlo Shchelokovskyy
 """
 
-from serial.tools.list_ports import comports
+import threading
+import time
+import Queue
+
+from simulator import SimulatedTGA1230, simulation_config
+
+SIMPORTS = ['SIM1', 'SIM2']
+FLUSHTIMEOUT = 2.0 # s, to wait for the reader thread to flush
+
+try:
+    if simulation_config() is not None:
+        raise ImportError('simulation forced')
+    import serial
+    from serial.tools.list_ports import comports
+except ImportError:
+    print "Warning! Using simulated devices instead of real serial ports."
+    serial = None
 
 def list_serial():
     """Return a list of available serial ports in the form suitable to pass to pyserial"""
+    if serial is None:
+        return list(SIMPORTS)
     seriallist = []
     for item in comports():
         seriallist.append(item[0])
     return seriallist
+
+def open_serial(port, **kwargs):
+    """Open a serial port, or a simulated device if serial is not available"""
+    if serial is None or port in SIMPORTS:
+        return SimulatedTGA1230(port, **kwargs)
+    return serial.Serial(port, **kwargs)
+
+
+class LineReader(object):
+    """Reads replies terminated by eol from a serial port
+    
+    The port must be opened with a (short) read timeout, so that reading
+    returns as soon as data arrive, but does not block forever.
+    With background=True a thread reads the port all the time
+    and queues complete replies (and flush() is handed over to it, so that
+    data it is reading are discarded too), otherwise the port is read only
+    while waiting for a reply. The latter returns replies sooner 
+    under Python 2, where waiting for a queue with timeout polls it.
+    """
+    def __init__(self, port, eol='\n', background=False):
+        self.port = port
+        self.eol = eol
+        self.buffer = ''
+        self.lines = None
+        self.thread = None
+        self.running = False
+        # events of flushes waiting for the background thread
+        self.flushes = []
+        self.lock = threading.Lock()
+        if background:
+            self.lines = Queue.Queue()
+            self.running = True
+            self.thread = threading.Thread(target=self._run, 
+                                           name='reader of %s'%port)
+            self.thread.daemon = True
+            self.thread.start()
+    
+    def _receive(self):
+        """Read what is available, or wait for one byte at most port timeout"""
+        self.buffer += self.port.read(max(1, self.port.inWaiting()))
+    
+    def _nextline(self):
+        """Take one complete reply from the buffer, None if there is none"""
+        if self.eol not in self.buffer:
+            return None
+        line, self.buffer = self.buffer.split(self.eol, 1)
+        return line.rstrip('\r')
+    
+    def _run(self):
+        while self.running:
+            try:
+                self._receive()
+            except Exception, err:
+                if not self.running or not self.port.isOpen():
+                    break
+                # a failed transfer is reported to the waiting reader
+                self.lines.put(err)
+                continue
+            line = self._nextline()
+            while line is not None:
+                self.lines.put(line)
+                line = self._nextline()
+            if self.flushes:
+                # what was read so far came before the flush
+                with self.lock:
+                    flushes, self.flushes = self.flushes, []
+                    self._flush()
+                for done in flushes:
+                    done.set()
+    
+    def readline(self, timeout):
+        """Next reply without terminator
+        
+        Raises IOError if no complete reply arrives within timeout s.
+        """
+        if self.thread is not None:
+            try:
+                line = self.lines.get(True, timeout)
+            except Queue.Empty:
+                raise IOError('Timeout waiting for reply')
+            if isinstance(line, Exception):
+                raise IOError('Reading from port failed: %s'%line)
+            return line
+        deadline = time.time() + timeout
+        line = self._nextline()
+        while line is None:
+            if time.time() >= deadline and not self.port.inWaiting():
+                raise IOError('Timeout waiting for reply')
+            self._receive()
+            line = self._nextline()
+        return line
+    
+    def flush(self):
+        """Discard replies received but not read yet, also partial ones
+        
+        The background thread, if any, flushes after its read going on,
+        within the port timeout.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            done = threading.Event()
+            with self.lock:
+                self.flushes.append(done)
+            if done.wait(FLUSHTIMEOUT):
+                return
+            with self.lock:
+                if done in self.flushes:
+                    self.flushes.remove(done)
+        with self.lock:
+            self._flush()
+    
+    def _flush(self):
+        self.buffer = ''
+        self.port.flushInput()
+        if self.lines is not None:
+            while True:
+                try:
+                    self.lines.get_nowait()
+                except Queue.Empty:
+                    break
+    
+    def stop(self):
+        """Stop the background thread (before closing the port)"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
@@ -0,0 +1,624 @@
+# -*- coding: utf-8 -*-
+"""Simulated function generators for development without hardware.
+
+SimulatedAgilent33220A stands in for a pyVISA instrument and
+SimulatedTGA1230 for a pySerial port. Both parse the commands used
+by the drivers of this package, keep the state of the instrument,
+enforce its limits and answer queries. Arbitrary waveforms sent
+as binary blocks are decoded and kept.
+Every command can be delayed by a configurable latency with random jitter
+and fail with a given probability, to test timing of protocols.
+
+Simulation is used when pyVISA/pySerial are not available, or when forced
+by the PYFUNCGEN_SIMULATE environment variable, which can also carry
+the settings of the latency model, e.g.
+    PYFUNCGEN_SIMULATE="latency=0.005,jitter=0.002,failrate=0.001,seed=1"
+(verbose=1 additionally prints every command).
+
+"""
+from __future__ import division
+import os
+import random
+import sys
+import threading
+import time
+from array import array
+
+from binblock import block_end, parse_binblock
+
+ENVVAR = 'PYFUNCGEN_SIMULATE'
+
+
+class SimulatedIOError(IOError):
+    """Communication failure injected by the latency model"""
+    pass
+
+
+class LatencyModel(object):
+    """Delays and failures of the communication with a simulated device
+
+    latency - mean delay of every command, s
+    jitter - standard deviation of the delay, s
+    failrate - probability of a command to fail
+
+    Transfers, the commands in them and their bytes are counted,
+    see reset_counters().
+    """
+    def __init__(self, latency=0.0, jitter=0.0, failrate=0.0, seed=None,
+                 verbose=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.failrate = failrate
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.transfers = 0
+        self.commands = 0
+        self.nbytes = 0
+
+    def transfer(self, name, text):
+        """Spend the time of one transfer, possibly failing it"""
+        if self.verbose:
+            print '%s - %s'%(name, text)
+        self.transfers += 1
+        if text != '<read>':
+            self.nbytes += len(text)
+            self.commands += len(_split_commands(text.replace('\n', ';')))
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.gauss(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.failrate and self.random.random() < self.failrate:
+            raise SimulatedIOError('simulated failure of %s on "%s"'
+                                   %(name, text))
+
+
+def simulation_config():
+    """Settings of simulation from the environment, None if not forced"""
+    value = os.environ.get(ENVVAR)
+    if value is None:
+        return None
+    config = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        key, val = [word.strip() for word in item.split('=', 1)]
+        if key in ('latency', 'jitter', 'failrate'):
+            config[key] = float(val)
+        elif key == 'seed':
+            config[key] = int(val)
+        elif key == 'verbose':
+            config[key] = val not in ('0', '')
+    return config
+
+
+def latency_model():
+    """Latency model configured by the environment"""
+    return LatencyModel(**(simulation_config() or {}))
+
+
+def _mnemonic(word, full):
+    """Check SCPI keyword against a mnemonic like 'FREQuency'"""
+    word = word.upper()
+    short = ''.join([char for char in full if not char.islower()])
+    return word == short or word == full.upper()
+
+
+def _split_commands(line, separator=';'):
+    """Split compound command, ignoring separators inside quotes"""
+    commands = []
+    current = ''
+    quote = None
+    for char in line:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == separator:
+            commands.append(current)
+            current = ''
+            continue
+        current += char
+    commands.append(current)
+    return [cmd.strip() for cmd in commands if cmd.strip()]
+
+
+def _find_block(text, start=0):
+    """Index of the first binary block in text, -1 if there is none"""
+    pos = text.find('#', start)
+    while pos >= 0 and not text[pos + 1:pos + 2].isdigit():
+        pos = text.find('#', pos + 1)
+    return pos
+
+
+def _split_block(text):
+    """Split text into the commands before a binary block and its data
+
+    The data are None if there is no block.
+    """
+    start = _find_block(text)
+    if start < 0:
+        return text, None
+    return text[:start], parse_binblock(text, start)
+
+
+def _decode_codes(data, littleendian):
+    """Codes of 16-bit integers in a block"""
+    codes = array('h', data)
+    if (sys.byteorder == 'little') != littleendian:
+        codes.byteswap()
+    return codes.tolist()
+
+
+def _clip(value, vmin, vmax):
+    return min(max(value, vmin), vmax)
+
+
+class SimulatedAgilent33220A(object):
+    """Simulated Agilent 33220A with pyVISA instrument interface
+
+    Out of range values are clipped and reported in the error queue,
+    as the real instrument does. Frequency sweeps are simulated
+    as taking place in real time, triggered bursts are recorded
+    in bursts as (time, number of cycles).
+    """
+    shapes = ['SINusoid', 'SQUare', 'RAMP', 'PULSe', 'NOISe', 'DC', 'USER']
+
+    def __init__(self, name, model=None):
+        self.name = name
+        if model is None:
+            model = latency_model()
+        self.model = model
+        self.freqrange = (1.0e-6, 2.0e7)
+        self.minampl = 1.e-2
+        self.maxampl = 5
+        self.reply = []
+        self.reset()
+
+    def reset(self):
+        self.shape = 'SIN'
+        self.freq = 1000.0
+        self.ampl = 0.1
+        self.offset = 0.0
+        self.output = 0
+        self.text = ''
+        self.remote = False
+        self.errors = []
+        self.sweepstate = 0
+        self.spacing = 'LIN'
+        self.sweeptime = 1.0
+        self.fstart = 100.0
+        self.fstop = 1000.0
+        self.trigsource = 'IMM'
+        self.sweepstarted = None
+        self.byteorder = 'NORM'
+        self.volatile = []
+        self.userwave = 'EXP_RISE'
+        self.burststate = 0
+        self.burstmode = 'TRIG'
+        self.ncycles = 1
+        self.bursts = []
+
+    def _sweepfreq(self):
+        """Frequency output by the sweep now"""
+        if self.sweepstarted is None:
+            return self.fstart
+        x = min(1.0, (time.time() - self.sweepstarted) / self.sweeptime)
+        if self.spacing == 'LOG':
+            return self.fstart * (self.fstop / self.fstart)**x
+        return self.fstart + (self.fstop - self.fstart)*x
+
+    def _error(self, code, mesg):
+        if len(self.errors) < 20:
+            self.errors.append('%+i,"%s"'%(code, mesg))
+
+    def _set_freq(self, value):
+        f = _clip(value, *self.freqrange)
+        if f != value:
+            self._error(-222, 'Data out of range;value clipped to upper limit')
+        self.freq = f
+
+    def _set_ampl(self, value):
+        umax = 2*(self.maxampl - abs(self.offset))
+        u = _clip(value, self.minampl, umax)
+        if u != value:
+            self._error(-222, 'Data out of range;value clipped to limit')
+        self.ampl = u
+
+    def _set_offset(self, value):
+        limit = self.maxampl - self.ampl/2
+        offset = _clip(value, -limit, limit)
+        if offset != value:
+            self._error(-222, 'Data out of range;value clipped to limit')
+        self.offset = offset
+
+    def _number(self, text):
+        try:
+            return float(text)
+        except ValueError:
+            self._error(-104, 'Data type error')
+            raise
+
+    def write(self, text):
+        self.model.transfer(self.name, text)
+        for cmd in _split_commands(text):
+            try:
+                self._command(cmd)
+            except ValueError:
+                pass
+
+    def write_raw(self, data):
+        """Write commands ending with a binary block"""
+        self.model.transfer(self.name, data)
+        text, block = _split_block(data)
+        commands = _split_commands(text)
+        for i, cmd in enumerate(commands):
+            try:
+                if i == len(commands) - 1:
+                    self._command(cmd, block)
+                else:
+                    self._command(cmd)
+            except ValueError:
+                pass
+
+    def _command(self, cmd, block=None):
+        """Perform one command (not compound), block is its binary data"""
+        header, _, params = cmd.lstrip(':').partition(' ')
+        params = [item.strip() for item in params.split(',') if item.strip()]
+        keys = header.split(':')
+        if header.endswith('?'):
+            self.reply.append(self._query(header[:-1].split(':')))
+        elif header.upper() == '*RST':
+            self.reset()
+        elif header.upper() in ('*CLS', '*OPC', '*WAI', '*TRG'):
+            if header.upper() == '*CLS':
+                self.errors = []
+            elif header.upper() == '*TRG' and self.trigsource == 'BUS':
+                if self.sweepstate:
+                    self.sweepstarted = time.time()
+                elif self.burststate and self.output:
+                    self.bursts.append((time.time(), self.ncycles))
+        elif _mnemonic(keys[0], 'APPLy') and len(keys) == 2:
+            for shape in self.shapes:
+                if _mnemonic(keys[1], shape):
+                    self.shape = ''.join([char for char in shape
+                                          if not char.islower()])
+                    break
+            else:
+                self._error(-113, 'Undefined header')
+                return
+            if params:
+                self._set_freq(self._number(params[0]))
+            if len(params) > 1:
+                self._set_ampl(self._number(params[1]))
+            if len(params) > 2:
+                self._set_offset(self._number(params[2]))
+            self.output = 1
+            self.sweepstate = 0
+            self.burststate = 0
+        elif _mnemonic(keys[0], 'FREQuency') and len(keys) == 1:
+            self._set_freq(self._number(params[0]))
+        elif _mnemonic(keys[0], 'FREQuency') and _mnemonic(keys[1], 'STARt'):
+            self.fstart = _clip(self._number(params[0]), *self.freqrange)
+        elif _mnemonic(keys[0], 'FREQuency') and _mnemonic(keys[1], 'STOP'):
+            self.fstop = _clip(self._number(params[0]), *self.freqrange)
+        elif _mnemonic(keys[0], 'SWEep') and len(keys) == 2:
+            if _mnemonic(keys[1], 'SPACing'):
+                self.spacing = params[0].upper()[:3]
+            elif _mnemonic(keys[1], 'TIME'):
+                self.sweeptime = _clip(self._number(params[0]), 1e-3, 500)
+            elif _mnemonic(keys[1], 'STATe'):
+                self.sweepstate = int(params[0].upper() in ('ON', '1'))
+                self.sweepstarted = None
+                if self.sweepstate:
+                    self.output = 1
+            else:
+                self._error(-113, 'Undefined header')
+        elif _mnemonic(keys[0], 'TRIGger') and len(keys) == 2:
+            self.trigsource = params[0].upper()[:3]
+        elif _mnemonic(keys[0], 'BURSt') and len(keys) == 2:
+            if _mnemonic(keys[1], 'MODE'):
+                self.burstmode = params[0].upper()[:4]
+            elif _mnemonic(keys[1], 'NCYCles'):
+                ncycles = int(self._number(params[0]))
+                self.ncycles = _clip(ncycles, 1, 50000)
+                if ncycles != self.ncycles:
+                    self._error(-222, 'Data out of range')
+            elif _mnemonic(keys[1], 'STATe'):
+                self.burststate = int(params[0].upper() in ('ON', '1'))
+                if self.burststate:
+                    self.sweepstate = 0
+            else:
+                self._error(-113, 'Undefined header')
+        elif _mnemonic(keys[0], 'FORMat') and len(keys) == 2:
+            self.byteorder = params[0].upper()[:4]
+        elif (_mnemonic(keys[0], 'DATA') and len(keys) == 2 and
+              _mnemonic(keys[1], 'DAC')):
+            if block is None:
+                codes = [int(self._number(item)) for item in params[1:]]
+            else:
+                codes = _decode_codes(block, self.byteorder == 'SWAP')
+            if not 1 <= len(codes) <= 65536:
+                self._error(-222, 'Data out of range')
+            elif max(abs(code) for code in codes) > 8191:
+                self._error(-222, 'Data out of range')
+            else:
+                self.volatile = codes
+        elif _mnemonic(keys[0], 'FUNCtion'):
+            if len(keys) == 2 and _mnemonic(keys[1], 'USER'):
+                if params[0].upper().startswith('VOL') and not self.volatile:
+                    self._error(-221, 'Settings conflict')
+                    return
+                self.userwave = params[0].upper()
+                return
+            for shape in self.shapes:
+                if _mnemonic(params[0], shape):
+                    self.shape = ''.join([char for char in shape
+                                          if not char.islower()])
+                    self.sweepstate = 0
+                    break
+            else:
+                self._error(-224, 'Illegal parameter value')
+        elif _mnemonic(keys[0], 'VOLTage'):
+            if len(keys) == 1:
+                self._set_ampl(self._number(params[0]))
+            elif _mnemonic(keys[1], 'OFFSet'):
+                self._set_offset(self._number(params[0]))
+            else:
+                self._error(-113, 'Undefined header')
+        elif _mnemonic(keys[0], 'OUTPut') and len(keys) == 1:
+            self.output = int(params[0].upper() in ('ON', '1'))
+        elif _mnemonic(keys[0], 'DISPlay') and len(keys) > 1:
+            if len(keys) == 3 and _mnemonic(keys[2], 'CLEar'):
+                self.text = ''
+            else:
+                self.text = ','.join(params).strip('\'"')
+        elif _mnemonic(keys[0], 'SYSTem') and len(keys) == 3:
+            self.remote = params[0].upper().startswith('REM')
+        else:
+            self._error(-113, 'Undefined header')
+
+    def _query(self, keys):
+        """Answer a query given as a list of keywords"""
+        key = keys[0].upper()
+        if key == '*IDN':
+            return 'Agilent Technologies,33220A,SIM%s,2.02-2.02-22-2'%(
+                abs(hash(self.name)) % 10000)
+        elif key == '*OPC':
+            return '1'
+        elif _mnemonic(keys[0], 'FREQuency'):
+            if self.sweepstate:
+                return '%+.15E'%self._sweepfreq()
+            return '%+.15E'%self.freq
+        elif _mnemonic(keys[0], 'SWEep'):
+            return '%i'%self.sweepstate
+        elif _mnemonic(keys[0], 'VOLTage'):
+            if len(keys) > 1:
+                return '%+.15E'%self.offset
+            return '%+.15E'%self.ampl
+        elif _mnemonic(keys[0], 'OUTPut'):
+            return '%i'%self.output
+        elif _mnemonic(keys[0], 'TRIGger'):
+            return self.trigsource
+        elif _mnemonic(keys[0], 'FUNCtion') and len(keys) == 1:
+            return self.shape
+        elif _mnemonic(keys[0], 'APPLy'):
+            return '"%s %+.15E,%+.15E,%+.15E"'%(self.shape, self.freq,
+                                                self.ampl, self.offset)
+        elif _mnemonic(keys[0], 'SYSTem') and _mnemonic(keys[-1], 'ERRor'):
+            if self.errors:
+                return self.errors.pop(0)
+            return '+0,"No error"'
+        self._error(-113, 'Undefined header')
+        return ''
+
+    def read(self):
+        if not self.reply:
+            raise SimulatedIOError('Timeout expired before operation completed')
+        self.model.transfer(self.name, '<read>')
+        reply = ';'.join(self.reply)
+        self.reply = []
+        return reply
+
+    def ask(self, text):
+        self.write(text)
+        return self.read()
+
+    def close(self):
+        pass
+
+
+class SimulatedTGA1230(object):
+    """Simulated TTI TGA1230 with pySerial port interface
+
+    Out of range values are clipped.
+    Reading waits for a reply up to timeout s (forever if None),
+    as a real port does; the port may be read from another thread.
+    """
+    modes = ['SINE', 'SQUARE', 'TRIANG', 'DC', 'POSRMP', 'NEGRMP', 'COSINE',
+             'HAVSIN', 'HAVCOS', 'SINC', 'PULSE', 'PULSTRN', 'ARB', 'SEQ']
+
+    def __init__(self, port, model=None, timeout=None, **kwargs):
+        self.port = port
+        if model is None:
+            model = latency_model()
+        self.model = model
+        self.timeout = timeout
+        self.freqrange = (1e-3, 10e6)
+        self.minampl = 5e-3
+        self.maxampl = 20.0
+        self.inbuffer = ''
+        self.outbuffer = ''
+        self.isopen = True
+        self.ready = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        self.mode = 'SINE'
+        self.freq = 10.0
+        self.ampl = 2.0
+        self.offset = 0.0
+        self.output = False
+        self.zload = '50'
+        self.remote = False
+        self.arbs = {}
+        self.arb = None
+
+    def _nextline(self):
+        """Take the next complete line from the input buffer
+
+        Binary blocks may contain newlines, the line ends after them.
+        None if there is no complete line yet.
+        """
+        pos = 0
+        while True:
+            eol = self.inbuffer.find('\n', pos)
+            start = _find_block(self.inbuffer, pos)
+            if eol < 0:
+                return None
+            if 0 <= start < eol:
+                try:
+                    pos = block_end(self.inbuffer, start)
+                except ValueError:
+                    return None
+                continue
+            line = self.inbuffer[:eol]
+            self.inbuffer = self.inbuffer[eol + 1:]
+            return line
+
+    def write(self, data):
+        # as pySerial, takes bytearrays too
+        data = str(data)
+        self.model.transfer(self.port, data.strip())
+        with self.ready:
+            self.inbuffer += data
+            line = self._nextline()
+            while line is not None:
+                text, block = _split_block(line)
+                commands = _split_commands(text)
+                for i, cmd in enumerate(commands):
+                    if i == len(commands) - 1:
+                        self._command(cmd, block)
+                    else:
+                        self._command(cmd)
+                line = self._nextline()
+            self.ready.notify_all()
+        return len(data)
+
+    def _command(self, cmd, block=None):
+        self.remote = True
+        header, _, param = cmd.partition(' ')
+        header = header.upper()
+        param = param.strip()
+        if header.endswith('?'):
+            self.outbuffer += self._query(header[:-1]) + '\r\n'
+            return
+        try:
+            if header == 'WAVFREQ':
+                self.freq = _clip(float(param), *self.freqrange)
+            elif header == 'AMPL':
+                umax = 2*(self.maxampl - abs(self.offset))
+                self.ampl = _clip(float(param), self.minampl, umax)
+            elif header == 'DCOFFS':
+                limit = self.maxampl - self.ampl/2
+                self.offset = _clip(float(param), -limit, limit)
+        except ValueError:
+            return
+        if header == 'OUTPUT':
+            self.output = param.upper() == 'ON'
+        elif header == 'MODE' and param.upper() in self.modes:
+            self.mode = param.upper()
+        elif header == 'ZLOAD':
+            self.zload = param.upper()
+        elif header == 'ARBDEF':
+            name, _, npoints = param.partition(',')
+            try:
+                npoints = int(npoints)
+            except ValueError:
+                return
+            if 4 <= npoints <= 65536:
+                self.arbs[name.strip().upper()] = [0]*npoints
+        elif header == 'ARBDATA' and block is not None:
+            name = param.rstrip(',').strip().upper()
+            codes = _decode_codes(block, False)
+            if (len(codes) == len(self.arbs.get(name, ())) and
+                max(abs(code) for code in codes) <= 2047):
+                self.arbs[name] = codes
+        elif header == 'ARB' and param.upper() in self.arbs:
+            self.arb = param.upper()
+        elif header == 'LOCAL':
+            self.remote = False
+        elif header == '*RST':
+            self.reset()
+
+    def _query(self, header):
+        if header == '*IDN':
+            return 'THURLBY THANDAR,TGA1230,SIM,1.00'
+        elif header == 'WAVFREQ':
+            return '%.7g'%self.freq
+        elif header == 'AMPL':
+            return '%.4f'%self.ampl
+        elif header == 'DCOFFS':
+            return '%.4f'%self.offset
+        elif header == 'OUTPUT':
+            return self.output and 'ON' or 'OFF'
+        elif header == 'MODE':
+            return self.mode
+        return ''
+
+    def inWaiting(self):
+        return len(self.outbuffer)
+
+    def _wait(self, complete):
+        """Wait until complete() is true or timeout expires, with lock held"""
+        if not self.isopen:
+            raise ValueError('Attempting to use a port that is not open')
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while not complete():
+            if self.timeout is None:
+                # blocks until the data arrive, as a real port does
+                self.ready.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                self.ready.wait(remaining)
+            if not self.isopen:
+                raise ValueError('Attempting to use a port that is not open')
+
+    def read(self, size=1):
+        with self.ready:
+            self._wait(lambda: self.outbuffer)
+            data = self.outbuffer[:size]
+            self.outbuffer = self.outbuffer[size:]
+        if data:
+            self.model.transfer(self.port, '<read>')
+        return data
+
+    def readline(self):
+        with self.ready:
+            self._wait(lambda: '\n' in self.outbuffer)
+            if '\n' in self.outbuffer:
+                size = self.outbuffer.index('\n') + 1
+            else:
+                size = len(self.outbuffer)
+        if not size:
+            return ''
+        return self.read(size)
+
+    def flushInput(self):
+        with self.ready:
+            self.outbuffer = ''
+
+    def close(self):
+        with self.ready:
+            self.isopen = False
+            self.ready.notify_all()
+
+    def isOpen(self):
+        return self.isopen
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""Raw SCPI over TCP sockets, without VISA.
+
+Instruments with a LAN interface (as the Agilent 33220A) accept SCPI
+commands on a raw TCP socket, port 5025. SocketInstrument talks to them
+with the interface of a pyVISA instrument, so drivers use it unchanged
+for addresses like 'TCPIP::192.168.0.10::5025::SOCKET'.
+Addresses listed in the PYFUNCGEN_SOCKETS environment variable
+(separated by commas, a host name alone meaning port 5025) are offered
+along with VISA devices.
+
+Connections are kept open in a pool and reused by the next instrument
+opened at the same address, so reconnecting costs no TCP handshake.
+Writes do not wait for the instrument, so commands are pipelined;
+ask_many() sends several queries in one packet before reading
+the replies, and query_all() asks many instruments at once.
+
+SCPIServer is a local stand-in for an instrument, a TCP server answering
+like a devices.simulator.SimulatedAgilent33220A, to test and benchmark
+the transport without hardware or network:
+    server = serve()                # on a free port of localhost
+    fg = Agilent33220A(server.address)
+    ...
+    server.stop()
+or from the command line:
+    python -m devices.sockethelper [port]
+
+"""
+import os
+import re
+import select
+import socket
+import SocketServer
+import threading
+
+from binblock import block_end
+
+PORT = 5025
+TIMEOUT = 5.0 # s
+MAXIDLE = 4 # idle connections kept per address
+BUFSIZE = 65536
+TERMINATOR = '\n'
+SOCKETSVAR = 'PYFUNCGEN_SOCKETS'
+ADDRESS = re.compile(r'^TCPIP\d*::([^:]+)::(\d+)::SOCKET$', re.IGNORECASE)
+QUOTED = re.compile(r'"[^"]*"|\'[^\']*\'')
+
+
+def is_socket_address(name):
+    """Whether name is the address of a raw socket instrument"""
+    return ADDRESS.match(name.strip()) is not None
+
+
+def parse_address(name):
+    """Host and port of a raw socket address"""
+    match = ADDRESS.match(name.strip())
+    if match is None:
+        raise ValueError('Not a socket address: %s'%name)
+    return match.group(1), int(match.group(2))
+
+
+def is_query(cmd):
+    """Whether a (compound) command has queries, i.e. a reply is due
+
+    The replies to all queries of a command come as one message.
+    Only headers ending with '?' count, not question marks in strings,
+    as in DISP:TEXT 'Ready?'.
+    """
+    for part in QUOTED.sub('', cmd).split(';'):
+        words = part.split(None, 1)
+        if words and words[0].endswith('?'):
+            return True
+    return False
+
+
+def socket_address(host, port=PORT):
+    return 'TCPIP::%s::%i::SOCKET'%(host, port)
+
+
+def get_sockets():
+    """Socket addresses configured in the environment"""
+    addresses = []
+    for item in os.environ.get(SOCKETSVAR, '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if not is_socket_address(item):
+            item = socket_address(item)
+        addresses.append(item)
+    return addresses
+
+
+class ConnectionPool(object):
+    """Open connections by address, kept for reuse when closed
+
+    maxidle - number of idle connections kept per address
+    May be shared by threads.
+    """
+    def __init__(self, maxidle=MAXIDLE):
+        self.maxidle = maxidle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host, port, timeout=TIMEOUT):
+        """Connection to host:port, an idle one if there is any"""
+        while True:
+            with self.lock:
+                idle = self.idle.get((host, port))
+                sock = idle.pop() if idle else None
+            if sock is None:
+                break
+            # an idle connection with anything to read was closed by
+            # the instrument or holds a stray reply, it is not reused
+            if not select.select([sock], [], [], 0)[0]:
+                sock.settimeout(timeout)
+                return sock
+            sock.close()
+        sock = socket.create_connection((host, port), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def release(self, host, port, sock):
+        """Keep the connection for reuse"""
+        with self.lock:
+            idle = self.idle.setdefault((host, port), [])
+            if len(idle) < self.maxidle:
+                idle.append(sock)
+                return
+        sock.close()
+
+    def close(self):
+        """Close all idle connections"""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for sock in connections:
+                sock.close()
+
+
+# shared by all instruments, so that connections are reused
+connections = ConnectionPool()
+
+
+class SocketInstrument(object):
+    """Instrument at a raw socket address with pyVISA instrument interface
+
+    Raises IOError (socket.error) if the communication fails;
+    the connection is dropped then and opened again on the next call.
+    Replies are queued by the connection, so queries may be written
+    and their replies read later (pipelined).
+    """
+    pipelined = True
+    # write_raw() takes bytearrays as well
+    buffers = True
+
+    def __init__(self, address, timeout=TIMEOUT, pool=connections):
+        self.address = address
+        self.host, self.port = parse_address(address)
+        self.timeout = timeout
+        self.pool = pool
+        self.sock = None
+        self.buffer = ''
+        self.pending = 0
+        self._connection()
+
+    def _connection(self):
+        if self.sock is None:
+            self.sock = self.pool.acquire(self.host, self.port, self.timeout)
+            self.buffer = ''
+            self.pending = 0
+        return self.sock
+
+    def _drop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _sendall(self, data):
+        try:
+            self._connection().sendall(data)
+        except socket.error:
+            self._drop()
+            raise
+
+    def write(self, cmd):
+        """Send a command, not waiting for the instrument"""
+        self._sendall(cmd + TERMINATOR)
+        if is_query(cmd):
+            # a reply is due, read() it
+            self.pending += 1
+
+    def write_raw(self, data):
+        """Send commands ending with a binary block, not copying them"""
+        self._sendall(data)
+        self._sendall(TERMINATOR)
+
+    def read(self):
+        """Next reply, without the terminator"""
+        sock = self._connection()
+        try:
+            while TERMINATOR not in self.buffer:
+                data = sock.recv(BUFSIZE)
+                if not data:
+                    raise socket.error('Connection closed by %s'%self.address)
+                self.buffer += data
+        except socket.error:
+            self._drop()
+            raise
+        reply, self.buffer = self.buffer.split(TERMINATOR, 1)
+        self.pending = max(0, self.pending - 1)
+        return reply.rstrip('\r')
+
+    def ask(self, query):
+        self.write(query)
+        return self.read()
+
+    def ask_many(self, queries):
+        """Replies to several queries, sent at once"""
+        self._sendall(''.join([query + TERMINATOR for query in queries]))
+        self.pending += len(queries)
+        return [self.read() for query in queries]
+
+    def close(self):
+        """Return the connection to the pool, unless replies are due"""
+        if self.sock is None:
+            return
+        if self.pending or self.buffer:
+            self._drop()
+        else:
+            self.pool.release(self.host, self.port, self.sock)
+            self.sock = None
+
+
+def query_all(instruments, query, timeout=None):
+    """Replies of all instruments to a query, asked in parallel
+
+    Replies of instruments which failed or did not reply within
+    timeout s are None.
+    """
+    from discovery import run_parallel
+    jobs = dict((i, (instrument.ask, (query,)))
+                for i, instrument in enumerate(instruments))
+    replies = run_parallel(jobs, timeout)
+    return [replies.get(i) for i in range(len(instruments))]
+
+
+def message_end(text):
+    """Index of the terminator of the first message in text
+
+    Terminators within binary blocks do not count.
+    -1 if the message is not complete yet.
+    """
+    pos = 0
+    while True:
+        end = text.find(TERMINATOR, pos)
+        block = text.find('#', pos, end if end >= 0 else len(text))
+        while block >= 0 and not text[block + 1:block + 2].isdigit():
+            block = text.find('#', block + 1, end if end >= 0 else len(text))
+        if block < 0:
+            return end
+        try:
+            pos = block_end(text, block)
+        except ValueError:
+            return -1
+
+
+class SCPIHandler(SocketServer.BaseRequestHandler):
+    """Connection to SCPIServer, messages are performed one by one"""
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.clients.add(self.request)
+
+    def handle(self):
+        buffer = ''
+        try:
+            while True:
+                data = self.request.recv(BUFSIZE)
+                if not data:
+                    return
+                buffer += data
+                end = message_end(buffer)
+                while end >= 0:
+                    reply = self.server.perform(buffer[:end])
+                    buffer = buffer[end + 1:]
+                    if reply is not None:
+                        self.request.sendall(reply + TERMINATOR)
+                    end = message_end(buffer)
+        except socket.error:
+            # the client went away, or the server was stopped
+            pass
+
+    def finish(self):
+        self.server.clients.discard(self.request)
+
+
+class SCPIServer(SocketServer.ThreadingTCPServer):
+    """Local TCP server standing in for an instrument
+
+    instrument - simulated instrument answering the commands,
+        a new devices.simulator.SimulatedAgilent33220A by default;
+        connections share it, as they share a real instrument
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 64
+
+    def __init__(self, host='127.0.0.1', port=0, instrument=None):
+        SocketServer.ThreadingTCPServer.__init__(self, (host, port),
+                                                 SCPIHandler)
+        if instrument is None:
+            from simulator import SimulatedAgilent33220A
+            instrument = SimulatedAgilent33220A(self.address)
+        self.instrument = instrument
+        self.lock = threading.Lock()
+        self.clients = set()
+        self.thread = None
+
+    def _get_address(self):
+        host, port = self.server_address[:2]
+        return socket_address(host, port)
+    address = property(_get_address, None, None,
+                       "Socket address of the server for SocketInstrument")
+
+    def perform(self, message):
+        """Pass a message to the instrument, return its reply if any"""
+        with self.lock:
+            try:
+                self.instrument.write_raw(message.rstrip('\r'))
+                if self.instrument.reply:
+                    return self.instrument.read()
+            except IOError:
+                # a failure injected by the latency model loses the reply
+                return None
+
+    def start(self):
+        """Serve in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name='SCPI server %s'%self.address)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and drop the connections, as if switched off"""
+        if self.thread is not None:
+            self.shutdown()
+        self.server_close()
+        for sock in list(self.clients):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+def serve(host='127.0.0.1', port=0, instrument=None):
+    """Start a SCPIServer in the background, on a free port by default"""
+    return SCPIServer(host, port, instrument).start()
+
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    server = SCPIServer(port=port)
+    print 'Simulated instrument at %s, Ctrl-C to stop'%server.address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Batching of device commands into a single write.
+
+A device supporting transactions implements begin(), commit() and
+rollback(), and queues commands written between begin() and commit()
+instead of sending them right away.
+
+"""
+
+
+class Transaction(object):
+    """Context manager sending commands of a device as one write
+
+    Usage:
+        with Transaction(device):
+            device.apply(f, u)
+            device.set_display(line1, line2)
+
+    Transactions may be nested, only the outermost one sends the commands.
+    If an exception happens inside, queued commands are discarded.
+    """
+    def __init__(self, device):
+        self.device = device
+
+    def __enter__(self):
+        self.device.begin()
+        return self.device
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.device.commit()
+        else:
+            self.device.rollback()
+        return False
+
+
+class NoTransaction(object):
+    """Stand-in for devices which can not batch commands"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+def transaction(device):
+    """Transaction of the device, or a do-nothing one if not supported"""
+    if hasattr(device, 'batch'):
+        return device.batch()
+    return NoTransaction()
+
+
+class CommandQueue(object):
+    """Commands collected by (possibly nested) transactions"""
+    def __init__(self):
+        self.depth = 0
+        self.commands = []
+
+    def _get_active(self):
+        return self.depth > 0
+    active = property(_get_active, None, None, "Whether commands are queued")
+
+    def begin(self):
+        self.depth += 1
+
+    def end(self):
+        """Close one level of nesting, return commands to send if outermost"""
+        self.depth = max(0, self.depth - 1)
+        if self.depth:
+            return []
+        return self.take()
+
+    def take(self):
+        """Remove and return all queued commands"""
+        commands = self.commands
+        self.commands = []
+        return commands
+
+    def rollback(self):
+        self.depth = 0
+        self.commands = []
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""Protocol execution machinery shared by wxfuncgen and agilentgrow.
+
+Contains everything that is needed to run a voltage/frequency protocol
+on a function generator, but is not specific to a particular device
+or user interface.
+
+"""
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of protocol runs, to resume them after a crash.
+
+A ProtocolRun given a Checkpoint saves the digest of its protocol,
+the index of the step just applied and the elapsed protocol time
+after every step. The file is replaced atomically (written aside,
+synced and renamed over), so it holds either the previous or the new
+checkpoint, even if the program or the computer dies while writing it.
+Windows can not rename over a file; there the old checkpoint is
+renamed aside first, and load() falls back to the new one written aside,
+or to the old one, if the program died in between.
+
+Usage:
+    checkpoint = Checkpoint('run.ckpt')
+    index, elapsed = checkpoint.resume_point(protocol)
+    run = ProtocolRun(fg, protocol, checkpoint=checkpoint)
+    run.run(index, elapsed=elapsed)
+
+"""
+import json
+import os
+import time
+
+VERSION = 1
+TMPEXT = '.tmp'
+BAKEXT = '.bak'
+
+
+class Checkpoint(object):
+    """Checkpoint file of one protocol run
+
+    sync - force every checkpoint to the disk before replacing the old one
+    """
+    def __init__(self, filename, sync=True):
+        self.filename = os.path.abspath(filename)
+        self.sync = sync
+
+    def save(self, digest, index, elapsed):
+        """Replace the checkpoint with a new one"""
+        data = json.dumps({'version':VERSION, 'protocol':digest,
+                           'index':index, 'elapsed':elapsed,
+                           'time':time.time()})
+        tmpname = self.filename + TMPEXT
+        with open(tmpname, 'wb') as f:
+            f.write(data)
+            if self.sync:
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            os.rename(tmpname, self.filename)
+        except OSError:
+            # on Windows the old file has to be moved out of the way first,
+            # it is kept until the new one is in place
+            bakname = self.filename + BAKEXT
+            if os.path.exists(bakname):
+                os.remove(bakname)
+            os.rename(self.filename, bakname)
+            os.rename(tmpname, self.filename)
+            os.remove(bakname)
+
+    def load(self):
+        """Content of the checkpoint as a dict, None if there is none
+
+        If the checkpoint is missing or damaged, the one being saved
+        (written aside) or the previous one is loaded instead.
+        """
+        for ext in ('', TMPEXT, BAKEXT):
+            try:
+                with open(self.filename + ext, 'rb') as f:
+                    data = json.loads(f.read())
+            except (IOError, ValueError):
+                continue
+            if isinstance(data, dict) and data.get('version') == VERSION:
+                return data
+        return None
+
+    def clear(self):
+        """Remove the checkpoint, when the run is over"""
+        for ext in ('', TMPEXT, BAKEXT):
+            if os.path.exists(self.filename + ext):
+                os.remove(self.filename + ext)
+
+    def resume_point(self, protocol):
+        """Step index and elapsed time to resume the protocol at
+
+        (0, None) if there is no checkpoint of this protocol,
+        which starts the run from the beginning.
+        """
+        data = self.load()
+        if not data or data['protocol'] != protocol.digest:
+            return 0, None
+        elapsed = min(data['elapsed'], protocol.duration)
+        index = max(data['index'], protocol.index_at(elapsed))
+        if index >= len(protocol):
+            return 0, None
+        return index, elapsed
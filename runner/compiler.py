@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Compiles protocol rows into a stream of device states.
+
+A protocol is a sequence of rows (stages) of the form
+    (stage name, duration in min, start U, start F, end U, end F, No of points,
+    ramp)
+as used in the protocol grid of wxfuncgen. The ramp shape is optional
+and defaults to linear, see runner.ramps for available shapes.
+States of the device are produced on demand, so the memory needed
+does not depend on the number of points in the protocol.
+Lazy protocols do not keep their stages either, but make them again
+from the rows (e.g. of a memory mapped runner.protofile.BinaryProtocol)
+when needed, so their memory does not depend on the number of stages.
+
+Stages with 0 points are adaptive (needs NumPy): out of a uniform grid
+of points mindt s apart, only those are kept where the amplitude or
+the frequency has moved from the last kept value by the tolerance
+of the protocol (e.g. the resolution of the device, see resolution()),
+plus the last point, so that the end values are reached.
+Values never differ from the ramp by more than the tolerance,
+with the fewest steps (and commands to the device).
+
+"""
+from __future__ import division
+import hashlib
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from runner.ramps import get_ramp, check_ramp, LINEAR
+
+# ramp shapes which a frequency sweep of a generator can perform
+SWEEPSPACINGS = {'lin':'LIN', 'log':'LOG'}
+MINDT = 1.0 # s, default interval of the grid of adaptive stages
+
+
+def resolution(device):
+    """Amplitude and frequency tolerance matching the digits of a device
+
+    device may be a driver or a devices.DriverInfo.
+    """
+    return 10.0**-device.ampldigits, 10.0**-device.freqdigits
+
+
+class ProtocolState(namedtuple('ProtocolState',
+                               'index stage u f tremain dt offset')):
+    """State of the device at one step of the protocol
+
+    index - number of the step in the whole protocol
+    stage - name of the stage
+    u, f - amplitude (Vpp) and frequency (Hz) to apply
+    tremain - time remaining until the end of the stage, s
+    dt - time until the next step, s
+    offset - time from the start of the protocol, s
+    """
+    __slots__ = ()
+
+
+class Stage(object):
+    """One stage (row) of the protocol with values varying along a ramp
+
+    Nstates of 0 makes the stage adaptive, with the given tolerance
+    (amplitude, frequency) on a grid of mindt s.
+    """
+    def __init__(self, name, T, Ustart, Fstart, Uend, Fend, Nstates,
+                 shape=LINEAR, tolerance=None, mindt=MINDT):
+        self.name = name
+        self.duration = T * 60
+        self.Ustart = Ustart
+        self.Fstart = Fstart
+        self.Uend = Uend
+        self.Fend = Fend
+        self.Nstates = Nstates
+        self.shape = shape or LINEAR
+        self.ramp = get_ramp(self.shape)
+        check_ramp(self.shape, Ustart, Uend)
+        check_ramp(self.shape, Fstart, Fend)
+        # grid points kept by an adaptive stage, None for uniform ones
+        self.points = None
+        self.Ngrid = Nstates
+        if Nstates == 0:
+            self._plan(tolerance, mindt)
+        elif Nstates < 1:
+            raise ValueError('Number of states is incorrect')
+        elif Nstates == 1:
+            if Ustart == Uend and Fstart == Fend:
+                self.dT = self.duration
+            else:
+                raise ValueError('Number of states is incorrect')
+        else:
+            self.dT = self.duration / Nstates
+
+    def _plan(self, tolerance, mindt):
+        """Choose the points of an adaptive stage"""
+        if tolerance is None:
+            raise ValueError('Adaptive stage %s needs a tolerance'%self.name)
+        try:
+            from runner.planner import adaptive_points
+        except ImportError:
+            raise ValueError('Adaptive stage %s needs NumPy'%self.name)
+        if mindt <= 0:
+            raise ValueError('Interval of adaptive stages must be positive')
+        constant = self.Ustart == self.Uend and self.Fstart == self.Fend
+        # a ramp needs at least its start and end points
+        self.Ngrid = max(1 if constant else 2, 
+                         int(round(self.duration / mindt)))
+        self.dT = self.duration / self.Ngrid
+        self.points, self.bounds = adaptive_points(self, tolerance)
+        self.Nstates = len(self.points)
+
+    def _get_sweep(self):
+        if (self.points is None and self.Nstates > 1 and
+            self.Ustart == self.Uend and 
+            self.Fstart != self.Fend and not callable(self.shape)):
+            return SWEEPSPACINGS.get(self.shape)
+    sweep = property(_get_sweep, None, None, 
+        "Spacing of a frequency sweep performing the stage, None if none can")
+
+    def __len__(self):
+        return self.Nstates
+
+    def fraction(self, i):
+        """Fraction of the ramp done at the i-th point (i may be an array)"""
+        if self.points is not None:
+            i = self.points[i]
+        if self.Ngrid == 1:
+            return 0*i
+        return i / (self.Ngrid - 1)
+
+    def time(self, i):
+        """Time of the i-th point from the start of the stage, s"""
+        if self.points is None:
+            return self.dT*i
+        return self.dT*self.points[i]
+
+    def interval(self, i):
+        """Time from the i-th point to the next one, s"""
+        if self.points is None:
+            return self.dT + 0*i
+        return self.dT*(self.bounds[i + 1] - self.bounds[i])
+
+    def point_at(self, t):
+        """Number of the point active t s after the start of the stage"""
+        i = int(t // self.dT)
+        if self.points is not None:
+            i = bisect_right(self.points, i) - 1
+        return min(max(i, 0), self.Nstates - 1)
+
+    def state(self, i, index=0, offset=0):
+        """State at the i-th point of the stage
+
+        index and offset are those of the first point of the stage
+        within the whole protocol.
+        """
+        x = self.fraction(i)
+        t = float(self.time(i))
+        return ProtocolState(index + i, self.name,
+                             self.ramp(self.Ustart, self.Uend, x),
+                             self.ramp(self.Fstart, self.Fend, x),
+                             self.duration - t,
+                             float(self.interval(i)),
+                             offset + t)
+
+
+class LazyStages(object):
+    """Sequence of the stages of rows, made on access
+
+    rows - sequence of rows supporting len() and indexing
+    The last stage accessed is kept, as it is usually accessed again.
+    tolerance, mindt - of adaptive stages (see Stage)
+    """
+    def __init__(self, rows, tolerance=None, mindt=MINDT):
+        self.rows = rows
+        self.tolerance = tolerance
+        self.mindt = mindt
+        self.last = (None, None)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, snum):
+        lastnum, stage = self.last
+        if snum != lastnum:
+            stage = Stage(tolerance=self.tolerance, mindt=self.mindt,
+                          *self.rows[snum])
+            self.last = (snum, stage)
+        return stage
+
+    def __iter__(self):
+        for snum in xrange(len(self)):
+            yield self[snum]
+
+
+class Protocol(object):
+    """Compiled protocol, producing states on demand
+
+    Supports len(), iteration, and random access to any step
+    with state(index) or iterstates(start).
+    lazy - do not keep the stages but make them from rows when needed,
+        rows must support len() and indexing then
+    tolerance, mindt - of adaptive stages (see Stage)
+    All rows are checked when the protocol is compiled.
+    digest identifies the protocol by the values of its stages.
+    Ngrid is the number of steps the protocol would have
+    without adaptive planning.
+    """
+    def __init__(self, rows, lazy=False, tolerance=None, mindt=MINDT):
+        if lazy:
+            self.stages = LazyStages(rows, tolerance, mindt)
+        else:
+            self.stages = []
+        self.firstindex = array('l')
+        self.firstoffset = array('d')
+        Nstates = 0
+        Ngrid = 0
+        offset = 0
+        digest = hashlib.sha1()
+        for row in rows:
+            stage = Stage(tolerance=tolerance, mindt=mindt, *row)
+            digest.update(repr((stage.name, stage.duration, stage.Ustart,
+                                stage.Fstart, stage.Uend, stage.Fend,
+                                stage.Nstates, stage.shape)))
+            if not lazy:
+                self.stages.append(stage)
+            self.firstindex.append(Nstates)
+            self.firstoffset.append(offset)
+            Nstates += len(stage)
+            Ngrid += stage.Ngrid
+            offset += stage.duration
+        self.Nstates = Nstates
+        self.Ngrid = Ngrid
+        self.duration = offset
+        self.digest = digest.hexdigest()
+
+    def __len__(self):
+        return self.Nstates
+
+    def __iter__(self):
+        return self.iterstates()
+
+    def _get_saved(self):
+        return self.Ngrid - self.Nstates
+    saved = property(_get_saved, None, None,
+                     "Number of steps (commands) saved by adaptive planning")
+
+    def _locate(self, index):
+        """Stage number and normalized index of the step with given index"""
+        if index < 0:
+            index += self.Nstates
+        if not 0 <= index < self.Nstates:
+            raise IndexError('protocol step index out of range')
+        return bisect_right(self.firstindex, index) - 1, index
+
+    def state(self, index):
+        """State of the step with given index"""
+        snum, index = self._locate(index)
+        return self.stages[snum].state(index - self.firstindex[snum],
+                                       self.firstindex[snum],
+                                       self.firstoffset[snum])
+
+    def stage_at(self, index):
+        """Stage of the step with given index and number of the step in it"""
+        snum, index = self._locate(index)
+        return self.stages[snum], index - self.firstindex[snum]
+
+    def iterstates(self, start=0):
+        """Generate states starting from the step with given index"""
+        if start >= self.Nstates:
+            return
+        first, start = self._locate(start)
+        for snum in range(first, len(self.stages)):
+            stage = self.stages[snum]
+            index = self.firstindex[snum]
+            offset = self.firstoffset[snum]
+            for i in xrange(max(0, start - index), len(stage)):
+                yield stage.state(i, index, offset)
+
+    def index_at(self, elapsed):
+        """Index of the step which is active after elapsed seconds"""
+        if self.Nstates == 0:
+            raise IndexError('empty protocol')
+        snum = max(0, bisect_right(self.firstoffset, elapsed) - 1)
+        stage = self.stages[snum]
+        return self.firstindex[snum] + stage.point_at(elapsed -
+                                                      self.firstoffset[snum])
+
+
+def three_stages(Ustart, Uend, Fmain, Fdetach, Tgrow, Trest, Tdetach, dt,
+                 shape=LINEAR, adaptive=False):
+    """Protocol rows for growing, resting and detaching stages
+
+    Durations are in minutes, the update interval dt is in seconds.
+    Stages with zero duration are omitted.
+    shape is the ramp shape of growing and detaching stages.
+    adaptive makes all stages adaptive, compile them with mindt=dt.
+    """
+    def points(T, Nmin):
+        if adaptive:
+            return 0
+        return max(Nmin, int(T*60//dt))
+    rows = []
+    if Tgrow:
+        N = points(Tgrow, 2)
+        rows.append(('Growing', Tgrow, Ustart, Fmain, Uend, Fmain, N, shape))
+    if Trest:
+        N = points(Trest, 1)
+        rows.append(('Resting', Trest, Uend, Fmain, Uend, Fmain, N, LINEAR))
+    if Tdetach:
+        N = points(Tdetach, 2)
+        rows.append(('Detaching', Tdetach, Uend, Fmain, Uend, Fdetach, N,
+                     shape))
+    return rows
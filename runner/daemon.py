@@ -0,0 +1,564 @@
+# -*- coding: utf-8 -*-
+"""Daemon owning the function generators, shared by all programs.
+
+The daemon opens devices when a client asks for them and keeps them
+connected, so wxfuncgen, agilentgrow and scripts use the same devices
+one after another or at once, without connecting again. Protocols may
+be run by the daemon itself; their progress is sent to all subscribed
+clients, which may pause, stop or adjust the run while it goes on.
+Devices may be used by several clients at once: their requests and
+the steps of a run are performed one by one, and a value set by a client
+during a run holds until the next step of the run sets it again.
+Clients only let a device go; the daemon returns it to local control
+when the last client has released it and no run goes on.
+See runner.remote for the clients and the protocol.
+
+Usage:
+    python -m runner.daemon                 # serve until Ctrl-C
+    python -m runner.daemon status          # open devices and their runs
+    python -m runner.daemon watch           # print events as they come
+    python -m runner.daemon set ADDRESS ampl 1.5
+    python -m runner.daemon pause|resume|stop ADDRESS
+    python -m runner.daemon shutdown
+
+"""
+from __future__ import division
+import argparse
+import hmac
+import json
+import os
+import Queue
+import socket
+import SocketServer
+import threading
+
+from devices import get_driver
+from devices.discovery import discovery
+from devices.transaction import transaction
+from runner import statusfeed
+from runner.compiler import Protocol, MINDT
+from runner.execute import ProtocolRun
+from runner.orchestra import DeviceStatus, RUNNING, FINISHED, STOPPED, FAILED
+from runner.protofile import read_protocol, BinaryProtocol
+from runner.remote import (default_address, running, encode, Client,
+                           DaemonError, DRIVER, PROPERTIES, METHODS,
+                           ATTRIBUTES, write_key, key_file)
+from runner.scheduler import DeadlineScheduler, CATCHUP
+
+IDLE = 'idle'
+PAUSEPOLL = 0.1 # s
+FEEDSTATES = {STOPPED:statusfeed.STOPPED, FAILED:statusfeed.FAILED}
+# what a stage display shows, as in agilentgrow
+DISPLAY = ('%s - %i:%02i', '%.2f Vpp | %.2f Hz')
+
+
+class Session(object):
+    """Device owned by the daemon, and the protocol run on it
+
+    All operations on the device hold the lock, so steps of a run
+    and requests of clients do not interleave.
+    """
+    def __init__(self, daemon, address, driver=DRIVER):
+        devclass = get_driver(driver).load()
+        fg = devclass(address)
+        if not fg.dev:
+            raise IOError('could not connect to device %s'%address)
+        fg.connect()
+        self.daemon = daemon
+        self.address = address
+        self.driver = driver
+        self.fg = fg
+        self.lock = threading.RLock()
+        self.users = 0
+        # returned to local control, when nobody uses it
+        self.local = False
+        self.run = None
+        self.thread = None
+        self.status = DeviceStatus(address)
+        self.status.state = IDLE
+        self.stopped = threading.Event()
+        self.feed = None
+        if daemon.feed:
+            self.feed = daemon.feed.device(address)
+
+    def info(self):
+        """Attributes of the driver for its RemoteDevice"""
+        return dict((name, getattr(self.fg, name)) for name in ATTRIBUTES
+                    if hasattr(self.fg, name))
+
+    def _perform(self, op, name, args):
+        if op == 'get' and name in PROPERTIES:
+            return getattr(self.fg, name)
+        elif op == 'set' and name in PROPERTIES:
+            setattr(self.fg, name, args[0])
+        elif op == 'call' and name in METHODS:
+            result = getattr(self.fg, name)(*args)
+            if name == 'pulse':
+                result = vars(result)
+            return result
+        else:
+            raise DaemonError('Can not %s %s of a device'%(op, name))
+
+    def perform(self, op, name, args=()):
+        with self.lock:
+            result = self._perform(op, name, args)
+        if op != 'get':
+            self.daemon.publish('changed', self.address,
+                                operations=[[op, name, args]])
+        return result
+
+    def batch(self, operations):
+        """Perform operations in one transaction of the device"""
+        with self.lock:
+            with transaction(self.fg):
+                for op, name, args in operations:
+                    self._perform(op, name, args)
+        self.daemon.publish('changed', self.address, operations=operations)
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start_run(self, rows, policy=CATCHUP, verify=None, tolerance=None,
+                  mindt=MINDT):
+        """Run the protocol of rows in the background, return its length"""
+        with self.lock:
+            if self.running():
+                raise DaemonError('A protocol is already running on %s'
+                                  %self.address)
+            protocol = Protocol(rows, lazy=isinstance(rows, BinaryProtocol),
+                                tolerance=tolerance, mindt=mindt)
+            run = ProtocolRun(self.fg, protocol, DeadlineScheduler(policy),
+                              display=self._show, verify=verify,
+                              feed=self.feed)
+            run.validate()
+            self.run = run
+            self.stopped = threading.Event()
+            run.stopped = self.stopped
+            self.status = DeviceStatus(self.address)
+            self.thread = threading.Thread(target=self._execute,
+                                           name='run on %s'%self.address)
+            self.thread.daemon = True
+            self.thread.start()
+        return len(protocol)
+
+    def _show(self, state):
+        self.status.update(state)
+        if hasattr(self.fg, 'set_display'):
+            t = state.tremain
+            self.fg.set_display(DISPLAY[0]%(state.stage, t//60, t%60),
+                                DISPLAY[1]%(state.u, state.f))
+        self.daemon.publish('step', self.address, index=state.index,
+                            stage=state.stage, u=state.u, f=state.f,
+                            tremain=state.tremain, offset=state.offset)
+
+    def _execute(self):
+        """Perform the run, in its own thread"""
+        run = self.run
+        status = self.status
+        status.state = RUNNING
+        self.daemon.publish('run', self.address, state=RUNNING,
+                            steps=len(run.protocol))
+        try:
+            with self.lock:
+                run.start()
+            while True:
+                # the deadline of a paused run is past, wait() would not
+                # look at the event
+                if (self.stopped.is_set() or
+                    run.scheduler.wait(run.nextoffset(), self.stopped)):
+                    status.state = STOPPED
+                    break
+                if run.scheduler.paused:
+                    self.stopped.wait(PAUSEPOLL)
+                    continue
+                with self.lock:
+                    if not run.step():
+                        status.state = FINISHED
+                        break
+        except Exception, err:
+            status.state = FAILED
+            status.error = str(err)
+        if self.feed and status.state != FINISHED:
+            self.feed.event(FEEDSTATES[status.state])
+        try:
+            with self.lock:
+                self.fg.output = False
+                if not self.users:
+                    self._release()
+        except Exception:
+            # the device failed, the run is reported failed anyway
+            pass
+        status.stats = run.scheduler.stats
+        status.deviceerrors = run.deviceerrors
+        self.daemon.publish('run', self.address, state=status.state,
+                            error=status.error, stats=str(status.stats),
+                            deviceerrors=[str(err) for err in
+                                          run.deviceerrors])
+
+    def attach(self, user=True):
+        """A client or a run takes the device, back to remote control"""
+        with self.lock:
+            if self.local:
+                self.fg.connect()
+                self.local = False
+            if user:
+                self.users += 1
+
+    def release(self):
+        """A client lets the device go
+
+        The last one returns it to local control, unless a run goes on
+        (then it is returned when the run ends).
+        """
+        with self.lock:
+            self.users = max(0, self.users - 1)
+            if not self.users and not self.running():
+                self._release()
+
+    def _release(self):
+        self.fg.disconnect()
+        self.local = True
+
+    def pause(self):
+        if not self.running():
+            raise DaemonError('No protocol is running on %s'%self.address)
+        with self.lock:
+            self.run.pause()
+        self.daemon.publish('run', self.address, state='paused')
+
+    def resume(self):
+        if not self.running():
+            raise DaemonError('No protocol is running on %s'%self.address)
+        with self.lock:
+            self.run.resume()
+        self.daemon.publish('run', self.address, state=RUNNING)
+
+    def stop(self, timeout=None):
+        """Stop the run, if any, the output is turned off"""
+        if self.running():
+            self.stopped.set()
+            self.thread.join(timeout)
+
+    def describe(self):
+        status = self.status
+        return {'address':self.address, 'driver':self.driver,
+                'users':self.users, 'state':status.state,
+                'index':status.index, 'stage':status.stage,
+                'u':status.u, 'f':status.f, 'tremain':status.tremain,
+                'error':status.error}
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            self.fg.disconnect()
+            self.fg.close()
+
+
+class Connection(SocketServer.StreamRequestHandler):
+    """Client connected to the daemon, requests are served in order"""
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        self.writelock = threading.Lock()
+        self.subscribed = False
+        # clients on TCP have to send the key first
+        self.authorized = self.server.daemon.key is None
+
+    def handle(self):
+        daemon = self.server.daemon
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    self.send({'error':'Malformed request'})
+                    continue
+                self.send(daemon.handle(self, request))
+                if not self.authorized:
+                    return
+        except socket.error:
+            # the client went away
+            pass
+        finally:
+            daemon.unsubscribe(self)
+
+    def send(self, message):
+        with self.writelock:
+            self.wfile.write(encode(message))
+
+
+class TCPServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(SocketServer, 'ThreadingUnixStreamServer'):
+    class UnixServer(SocketServer.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class Daemon(object):
+    """Server of the devices
+
+    address - socket path, or (host, port), see runner.remote;
+        on TCP, clients are asked for the key written to key_file()
+    feed - file to publish the live status of the runs to
+        (see runner.statusfeed), none by default
+    """
+    def __init__(self, address=None, feed=None):
+        if address is None:
+            address = default_address()
+        self.address = address
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                if running(address):
+                    raise IOError('A daemon is already running at %s'
+                                  %address)
+                # left behind by a daemon which died
+                os.remove(address)
+            self.server = UnixServer(address, Connection)
+            os.chmod(address, 0600)
+            self.key = None
+        else:
+            # the port may be reused, a running daemon would lose its key
+            if address[1] and running(address):
+                raise IOError('A daemon is already running at %s:%i'
+                              %address)
+            self.server = TCPServer(address, Connection)
+            # the port, if a free one was chosen
+            self.address = address = self.server.server_address
+            self.key = write_key(address)
+        self.server.daemon = self
+        self.feed = None
+        if feed:
+            self.feed = statusfeed.StatusFeed(feed)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.events = Queue.Queue()
+        self.publisher = threading.Thread(target=self._publish,
+                                          name='daemon events')
+        self.publisher.daemon = True
+        self.publisher.start()
+        self.thread = None
+
+    def publish(self, event, device=None, **data):
+        """Send an event to the subscribers, not waiting for them"""
+        data['event'] = event
+        data['device'] = device
+        self.events.put(data)
+
+    def _publish(self):
+        while True:
+            message = self.events.get()
+            if message is None:
+                return
+            for connection in list(self.subscribers):
+                try:
+                    connection.send(message)
+                except socket.error:
+                    self.unsubscribe(connection)
+
+    def unsubscribe(self, connection):
+        self.subscribers.discard(connection)
+
+    def session(self, address):
+        with self.lock:
+            try:
+                return self.sessions[address]
+            except KeyError:
+                raise DaemonError('Device %s is not open'%address)
+
+    def open(self, address, driver=DRIVER, user=True):
+        """Session of the device, opening it if needed
+
+        user - count the client among the users of the device,
+            until it releases it
+        """
+        with self.lock:
+            session = self.sessions.get(address)
+            if session is None:
+                session = Session(self, address, driver)
+                self.sessions[address] = session
+                self.publish('open', address)
+        session.attach(user)
+        return session
+
+    def handle(self, connection, request):
+        """Reply to a request of a connected client"""
+        reply = {'id':request.get('id')}
+        try:
+            reply['result'] = self._handle(connection, request)
+        except Exception, err:
+            reply['error'] = str(err) or err.__class__.__name__
+        return reply
+
+    def _handle(self, connection, request):
+        cmd = request.get('cmd')
+        address = request.get('address')
+        if cmd == 'auth':
+            connection.authorized = (self.key is None or hmac.compare_digest(
+                str(request.get('key', '')), self.key))
+            if not connection.authorized:
+                raise DaemonError('Wrong key')
+        elif not connection.authorized:
+            raise DaemonError('Not authorized, send the key first')
+        elif cmd == 'ping':
+            return 'pong'
+        elif cmd == 'subscribe':
+            self.subscribers.add(connection)
+        elif cmd == 'list':
+            driver = get_driver(request.get('driver', DRIVER))
+            # open devices are busy, they are not probed again
+            with self.lock:
+                exclude = set(request.get('exclude', ())) | set(self.sessions)
+            devices = discovery.devices([driver.transport],
+                                        request.get('refresh', False),
+                                        request.get('probe', True), exclude)
+            return [{'address':info.address, 'idn':info.idn}
+                    for info in devices]
+        elif cmd == 'open':
+            return self.open(address, request.get('driver', DRIVER)).info()
+        elif cmd == 'release':
+            self.session(address).release()
+        elif cmd == 'close':
+            session = self.session(address)
+            with self.lock:
+                del self.sessions[address]
+            session.close()
+            self.publish('close', address)
+        elif cmd in ('get', 'set', 'call'):
+            return self.session(address).perform(cmd, request.get('name'),
+                                                 request.get('args', ()))
+        elif cmd == 'batch':
+            self.session(address).batch(request.get('operations', []))
+        elif cmd == 'run':
+            rows = request.get('rows')
+            if request.get('file'):
+                rows = read_protocol(request['file'])
+            session = self.open(address, request.get('driver', DRIVER),
+                                user=False)
+            return session.start_run(rows, request.get('policy', CATCHUP),
+                                     request.get('verify'),
+                                     request.get('tolerance'),
+                                     request.get('mindt', MINDT))
+        elif cmd == 'pause':
+            self.session(address).pause()
+        elif cmd == 'resume':
+            self.session(address).resume()
+        elif cmd == 'stop':
+            self.session(address).stop()
+        elif cmd == 'status':
+            with self.lock:
+                sessions = self.sessions.values()
+            return [session.describe() for session in sessions]
+        elif cmd == 'shutdown':
+            # not from the thread of the request, it would wait for itself
+            threading.Thread(target=self.shutdown).start()
+        else:
+            raise DaemonError('Unknown request %s'%cmd)
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name='daemon')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def shutdown(self):
+        """Stop the runs, close the devices and stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            sessions, self.sessions = self.sessions.values(), {}
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+        self.events.put(None)
+        if self.feed:
+            self.feed.close()
+        if isinstance(self.address, basestring):
+            filename = self.address
+        else:
+            filename = key_file(self.address)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def print_event(event):
+    """Print an event as a line"""
+    items = ['%s=%s'%(key, value) for key, value in sorted(event.items())
+             if key not in ('event', 'device') and value is not None]
+    print '%s %s %s'%(event['event'], event['device'] or '', ' '.join(items))
+
+
+def main():
+    optparser = argparse.ArgumentParser(description=
+        "Daemon owning function generators, shared by all programs.")
+    optparser.add_argument('command', nargs='?', default='serve',
+        choices=('serve', 'status', 'watch', 'set', 'pause', 'resume',
+                 'stop', 'close', 'shutdown'),
+        help='What to do (serve)')
+    optparser.add_argument('args', nargs='*',
+        help='Device address, and property and value for set')
+    args = optparser.parse_args()
+    if args.command == 'serve':
+        try:
+            daemon = Daemon(feed=statusfeed.default_feed())
+        except (IOError, socket.error), err:
+            optparser.exit(1, '%s\n'%err)
+        print 'Serving at %s, Ctrl-C to stop'%(daemon.address,)
+        daemon.start()
+        try:
+            while daemon.thread.is_alive():
+                daemon.thread.join(1.0)
+        except KeyboardInterrupt:
+            daemon.shutdown()
+        return
+    try:
+        client = Client()
+    except IOError, err:
+        optparser.exit(1, 'The daemon is not running (%s)\n'%err)
+    try:
+        request(client, optparser, args)
+    except DaemonError, err:
+        optparser.exit(1, '%s\n'%err)
+    finally:
+        client.close()
+
+
+def request(client, optparser, args):
+    """Perform the command of the command line in the daemon"""
+    if args.command == 'status':
+        for item in client.call('status'):
+            print json.dumps(item, sort_keys=True)
+    elif args.command == 'watch':
+        client.subscribe(print_event)
+        try:
+            while not client.closed:
+                client.thread.join(1.0)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'set':
+        if len(args.args) != 3:
+            optparser.error('set needs the address, property and value')
+        address, name, value = args.args
+        client.call('set', address=address, name=name, args=[float(value)])
+    elif args.command == 'shutdown':
+        client.call('shutdown')
+    else:
+        if len(args.args) != 1:
+            optparser.error('%s needs the address'%args.command)
+        client.call(args.command, address=args.args[0])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Execution of a compiled protocol on a function generator.
+
+The same ProtocolRun drives the protocol both in the blocking loop
+of agilentgrow (run()) and from the timer of wxfuncgen (step()).
+
+Frequency ramps at constant amplitude are offloaded to the sweep engine
+of devices supporting it (those with a true supports_sweep attribute):
+a sweep is started at the first step of the ramp, and the following steps
+only update the displays, until the last step sets the end values.
+Sweeps longer than the device allows are split into several ones.
+
+What was applied and when is logged if a runner.recorder.DeviceLog
+is given. With a runner.checkpoint.Checkpoint, the progress is saved
+after every step, and the run can be resumed from it with
+start(index, elapsed=...) after a crash.
+
+With verify set, the commands of every step are checked for errors
+by devices supporting it (those with check() and errors(), see
+devices.errorqueue), and the errors are read every verify s of
+the protocol time, between steps. They are kept in deviceerrors
+with the steps which caused them, and logged.
+
+The live status of the run is published for other programs if
+a runner.statusfeed.DeviceFeed is given.
+
+"""
+from __future__ import division
+
+import threading
+
+from devices.transaction import transaction
+from runner import statusfeed
+from runner.scheduler import DeadlineScheduler
+
+try:
+    from runner import planner
+except ImportError:
+    # no NumPy - states are computed one by one
+    # and values are clipped by the device itself
+    planner = None
+
+
+class ProtocolRun(object):
+    """Performs the steps of a protocol on a device at their deadlines
+
+    display is an optional function called with the state
+    of every performed step, to show it to the user.
+    sweep=False makes all the steps performed by the host.
+    log is an optional runner.recorder.DeviceLog to record the run to.
+    checkpoint is an optional runner.checkpoint.Checkpoint to save
+    the progress to; it is cleared when the protocol is finished.
+    verify is the interval to read errors of checked steps at, s;
+    None (default) does not check the steps.
+    feed is an optional runner.statusfeed.DeviceFeed to publish
+    the live status of the run to.
+    """
+    def __init__(self, fg, protocol, scheduler=None, display=None, 
+                 sweep=True, log=None, checkpoint=None, verify=None,
+                 feed=None):
+        self.fg = fg
+        self.log = log
+        self.feed = feed
+        self.checkpoint = checkpoint
+        if not hasattr(fg, 'check'):
+            verify = None
+        self.verify = verify
+        self.verified = 0
+        self.deviceerrors = []
+        self.protocol = protocol
+        self.sweep = sweep and getattr(fg, 'supports_sweep', False)
+        # steps of the hardware sweep going on
+        self.sweeping = None
+        self.lastitem = None
+        if scheduler is None:
+            scheduler = DeadlineScheduler()
+        self.scheduler = scheduler
+        self.display = display
+        self.states = None
+        self.nextitem = None
+        self.stopped = threading.Event()
+
+    def validate(self):
+        """Check the protocol against device limits before enabling output
+
+        Raises planner.LimitError (a ValueError).
+        Does nothing if NumPy is not available.
+        """
+        if planner:
+            planner.validate(self.protocol, self.fg)
+
+    def _iterstates(self, start):
+        if planner and hasattr(self.fg, 'apply_formatted'):
+            return planner.iterplanned(self.protocol, self.fg, start)
+        return ((state, None, None)
+                for state in self.protocol.iterstates(start))
+
+    def _fetch(self):
+        try:
+            self.nextitem = self.states.next()
+        except StopIteration:
+            self.nextitem = None
+
+    def _apply(self, item):
+        """Set the values of a step and update displays in one transaction"""
+        state, fstr, ustr = item
+        try:
+            with transaction(self.fg):
+                if not (self.sweep and self._sweep(state)):
+                    self._set(item)
+                if self.display:
+                    self.display(state)
+                if self.verify is not None:
+                    self.fg.check(state.index)
+        except Exception, err:
+            if self.log:
+                self.log.error(err, state.index)
+            if self.feed:
+                self.feed.event(statusfeed.FAILED)
+            raise
+        if self.log:
+            self.log.setpoint(state)
+        if self.feed:
+            self.feed.setpoint(state)
+        if self.checkpoint:
+            self.checkpoint.save(self.protocol.digest, state.index,
+                                 self.scheduler.elapsed())
+        self.lastitem = item
+    
+    def _set(self, item):
+        state, fstr, ustr = item
+        self.sweeping = None
+        if fstr is None:
+            self.fg.apply(state.f, state.u)
+        else:
+            self.fg.apply_formatted(fstr, ustr)
+    
+    def _sweep(self, state):
+        """Perform the step with a hardware sweep if possible
+        
+        Returns False if the values of the step must be set as usual.
+        """
+        stage, i = self.protocol.stage_at(state.index)
+        last = len(stage) - 1
+        if stage.sweep is None or i == last:
+            return False
+        if self.sweeping and state.index in self.sweeping:
+            return True
+        tmin, tmax = self.fg.sweeptimerange
+        if not tmin <= stage.dT <= tmax:
+            return False
+        end = min(last, i + int(tmax // stage.dT))
+        self.fg.sweep(state.f, stage.state(end).f, (end - i)*stage.dT, 
+                      stage.sweep, state.u)
+        self.sweeping = xrange(state.index, state.index + end - i)
+        return True
+
+    def read_errors(self):
+        """Read errors of the checked steps, return them"""
+        errors = self.fg.errors()
+        self.verified = self.scheduler.elapsed()
+        for err in errors:
+            if self.log:
+                self.log.error('%i %s'%(err.code, err.message), err.first)
+        self.deviceerrors.extend(errors)
+        return errors
+
+    def nextoffset(self):
+        """Deadline offset of the next step or of the end of the protocol"""
+        if self.nextitem:
+            return self.nextitem[0].offset
+        return self.protocol.duration
+
+    def delay(self):
+        """Time until the next step is due, s"""
+        return self.scheduler.delay(self.nextoffset())
+
+    def start(self, index=0, t0=None, elapsed=None):
+        """Apply the state of the given step, turn output on and start timing
+
+        t0 is the clock time the run is counted from (now by default).
+        elapsed is the protocol time to start at, within the given step;
+        by default the step starts at its beginning.
+        """
+        self.states = self._iterstates(index)
+        self._fetch()
+        item = self.nextitem
+        self._fetch()
+        if elapsed is None:
+            elapsed = item[0].offset
+        self.scheduler.start(elapsed, t0)
+        self.verified = elapsed
+        self.scheduler.mark(item[0].offset)
+        if self.log:
+            self.log.event('start', item[0].index)
+        with transaction(self.fg):
+            self._apply(item)
+            self.fg.output = True
+        if self.log:
+            self.log.output(True)
+
+    def step(self):
+        """Perform the next step, unless dropped by the scheduler
+
+        Returns False when the protocol is finished.
+        """
+        item = self.nextitem
+        if item is None:
+            self.scheduler.finish(self.protocol.duration)
+            if self.verify is not None:
+                self.read_errors()
+            if self.log:
+                self.log.event('finish')
+            if self.feed:
+                self.feed.event(statusfeed.FINISHED)
+            if self.checkpoint:
+                self.checkpoint.clear()
+            return False
+        self._fetch()
+        if not self.scheduler.overdue(self.nextoffset()):
+            self.scheduler.mark(item[0].offset)
+            self._apply(item)
+        if (self.verify is not None and
+            self.scheduler.elapsed() - self.verified >= self.verify):
+            self.read_errors()
+        return True
+
+    def pause(self):
+        """Pause timing, holding the values of the last step"""
+        self.scheduler.pause()
+        if self.log:
+            self.log.event('pause')
+        if self.feed:
+            self.feed.event(statusfeed.PAUSED)
+        if self.sweeping and self.lastitem:
+            # the device would go on sweeping
+            with transaction(self.fg):
+                self._set(self.lastitem)
+
+    def resume(self):
+        self.scheduler.resume()
+        if self.log:
+            self.log.event('resume')
+        if self.feed:
+            self.feed.event(statusfeed.RUNNING)
+
+    def stop(self):
+        """Make a blocking run() return before the next step"""
+        self.stopped.set()
+
+    def run(self, index=0, t0=None, elapsed=None):
+        """Run the protocol to the end, blocking; return timing statistics
+
+        Returns earlier if stop() is called from another thread.
+        """
+        self.start(index, t0, elapsed)
+        while True:
+            if self.scheduler.wait(self.nextoffset(), self.stopped):
+                if self.feed:
+                    self.feed.event(statusfeed.STOPPED)
+                return self.scheduler.stats
+            if not self.step():
+                return self.scheduler.stats
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Running protocols on several function generators at once.
+
+Every device gets its own thread, so a stalled instrument delays only
+its own steps, and an error on one device does not stop the others.
+All runs are counted from the same start time, so their steps stay
+aligned on shared deadlines.
+
+"""
+import threading
+
+from runner import statusfeed
+from runner.execute import ProtocolRun
+from runner.scheduler import DeadlineScheduler, CATCHUP, monotonic
+
+WAITING = 'waiting'
+RUNNING = 'running'
+FINISHED = 'finished'
+STOPPED = 'stopped'
+FAILED = 'failed'
+
+
+class DeviceStatus(object):
+    """Current state of the protocol run on one device"""
+    def __init__(self, name):
+        self.name = name
+        self.state = WAITING
+        self.index = None
+        self.stage = None
+        self.u = None
+        self.f = None
+        self.tremain = None
+        self.error = None
+        self.stats = None
+        self.deviceerrors = []
+
+    def update(self, state):
+        self.index = state.index
+        self.stage = state.stage
+        self.u = state.u
+        self.f = state.f
+        self.tremain = state.tremain
+
+    def __str__(self):
+        if self.state == FAILED:
+            return '%s: failed (%s)'%(self.name, self.error)
+        if self.stage is None:
+            return '%s: %s'%(self.name, self.state)
+        return '%s: %s %.2f Vpp %.2f Hz'%(self.name, self.stage,
+                                         self.u, self.f)
+
+
+class Channel(object):
+    """Protocol run on one device, performed in its own thread"""
+    def __init__(self, opener, protocol, name, policy, display, log=None,
+                 verify=None, feed=None):
+        self.opener = opener
+        self.log = log
+        self.feed = feed
+        self.verify = verify
+        self.protocol = protocol
+        self.status = DeviceStatus(name)
+        self.policy = policy
+        self.display = display
+        self.fg = None
+        self.run = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def _show(self, state):
+        self.status.update(state)
+        if self.display:
+            self.display(self.fg, state)
+
+    def execute(self, t0):
+        """Open the device and run the protocol (in the channel's thread)"""
+        status = self.status
+        try:
+            self.fg = self.opener()
+            scheduler = DeadlineScheduler(self.policy)
+            self.run = ProtocolRun(self.fg, self.protocol, scheduler,
+                                   display=self._show, log=self.log,
+                                   verify=self.verify, feed=self.feed)
+            # errors found by the device are added as they are read
+            status.deviceerrors = self.run.deviceerrors
+            self.run.stopped = self.stopped
+            self.run.validate()
+            scheduler.start(t0=t0)
+            if not scheduler.wait(0, self.stopped):
+                status.state = RUNNING
+                # a device which took long to open catches up with the others
+                status.stats = self.run.run(t0=t0)
+        except Exception, err:
+            # errors of running steps are logged by the run itself
+            if self.log and status.state != RUNNING:
+                self.log.error(err)
+            if self.feed and status.state != RUNNING:
+                self.feed.event(statusfeed.FAILED)
+            status.state = FAILED
+            status.error = err
+        else:
+            if self.stopped.is_set():
+                status.state = STOPPED
+            else:
+                status.state = FINISHED
+
+
+class Orchestrator(object):
+    """Runs protocols on several devices concurrently
+
+    Devices are added with add() as functions opening and connecting them,
+    or with add_device() as a driver class and its address.
+    display, if given, is called as display(fg, state) after each step
+    of every device, from the thread of that device.
+    recorder, if given, is a runner.recorder.Recorder logging the runs,
+    devices are numbered in the order they were added.
+    verify, if given, is the interval to read errors of the checked steps
+    of every device at, s (see runner.execute).
+    feed, if given, is a runner.statusfeed.StatusFeed to publish the live
+    status of every device to.
+    """
+    def __init__(self, policy=CATCHUP, display=None, recorder=None,
+                 verify=None, feed=None):
+        self.policy = policy
+        self.display = display
+        self.recorder = recorder
+        self.feed = feed
+        self.verify = verify
+        self.channels = []
+
+    def add(self, opener, protocol, name=None):
+        """Add a device opened by calling opener() to run the protocol"""
+        if name is None:
+            name = 'device %i'%(len(self.channels) + 1)
+        log = None
+        if self.recorder:
+            log = self.recorder.device(len(self.channels))
+            log.event(name)
+        feed = None
+        if self.feed:
+            feed = self.feed.device(name)
+        self.channels.append(Channel(opener, protocol, name,
+                                     self.policy, self.display, log,
+                                     self.verify, feed))
+
+    def add_device(self, devclass, address, protocol, tracer=None):
+        """Add a device by its driver class and address
+
+        tracer is an optional devices.instrumentation.Tracer for the device.
+        """
+        def opener():
+            fg = devclass(address)
+            if not bool(fg.dev):
+                raise IOError('could not connect to device %s'%address)
+            fg.tracer = tracer
+            fg.connect()
+            return fg
+        self.add(opener, protocol, address)
+
+    def _get_statuses(self):
+        return [channel.status for channel in self.channels]
+    statuses = property(_get_statuses, None, None, "Status of every device")
+
+    def _get_devices(self):
+        return [channel.fg for channel in self.channels if channel.fg]
+    devices = property(_get_devices, None, None, "Opened devices")
+
+    def start(self, delay=0):
+        """Start all runs in background, delay s from now"""
+        t0 = monotonic() + delay
+        for channel in self.channels:
+            channel.thread = threading.Thread(target=channel.execute,
+                                              args=(t0,),
+                                              name=channel.status.name)
+            channel.thread.daemon = True
+            channel.thread.start()
+
+    def alive(self):
+        """Whether any of the runs is still going on"""
+        return any(channel.thread.is_alive() for channel in self.channels)
+
+    def join(self, timeout=None):
+        for channel in self.channels:
+            channel.thread.join(timeout)
+
+    def stop(self):
+        """Stop all runs before their next steps"""
+        for channel in self.channels:
+            channel.stopped.set()
+
+    def run(self, delay=0):
+        """Run all protocols to the end, blocking; return the statuses"""
+        self.start(delay)
+        self.join()
+        return self.statuses
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Vectorized planning of protocols with NumPy.
+
+Values of whole stages are computed as arrays (in chunks of limited size,
+so that the memory stays bounded for very long stages), checked against
+the limits of the device in one batch before the run begins,
+and formatted into command arguments ahead of time, so that performing
+a step is just a write to the device.
+The points of adaptive stages are chosen here as well.
+
+"""
+from __future__ import division
+
+import numpy as np
+
+from runner.compiler import ProtocolState
+
+CHUNK = 4096 # max number of points computed at once
+MAXREPORTED = 5 # max number of violations listed in the error message
+
+
+class LimitError(ValueError):
+    """Protocol values are outside of the range supported by the device"""
+    def __init__(self, violations, total):
+        self.violations = violations
+        self.total = total
+        lines = ['Step %i (%s): %s'%item for item in violations]
+        if total > len(violations):
+            lines.append('... and %i more'%(total - len(violations)))
+        ValueError.__init__(self, 'Protocol is out of device limits:\n%s'
+                                  %'\n'.join(lines))
+
+
+class StagePlan(object):
+    """Values of (a part of) a protocol stage computed as arrays
+
+    i - array of point numbers within the stage,
+    index, offset - those of the first point of the stage in the protocol.
+    """
+    def __init__(self, stage, i, index=0, offset=0):
+        self.stage = stage
+        x = stage.fraction(i)
+        self.index = index + i
+        self.u = stage.ramp(stage.Ustart, stage.Uend, x)
+        self.f = stage.ramp(stage.Fstart, stage.Fend, x)
+        t = stage.time(i)
+        self.tremain = stage.duration - t
+        self.offset = offset + t
+        self.dt = stage.interval(i)
+        self.fstr = None
+        self.ustr = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def format(self, device, offset=0):
+        """Format values into command arguments with device's precision
+
+        Values are clipped to the limits of the device first, as the
+        driver's apply() would do, since the arguments are sent as they are.
+        """
+        fmin, fmax = device.freqrange
+        umax = max(device.minampl, 2*(device.maxampl - abs(offset)))
+        self.fstr = np.char.mod(device.freqacc, np.clip(self.f, fmin, fmax))
+        self.ustr = np.char.mod(device.amplacc,
+                                np.clip(self.u, device.minampl, umax))
+
+    def check(self, device, offset=0):
+        """Find points outside of device limits
+
+        Returns total number of violations and a list of
+        (index, stage name, description) for the first few of them.
+        """
+        fmin, fmax = device.freqrange
+        badf = (self.f < fmin) | (self.f > fmax)
+        badu = ((self.u < device.minampl) |
+                (abs(offset) + self.u/2 > device.maxampl))
+        bad = np.flatnonzero(badf | badu)
+        found = []
+        for k in bad[:MAXREPORTED]:
+            if badf[k]:
+                what = 'frequency %g Hz'%self.f[k]
+            else:
+                what = 'amplitude %g Vpp'%self.u[k]
+            found.append((self.index[k], self.stage.name, what))
+        return len(bad), found
+
+    def state(self, k):
+        return ProtocolState(int(self.index[k]), self.stage.name,
+                             float(self.u[k]), float(self.f[k]),
+                             float(self.tremain[k]), float(self.dt[k]),
+                             float(self.offset[k]))
+
+
+def _levels(start, values, tolerance):
+    """Number of tolerances the values are away from start"""
+    if tolerance <= 0:
+        # every point is a new level
+        return np.arange(len(values))
+    return np.floor((values - start) / tolerance)
+
+
+def adaptive_points(stage, tolerance):
+    """Points of the grid of an adaptive stage where values must change
+
+    Returns the numbers of the grid points to keep, and the same
+    with the number of grid points appended (bounds of their intervals).
+    """
+    utol, ftol = tolerance
+    keep = np.zeros(stage.Ngrid, dtype=bool)
+    keep[0] = True
+    # levels at the last point of the previous chunk
+    ulast = flast = 0
+    for i0 in xrange(0, stage.Ngrid, CHUNK):
+        i = np.arange(i0, min(i0 + CHUNK, stage.Ngrid))
+        if stage.Ngrid == 1:
+            x = 0*i
+        else:
+            x = i / (stage.Ngrid - 1)
+        ulevels = _levels(stage.Ustart, 
+                          stage.ramp(stage.Ustart, stage.Uend, x), utol)
+        flevels = _levels(stage.Fstart,
+                          stage.ramp(stage.Fstart, stage.Fend, x), ftol)
+        changed = ((np.diff(np.concatenate(([ulast], ulevels))) != 0) |
+                   (np.diff(np.concatenate(([flast], flevels))) != 0))
+        keep[i0:i0 + len(i)] |= changed
+        ulast, flast = ulevels[-1], flevels[-1]
+    keep[0] = True
+    if stage.Ustart != stage.Uend or stage.Fstart != stage.Fend:
+        keep[-1] = True
+    points = np.flatnonzero(keep)
+    return points, np.append(points, stage.Ngrid)
+
+
+def iterplans(protocol, start=0, chunk=CHUNK):
+    """Generate plans of consecutive parts of protocol stages"""
+    for snum, stage in enumerate(protocol.stages):
+        index = protocol.firstindex[snum]
+        offset = protocol.firstoffset[snum]
+        if index + len(stage) <= start:
+            continue
+        for i0 in xrange(max(0, start - index), len(stage), chunk):
+            i = np.arange(i0, min(i0 + chunk, len(stage)))
+            yield StagePlan(stage, i, index, offset)
+
+
+def validate(protocol, device, offset=None):
+    """Check the whole protocol against the limits of the device
+
+    offset is the DC offset used during the run, asked from the device
+    if not given. Raises LimitError listing the offending steps.
+    """
+    if offset is None:
+        offset = getattr(device, 'offset', 0)
+    total = 0
+    found = []
+    for plan in iterplans(protocol):
+        n, items = plan.check(device, offset)
+        total += n
+        found.extend(items[:MAXREPORTED - len(found)])
+    if total:
+        raise LimitError(found, total)
+
+
+def iterplanned(protocol, device, start=0, offset=None):
+    """Generate (state, frequency string, amplitude string) for every step
+
+    The strings are clipped to the limits of the device (see validate()
+    for offset), the states keep the values of the protocol.
+    """
+    if offset is None:
+        offset = getattr(device, 'offset', 0)
+    for plan in iterplans(protocol, start):
+        plan.format(device, offset)
+        for k in xrange(len(plan)):
+            yield plan.state(k), plan.fstr[k], plan.ustr[k]
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Reading and writing protocol files.
+
+Protocols are stored as CSV files (Excel dialect) with one stage per row,
+in the column order of PROTOCOLCOLS. Files written before ramp shapes
+were introduced have no last column and are read as linear.
+
+Long protocols can be stored in a compact binary format instead:
+a header (magic, format version, record size, number of rows)
+followed by fixed-width little-endian records of the typed columns.
+Binary files are memory mapped and their rows are unpacked only when
+accessed, so opening them takes no time whatever their size.
+Conversion between both formats is lossless (floats are written to CSV
+with all their digits):
+    python -m runner.protofile protocol.csv protocol.pfg
+
+"""
+import csv
+import mmap
+import struct
+import sys
+
+from runner.ramps import LINEAR
+
+PROTOCOLCOLS = [
+                ('Stage', str),
+                ('t, min', float),
+                ('start U, Vpp', float),
+                ('start F, Hz', float),
+                ('end U, Vpp', float),
+                ('end F, Hz', float),
+                ('No of points', int),
+                ('Ramp', str),
+                ]
+
+BINEXT = '.pfg'
+MAGIC = 'PFGP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+# stage name, t, start U, start F, end U, end F, No of points, ramp
+RECORD = struct.Struct('<32s5di8s')
+
+
+def read_csv(filename):
+    """Read protocol rows from CSV file as lists of strings
+
+    Raises ValueError if the file is not formatted properly.
+    """
+    data = []
+    with open(filename, 'rb') as f:
+        reader = csv.reader(f, dialect='excel')
+        for row in reader:
+            if len(row) == len(PROTOCOLCOLS) - 1:
+                row.append(LINEAR)
+            if len(row) != len(PROTOCOLCOLS):
+                raise ValueError('Error in file formatting: %s'%filename)
+            data.append(row)
+    return data
+
+
+def write_csv(filename, data):
+    """Write protocol rows to CSV file"""
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f, dialect='excel')
+        writer.writerows(data)
+
+
+def convert_rows(data):
+    """Convert rows of strings to the types of protocol columns
+
+    Raises ValueError naming the item which could not be converted.
+    """
+    rows = []
+    for rownum, row in enumerate(data):
+        line = []
+        for colnum, strval in enumerate(row):
+            try:
+                val = PROTOCOLCOLS[colnum][1](strval)
+            except ValueError:
+                msg = 'Could not convert item at row %i, col %i to desired type'
+                raise ValueError(msg%(rownum, colnum))
+            line.append(val)
+        rows.append(line)
+    return rows
+
+
+def _pack(row):
+    """Binary record of a row of typed values"""
+    name, T, Ustart, Fstart, Uend, Fend, Npoints = row[:7]
+    ramp = len(row) > 7 and row[7] or ''
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    if len(name) > 32 or len(ramp) > 8 or '\0' in name + ramp:
+        raise ValueError('Stage name or ramp too long for binary file: %s'%name)
+    return RECORD.pack(name, T, Ustart, Fstart, Uend, Fend, Npoints, ramp)
+
+
+def write_binary(filename, rows):
+    """Write typed protocol rows (any iterable) to a binary file"""
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+        nrows = 0
+        for row in rows:
+            f.write(_pack(row))
+            nrows += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, nrows))
+
+
+def is_binary(filename):
+    """Check if the file is a binary protocol file"""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BinaryProtocol(object):
+    """Rows of a memory mapped binary protocol file
+    
+    A read-only sequence of rows of typed values, unpacked on access.
+    Raises ValueError if the file is not a binary protocol file
+    of a known version.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError('Not a binary protocol file: %s'%filename)
+            magic, version, recsize, nrows = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError('Not a binary protocol file: %s'%filename)
+            if version > VERSION or recsize != RECORD.size:
+                raise ValueError('Unsupported version %i of protocol file: %s'%
+                                 (version, filename))
+            f.seek(0, 2)
+            if f.tell() < HEADER.size + nrows*recsize:
+                raise ValueError('Truncated protocol file: %s'%filename)
+            self.nrows = nrows
+            self.map = None
+            if nrows:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.nrows
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.nrows
+        if not 0 <= index < self.nrows:
+            raise IndexError('protocol row index out of range')
+        row = list(RECORD.unpack_from(self.map,
+                                      HEADER.size + index*RECORD.size))
+        row[0] = row[0].rstrip('\0')
+        row[-1] = row[-1].rstrip('\0')
+        return row
+
+    def __iter__(self):
+        for index in xrange(self.nrows):
+            yield self[index]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_protocol(filename):
+    """Typed rows of a protocol file of either format
+    
+    Binary files are returned as BinaryProtocol, not read in.
+    Raises ValueError if the file is not formatted properly.
+    """
+    if is_binary(filename):
+        return BinaryProtocol(filename)
+    return convert_rows(read_csv(filename))
+
+
+def write_protocol(filename, rows):
+    """Write typed rows, binary if the file name ends with BINEXT"""
+    if filename.lower().endswith(BINEXT):
+        write_binary(filename, rows)
+    else:
+        write_csv(filename, rows)
+
+
+def convert_file(source, target):
+    """Convert a protocol file between CSV and binary formats"""
+    rows = read_protocol(source)
+    try:
+        write_protocol(target, rows)
+    finally:
+        if isinstance(rows, BinaryProtocol):
+            rows.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python -m runner.protofile SOURCE TARGET\n'
+                 'Converts protocol files, TARGET is binary if it ends with %s'
+                 %BINEXT)
+    convert_file(sys.argv[1], sys.argv[2])
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Shapes of the ramps between start and end values of a protocol stage.
+
+A ramp maps the fraction x of the stage (0 at the first point,
+1 at the last one) to a value between start and end.
+Every ramp works both on plain numbers and on NumPy arrays.
+
+Available shapes:
+    lin - linear
+    log - logarithmic, i.e. equal ratio between consecutive points
+        (like a logarithmic sweep of a generator), start and end
+        must be non-zero and of the same sign
+    exp - exponential, slow at the start and fast at the end
+
+User-supplied shapes are functions mapping x to a fraction
+of the way from start to end value, registered with register_ramp().
+
+"""
+from __future__ import division
+import math
+
+LINEAR = 'lin'
+EXPK = 3.0 # steepness of the exponential ramp
+
+_shapes = {}
+
+
+def _expm1(x):
+    if hasattr(x, 'shape'):
+        import numpy
+        return numpy.expm1(x)
+    return math.expm1(x)
+
+
+def _linear(start, end, x):
+    return start + (end - start)*x
+
+
+def _logarithmic(start, end, x):
+    if start == end:
+        return start + 0*x
+    return start * (end / start)**x
+
+
+def _exponential(start, end, x):
+    return start + (end - start)*_expm1(EXPK*x)/math.expm1(EXPK)
+
+
+def register_ramp(name, shape):
+    """Make a user-supplied ramp shape available by name
+
+    shape is a function of the fraction of the stage x, returning
+    a fraction of the way from start to end value (0 to 1 normally).
+    It must accept NumPy arrays as well as plain numbers.
+    """
+    _shapes[name] = lambda start, end, x: start + (end - start)*shape(x)
+
+
+def ramps():
+    """Names of all available ramp shapes"""
+    return sorted(_shapes)
+
+
+def get_ramp(shape):
+    """Get a ramp function by name, or wrap a shape function directly"""
+    if not shape:
+        shape = LINEAR
+    if callable(shape):
+        return lambda start, end, x: start + (end - start)*shape(x)
+    try:
+        return _shapes[shape]
+    except KeyError:
+        raise ValueError('Unknown ramp shape %s'%shape)
+
+
+def check_ramp(shape, start, end):
+    """Raise ValueError if the values can not be ramped with this shape"""
+    ramp = get_ramp(shape)
+    if ramp is _logarithmic and start != end:
+        if start * end <= 0:
+            raise ValueError('Logarithmic ramp needs non-zero values '
+                             'of the same sign')
+
+
+_shapes['lin'] = _linear
+_shapes['log'] = _logarithmic
+_shapes['exp'] = _exponential
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Recording of what was applied to the devices during a run, and when.
+
+Every applied setpoint, output switch, pulse, error and run event
+(start, pause, ...) is packed into a fixed-size record with monotonic
+and wall clock timestamps and put into an in-memory ring buffer.
+A background thread appends the buffer to the log file, so logging
+never waits for the disk. If the buffer fills up faster than it is
+written, new records are dropped and their number is logged instead.
+
+The log file of wxfuncgen and agilentgrow (if not given on the command
+line) may be set in the PYFUNCGEN_RUNLOG environment variable;
+nothing is recorded otherwise.
+
+Log files start with a header (magic, format version, record size)
+followed by the records, in the layout of RECORD (and of LOGDTYPE).
+
+Usage:
+    recorder = Recorder('run.pfr')
+    run = ProtocolRun(fg, protocol, log=recorder.device(0))
+    ...
+    recorder.close()
+    log = read_log('run.pfr')   # NumPy structured array
+    setpoints = log[log['kind'] == SETPOINT]
+
+"""
+from __future__ import division
+import os
+import struct
+import threading
+import time
+
+from runner.scheduler import monotonic
+
+LOGVAR = 'PYFUNCGEN_RUNLOG'
+LOGEXT = '.pfr'
+MAGIC = 'PFGR'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+# monotonic time, wall time, kind, device, step index, u, f, text
+RECORD = struct.Struct('<ddBBxxidd24s')
+LOGDTYPE = [('mono', '<f8'), ('wall', '<f8'), ('kind', 'u1'),
+            ('device', 'u1'), ('pad', 'V2'), ('index', '<i4'),
+            ('u', '<f8'), ('f', '<f8'), ('text', 'S24')]
+
+# kinds of records, and what u, f and text hold in them
+SETPOINT = 1 # amplitude, frequency, stage
+OUTPUT = 2 # u is 1 for on, 0 for off
+PULSE = 3 # requested and produced length, s, pulse method
+ERROR = 4 # error message
+EVENT = 5 # start, pause, resume, finish, ...
+DROPPED = 6 # index is the number of records dropped
+KINDS = {SETPOINT:'setpoint', OUTPUT:'output', PULSE:'pulse',
+         ERROR:'error', EVENT:'event', DROPPED:'dropped'}
+
+CAPACITY = 4096 # records
+FLUSHINTERVAL = 1.0 # s
+NAN = float('nan')
+
+
+def default_log():
+    """Log file set in the environment, None if not set"""
+    return os.environ.get(LOGVAR) or None
+
+
+class Recorder(object):
+    """Ring buffer of records written to a log file by a background thread
+
+    filename - log file, appended to if it exists
+    capacity - number of records the buffer holds
+    interval - time between writes of the buffer, s; it is written
+        earlier when half full
+    May be shared by threads.
+    """
+    def __init__(self, filename, capacity=CAPACITY, interval=FLUSHINTERVAL):
+        self.filename = filename
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = bytearray(capacity*RECORD.size)
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        # held while taking the buffer and writing it, so that writes
+        # of the thread and of flush() are not mixed up or reordered
+        self.writelock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run,
+                                       name='recorder of %s'%filename)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def log(self, kind, device=0, index=-1, u=NAN, f=NAN, text=''):
+        """Add a record to the buffer, never blocking for long"""
+        mono = monotonic()
+        wall = time.time()
+        if isinstance(text, unicode):
+            text = text.encode('utf-8', 'replace')
+        with self.lock:
+            if self.count == self.capacity:
+                self.dropped += 1
+                return
+            slot = (self.head + self.count) % self.capacity
+            RECORD.pack_into(self.buffer, slot*RECORD.size, mono, wall,
+                             kind, device, index, u, f, text[:24])
+            self.count += 1
+            if self.count*2 >= self.capacity:
+                self.wakeup.set()
+
+    def device(self, number):
+        """Log of the given device, to pass to a ProtocolRun"""
+        return DeviceLog(self, number)
+
+    def _take(self):
+        """Records in the buffer as a string, emptying it"""
+        with self.lock:
+            start = self.head*RECORD.size
+            end = (self.head + self.count)*RECORD.size
+            size = len(self.buffer)
+            if end <= size:
+                data = str(self.buffer[start:end])
+            else:
+                data = str(self.buffer[start:]) + str(self.buffer[:end - size])
+            self.head = (self.head + self.count) % self.capacity
+            self.count = 0
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            data += RECORD.pack(monotonic(), time.time(), DROPPED, 0,
+                                dropped, NAN, NAN, '')
+        return data
+
+    def flush(self):
+        """Write the buffer to the file now"""
+        with self.writelock:
+            data = self._take()
+            if data:
+                self.file.write(data)
+                self.file.flush()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Write what is left and close the file"""
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        self.file.close()
+
+
+class DeviceLog(object):
+    """Records of one device, numbered device in the log"""
+    def __init__(self, recorder, device=0):
+        self.recorder = recorder
+        self.device = device
+
+    def setpoint(self, state):
+        """Values of a protocol state were applied"""
+        self.recorder.log(SETPOINT, self.device, state.index, state.u,
+                          state.f, state.stage)
+
+    def output(self, value):
+        self.recorder.log(OUTPUT, self.device, u=int(bool(value)))
+
+    def pulse(self, result):
+        """A pulse was applied, result is a devices.pulse.PulseResult"""
+        self.recorder.log(PULSE, self.device, u=result.requested,
+                          f=result.width, text=result.method)
+
+    def error(self, err, index=-1):
+        self.recorder.log(ERROR, self.device, index, text=str(err))
+
+    def event(self, text, index=-1):
+        self.recorder.log(EVENT, self.device, index, text=text)
+
+
+def read_log(filename):
+    """Records of a log file as a NumPy structured array of LOGDTYPE
+
+    Raises ValueError if the file is not a log of a known version.
+    """
+    import numpy as np
+    with open(filename, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError('Not a run log: %s'%filename)
+        magic, version, recsize = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError('Not a run log: %s'%filename)
+        if version > VERSION or recsize != RECORD.size:
+            raise ValueError('Unsupported version %i of run log: %s'%
+                             (version, filename))
+        data = f.read()
+    # a record being written when the file was read is left out
+    nrecords = len(data) // RECORD.size
+    return np.frombuffer(data[:nrecords*RECORD.size], dtype=LOGDTYPE)
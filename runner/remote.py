@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""Clients of the device daemon (runner.daemon).
+
+The daemon owns the devices and keeps them connected, so that the GUI,
+agilentgrow and scripts share them, and a run started by one of them can
+be watched and adjusted from the others. It listens on a Unix socket
+(on a TCP port of localhost where there are none, i.e. Windows);
+the PYFUNCGEN_DAEMON environment variable may give another socket path
+or host:port.
+The Unix socket is open to its user only. A TCP port is open to all
+local users, so there the daemon writes a random key to a file of the
+user's (see key_file()), and clients send it in an 'auth' request
+before any other; connections failing to do so are closed.
+
+Requests and replies are JSON objects, one per line:
+    {"id": 1, "cmd": "get", "address": "GPIB0::10", "name": "freq"}
+    {"id": 1, "result": 1000.0}         or {"id": 1, "error": "..."}
+and subscribed clients also get events, as {"event": ..., ...}.
+
+Usage:
+    client = Client()                  # raises IOError if no daemon runs
+    fg = RemoteDevice('GPIB0::10', client)
+    fg.connect()
+    with fg.batch():                   # sent as one request
+        fg.apply(500, 1.0)
+        fg.set_display('manual')
+    client.subscribe(print_event)      # called with every event
+    client.call('run', address='GPIB0::10', rows=rows)
+
+"""
+import binascii
+import itertools
+import json
+import os
+import socket
+import tempfile
+import threading
+
+from devices.pulse import PulseResult
+from devices.transaction import Transaction, CommandQueue
+
+ADDRESSVAR = 'PYFUNCGEN_DAEMON'
+PORT = 5027
+TIMEOUT = 10.0 # s
+KEYSIZE = 16 # bytes of the key of a daemon on TCP
+DRIVER = 'Agilent33220A'
+# what clients may do with devices through the daemon
+PROPERTIES = ('freq', 'ampl', 'offset', 'output')
+# (not disconnect: the daemon returns a device to local control itself,
+# when nobody uses it any more)
+METHODS = ('connect', 'apply', 'apply_formatted',
+           'set_display', 'clear_display', 'whoami', 'refresh', 'reset',
+           'sweep', 'stop_sweep', 'pulse')
+# attributes of drivers passed on to their RemoteDevice
+ATTRIBUTES = ('freqrange', 'minampl', 'maxampl', 'freqdigits', 'ampldigits',
+              'freqacc', 'amplacc', 'offsetacc', 'supports_sweep',
+              'sweeptimerange', 'modes')
+
+
+class DaemonError(Exception):
+    """Request refused or failed in the daemon"""
+    pass
+
+
+def _user():
+    return os.environ.get('USER') or os.environ.get('USERNAME') or 'user'
+
+
+def default_address():
+    """Socket path, or (host, port) of the daemon"""
+    address = os.environ.get(ADDRESSVAR)
+    if address:
+        host, _, port = address.rpartition(':')
+        if host and port.isdigit():
+            return host, int(port)
+        return address
+    if hasattr(socket, 'AF_UNIX'):
+        return os.path.join(tempfile.gettempdir(), 'pyfuncgen-%s.sock'%_user())
+    return '127.0.0.1', PORT
+
+
+def key_file(address):
+    """File of the key of the daemon at a TCP (host, port) address
+
+    It is in the temporary directory of the user (under the user's profile
+    on Windows), readable by the user only.
+    """
+    return os.path.join(tempfile.gettempdir(), 
+                        'pyfuncgen-%s-%i.key'%(_user(), address[1]))
+
+
+def write_key(address):
+    """Write a new random key for the daemon at address, return it"""
+    key = binascii.hexlify(os.urandom(KEYSIZE))
+    filename = key_file(address)
+    if os.path.exists(filename):
+        # the mode of an existing file would be kept
+        os.remove(filename)
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def read_key(address):
+    """Key of the daemon at address, None if there is none"""
+    try:
+        with open(key_file(address), 'rb') as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def open_socket(address, timeout=TIMEOUT):
+    """Connection to the daemon at address"""
+    if isinstance(address, basestring):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except socket.error:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection(address, timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def encode(message):
+    return json.dumps(message) + '\n'
+
+
+class Client(object):
+    """Connection to the daemon
+
+    Replies are read by a background thread, which also calls
+    the subscribers with the events.
+    Raises IOError (socket.error) if the daemon does not run,
+    or does not accept the key of the user (on TCP).
+    """
+    def __init__(self, address=None, timeout=TIMEOUT):
+        if address is None:
+            address = default_address()
+        self.address = address
+        self.timeout = timeout
+        self.sock = open_socket(address, timeout)
+        self.sock.settimeout(None)
+        self.ids = itertools.count(1)
+        self.waiting = {}
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self._read,
+                                       name='daemon client')
+        self.thread.daemon = True
+        self.thread.start()
+        if not isinstance(address, basestring):
+            self._authenticate()
+
+    def _authenticate(self):
+        key = read_key(self.address)
+        try:
+            if key is None:
+                raise DaemonError('No key of the daemon in %s'
+                                  %key_file(self.address))
+            self.call('auth', key=key)
+        except DaemonError, err:
+            self.close()
+            raise socket.error(str(err))
+
+    def _read(self):
+        reader = self.sock.makefile('rb')
+        try:
+            for line in reader:
+                message = json.loads(line)
+                if 'event' in message:
+                    for callback in list(self.subscribers):
+                        callback(message)
+                    continue
+                with self.lock:
+                    slot = self.waiting.pop(message.get('id'), None)
+                if slot is not None:
+                    slot[1] = message
+                    slot[0].set()
+        except (socket.error, ValueError):
+            pass
+        finally:
+            self.closed = True
+            # nobody is going to reply any more
+            with self.lock:
+                waiting, self.waiting = self.waiting, {}
+            for slot in waiting.values():
+                slot[0].set()
+
+    def call(self, cmd, **args):
+        """Perform a request, return its result
+
+        Raises DaemonError if it failed, IOError if the daemon went away.
+        """
+        args['cmd'] = cmd
+        args['id'] = self.ids.next()
+        slot = [threading.Event(), None]
+        with self.lock:
+            if self.closed:
+                raise socket.error('Connection to the daemon is closed')
+            self.waiting[args['id']] = slot
+            self.sock.sendall(encode(args))
+        if not slot[0].wait(self.timeout):
+            with self.lock:
+                self.waiting.pop(args['id'], None)
+            raise socket.error('The daemon did not reply to %s'%cmd)
+        reply = slot[1]
+        if reply is None:
+            raise socket.error('Connection to the daemon is closed')
+        if 'error' in reply:
+            raise DaemonError(reply['error'])
+        return reply.get('result')
+
+    def subscribe(self, callback):
+        """Call callback(event) with all events, in the reading thread"""
+        self.subscribers.append(callback)
+        if len(self.subscribers) == 1:
+            self.call('subscribe')
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        if threading.current_thread() is not self.thread:
+            # let the reader end before the interpreter does
+            self.thread.join(self.timeout)
+
+
+def running(address=None):
+    """Whether a daemon is listening"""
+    try:
+        open_socket(address or default_address(), 1.0).close()
+    except socket.error:
+        return False
+    return True
+
+
+def _method(name):
+    """Method of RemoteDevice performed by the device in the daemon"""
+    def method(self, *args):
+        return self._perform('call', name, *args)
+    method.__name__ = name
+    return method
+
+
+def _property(name, doc):
+    """Property of RemoteDevice read and set in the daemon"""
+    def get(self):
+        # the value may depend on the operations of an open transaction
+        self._flush()
+        return self.client.call('get', address=self.address, name=name)
+    def set(self, value):
+        self._perform('set', name, value)
+    return property(get, set, None, doc)
+
+
+class RemoteDevice(object):
+    """Device owned by the daemon, with the interface of its driver
+
+    Operations within a transaction (batch()) are sent as one request
+    and performed in a transaction of the driver.
+    disconnect() and close() let the device go, the daemon keeps it
+    connected, and returns it to local control when no client uses it
+    and no run is going on (another client or run may still use it).
+    """
+    def __init__(self, address, client=None, driver=DRIVER):
+        if client is None:
+            client = Client()
+        self.client = client
+        self.address = address
+        self.driver = driver
+        self.queue = CommandQueue()
+        info = client.call('open', address=address, driver=driver)
+        for name, value in info.items():
+            if isinstance(value, list):
+                value = tuple(value)
+            setattr(self, name, value)
+        self.dev = True
+        self.released = False
+
+    def _perform(self, op, name, *args):
+        if self.queue.active:
+            self.queue.commands.append([op, name, args])
+            return None
+        return self.client.call(op, address=self.address, name=name,
+                                args=args)
+
+    def _flush(self):
+        """Send the operations queued by an open transaction"""
+        if self.queue.active and self.queue.commands:
+            self.client.call('batch', address=self.address,
+                             operations=self.queue.take())
+
+    def batch(self):
+        return Transaction(self)
+
+    def begin(self):
+        self.queue.begin()
+
+    def commit(self):
+        operations = self.queue.end()
+        if operations:
+            self.client.call('batch', address=self.address,
+                             operations=operations)
+
+    def rollback(self):
+        self.queue.rollback()
+
+    def connect(self):
+        if self.released:
+            self.client.call('open', address=self.address, driver=self.driver)
+            self.released = False
+        return self._perform('call', 'connect')
+
+    def disconnect(self):
+        """Let the device go, not touching the instrument"""
+        if not self.released:
+            self.client.call('release', address=self.address)
+            self.released = True
+
+    def close(self):
+        self.disconnect()
+        self.dev = None
+
+    def pulse(self, duration):
+        """Apply a pulse, return its devices.pulse.PulseResult"""
+        result = self.client.call('call', address=self.address,
+                                  name='pulse', args=[duration])
+        return PulseResult(**result)
+
+    apply = _method('apply')
+    apply_formatted = _method('apply_formatted')
+    set_display = _method('set_display')
+    clear_display = _method('clear_display')
+    whoami = _method('whoami')
+    refresh = _method('refresh')
+    reset = _method('reset')
+    sweep = _method('sweep')
+    stop_sweep = _method('stop_sweep')
+
+    freq = _property('freq', "Field frequency")
+    ampl = _property('ampl', "Field amplitude")
+    offset = _property('offset', "Field DC Offset")
+    output = _property('output', "State of the device output")
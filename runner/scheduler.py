@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Deadline-based pacing of protocol steps.
+
+Every step of a protocol is due at a fixed offset from the start of the run.
+The scheduler waits for absolute deadlines on a monotonic clock instead of
+sleeping for a step interval after the step was performed,
+so that the time spent talking to the device does not accumulate
+over the run.
+
+"""
+from __future__ import division
+import sys
+import time
+
+CATCHUP = 'catchup'
+SKIP = 'skip'
+POLICIES = (CATCHUP, SKIP)
+EVENTSLACK = 0.06 # s, granularity of threading.Event.wait timeout
+
+
+def _get_monotonic():
+    """Find the best monotonic clock available on this platform"""
+    try:
+        from time import monotonic
+        return monotonic
+    except ImportError:
+        pass
+    if sys.platform == 'win32':
+        # on Windows time.clock is a performance counter
+        return time.clock
+    try:
+        import ctypes
+        import ctypes.util
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+        libname = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+        clock_gettime = ctypes.CDLL(libname, use_errno=True).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        if sys.platform == 'darwin':
+            CLOCK_MONOTONIC = 6
+        else:
+            CLOCK_MONOTONIC = 1
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return t.tv_sec + t.tv_nsec * 1e-9
+        monotonic()
+        return monotonic
+    except (AttributeError, OSError, TypeError):
+        return time.time
+
+monotonic = _get_monotonic()
+
+
+class RunStats(object):
+    """Timing accuracy of a protocol run
+
+    Jitter is the lateness of a step relative to its deadline,
+    drift is the lateness of the end of the run.
+    All values are in seconds.
+    """
+    def __init__(self):
+        self.steps = 0
+        self.skipped = 0
+        self.jittersum = 0.0
+        self.jittersqsum = 0.0
+        self.jittermax = 0.0
+        self.drift = None
+
+    def add(self, jitter):
+        self.steps += 1
+        self.jittersum += jitter
+        self.jittersqsum += jitter*jitter
+        self.jittermax = max(self.jittermax, jitter)
+
+    def _get_jittermean(self):
+        if self.steps:
+            return self.jittersum / self.steps
+        return 0.0
+    jittermean = property(_get_jittermean, None, None, "Mean step jitter")
+
+    def _get_jitterrms(self):
+        if self.steps:
+            return (self.jittersqsum / self.steps)**0.5
+        return 0.0
+    jitterrms = property(_get_jitterrms, None, None, "RMS step jitter")
+
+    def as_dict(self):
+        return {'steps':self.steps,
+                'skipped':self.skipped,
+                'jitter_mean':self.jittermean,
+                'jitter_rms':self.jitterrms,
+                'jitter_max':self.jittermax,
+                'drift':self.drift,
+                }
+
+    def __str__(self):
+        if self.drift is None:
+            drift = '--'
+        else:
+            drift = '%.1f ms'%(self.drift*1e3)
+        return ('%i steps (%i skipped), jitter mean %.1f ms, '
+                'rms %.1f ms, max %.1f ms, drift %s'%(self.steps, self.skipped,
+                self.jittermean*1e3, self.jitterrms*1e3,
+                self.jittermax*1e3, drift))
+
+
+class DeadlineScheduler(object):
+    """Paces steps on absolute deadlines counted from the start of the run
+
+    Offsets of steps are given in seconds from the start of the run.
+    When the run falls behind, the policy decides what happens
+    to the overdue steps:
+        'catchup' - perform every overdue step immediately, one after another;
+        'skip' - drop every step whose successor is already due,
+            so that only the latest due state is applied.
+    """
+    def __init__(self, policy=CATCHUP, clock=monotonic, sleep=time.sleep):
+        if policy not in POLICIES:
+            raise ValueError('Unknown scheduling policy %s'%policy)
+        self.policy = policy
+        self.clock = clock
+        self.sleep = sleep
+        self.t0 = None
+        self.pausedat = None
+        self.stats = RunStats()
+
+    def start(self, elapsed=0, t0=None):
+        """Start counting deadlines, optionally as if elapsed seconds passed
+
+        t0 is the clock time to count from, now by default;
+        schedulers sharing t0 have their deadlines aligned.
+        """
+        if t0 is None:
+            t0 = self.clock()
+        self.t0 = t0 - elapsed
+        self.pausedat = None
+        self.stats = RunStats()
+
+    def pause(self):
+        if self.pausedat is None:
+            self.pausedat = self.clock()
+
+    def resume(self):
+        """Continue the run, shifting all deadlines by the time spent paused"""
+        if self.pausedat is not None:
+            self.t0 += self.clock() - self.pausedat
+            self.pausedat = None
+
+    def _get_paused(self):
+        return self.pausedat is not None
+    paused = property(_get_paused, None, None, "Whether the run is paused")
+
+    def elapsed(self):
+        """Time since the start of the run, not counting pauses"""
+        if self.pausedat is not None:
+            return self.pausedat - self.t0
+        return self.clock() - self.t0
+
+    def deadline(self, offset):
+        return self.t0 + offset
+
+    def delay(self, offset):
+        """Time left until the deadline, zero if it is already due"""
+        return max(0.0, self.deadline(offset) - self.clock())
+
+    def wait(self, offset, event=None):
+        """Block until the deadline of a step
+
+        If a threading.Event is given, stop waiting as soon as it is set
+        and return True.
+        """
+        deadline = self.deadline(offset)
+        while True:
+            left = deadline - self.clock()
+            if left <= 0:
+                return False
+            if event is None or left <= EVENTSLACK:
+                self.sleep(left)
+            # waiting for an event with timeout is coarse in Python 2,
+            # the rest of time is slept through
+            elif event.wait(left - EVENTSLACK):
+                return True
+            if event is not None and event.is_set():
+                return True
+
+    def overdue(self, nextoffset):
+        """Check if a step must be dropped because its successor is due
+
+        Always False for the 'catchup' policy.
+        Counts the dropped step in the run statistics.
+        """
+        if self.policy == SKIP and nextoffset is not None:
+            if self.clock() >= self.deadline(nextoffset):
+                self.stats.skipped += 1
+                return True
+        return False
+
+    def mark(self, offset):
+        """Record the jitter of a step being performed now"""
+        self.stats.add(self.clock() - self.deadline(offset))
+
+    def finish(self, offset):
+        """Record the drift of the run which was planned to end at offset"""
+        self.stats.drift = self.clock() - self.deadline(offset)
+        return self.stats
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""Live status of protocol runs in shared memory, for other programs.
+
+A run given a DeviceFeed publishes the state of every applied step
+(stage, amplitude, frequency, time remaining) and of the run (running,
+paused, finished, ...) to a memory mapped file. Other processes,
+e.g. acquisition software tagging its frames, read it with StatusReader
+as often as they like: reading takes no lock, no request to the runner
+and no command to the instrument.
+
+Several programs may publish to the same file at once (e.g. the device
+daemon and wxfuncgen attached to it). The file is created by the first
+one and never replaced, so readers may keep it mapped. Every device gets
+a slot of its own, claimed in the file under a file lock: the slot of
+the same device if its publisher is gone, a free slot, or the slot
+of a publisher which is gone, in this order. The same device published
+by two programs at once has two slots; StatusReader.status() gives
+the latest of them.
+Its layout, all little-endian:
+    FILEHEADER  magic 'PFGFEED\\0', version, number of slots, records
+                per slot, record size (uint16 each)
+    SLOTS times, one slot per device:
+        SLOTHEADER  number of records written (uint64), process id
+                    of the publisher, 0 if none (uint32), device name
+                    (36 bytes, NUL padded, UTF-8; empty if never used)
+        DEPTH times RECORD, a ring: record n is at n % DEPTH
+RECORD holds its sequence number (uint64), wall clock time of the step
+(float64, s since the epoch), step index (int32), state code (uint8,
+see STATES), 3 bytes padding, amplitude (Vpp), frequency (Hz),
+time remaining at the step and protocol time of the step (s, float64),
+and the stage name (24 bytes, NUL padded, UTF-8).
+
+Records are guarded by a sequence lock: the writer sets the sequence
+number of record n to 2n + 1 while writing it and to 2n + 2 when done,
+and then counts it in the slot header. A reader takes the last record
+counted, and retries if its sequence number was odd or changed while
+reading (the writer was busy with it or went round the ring).
+Stores of CPython become visible in program order on x86 and x64;
+on CPUs reordering stores a reader may, very rarely, see a torn record.
+
+Usage:
+    feed = StatusFeed('status.feed')
+    run = ProtocolRun(fg, protocol, feed=feed.device('GPIB0::10'))
+    ...
+    reader = StatusReader('status.feed')     # in the other program
+    for status in reader.status():
+        print status.device, status.stage, status.u, status.f, status.tremain
+
+"""
+from __future__ import division
+from collections import namedtuple
+import errno
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+FEEDVAR = 'PYFUNCGEN_STATUSFEED'
+MAGIC = 'PFGFEED\0'
+VERSION = 1
+SLOTS = 8
+DEPTH = 16
+FILEHEADER = struct.Struct('<8sHHHH')
+SLOTHEADER = struct.Struct('<QI36s')
+NAMESIZE = 36
+# sequence, wall time, index, state, u, f, time remaining, offset, stage
+RECORD = struct.Struct('<QdiBxxxdddd24s')
+RETRIES = 100
+NAN = float('nan')
+
+# states of the runs, by their code in records
+IDLE = 0
+RUNNING = 1
+PAUSED = 2
+FINISHED = 3
+STOPPED = 4
+FAILED = 5
+STATES = {IDLE:'idle', RUNNING:'running', PAUSED:'paused',
+          FINISHED:'finished', STOPPED:'stopped', FAILED:'failed'}
+
+
+def slot_size(depth=DEPTH):
+    return SLOTHEADER.size + depth*RECORD.size
+
+
+def feed_size(slots=SLOTS, depth=DEPTH):
+    return FILEHEADER.size + slots*slot_size(depth)
+
+
+def default_feed():
+    """File of the status feed set in the environment, None if not set"""
+    return os.environ.get(FEEDVAR) or None
+
+
+def _text(value, size):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8', 'replace')
+    return value[:size]
+
+
+def _untext(value):
+    return value.rstrip('\0').decode('utf-8', 'replace')
+
+
+def _alive(pid):
+    """Whether the process with the given id may still run"""
+    if not pid:
+        return False
+    if pid == os.getpid() or os.name == 'nt':
+        # os.kill() would terminate it on Windows, where the publisher
+        # is taken as running until it lets the slot go
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        # EPERM: it runs, as another user
+        return err.errno == errno.EPERM
+    return True
+
+
+class StatusFeed(object):
+    """Status feed file, published to by this program
+
+    The file is created if there is none; the layout of an existing
+    feed (its number of slots and depth) is kept.
+    Raises ValueError if the file is not a status feed of this version.
+    May be shared by threads.
+    """
+    def __init__(self, filename, slots=SLOTS, depth=DEPTH):
+        self.filename = filename
+        self.file = open(filename, 'r+b' if os.path.exists(filename)
+                                   else 'w+b')
+        self.lock = threading.Lock()
+        self.devices = {}
+        with self._locked():
+            header = self.file.read(FILEHEADER.size)
+            if len(header) < FILEHEADER.size or not header.strip('\0'):
+                # new file
+                self.file.truncate(feed_size(slots, depth))
+                self.file.seek(0)
+                self.file.write(FILEHEADER.pack(MAGIC, VERSION, slots, depth,
+                                                RECORD.size))
+                self.file.flush()
+            else:
+                magic, version, slots, depth, recsize = \
+                    FILEHEADER.unpack(header)
+                if (magic != MAGIC or version != VERSION or
+                    recsize != RECORD.size or
+                    os.path.getsize(filename) != feed_size(slots, depth)):
+                    self.file.close()
+                    raise ValueError('Not a status feed of version %i: %s'%
+                                     (VERSION, filename))
+        self.slots = slots
+        self.depth = depth
+        self.map = mmap.mmap(self.file.fileno(), feed_size(slots, depth))
+
+    def _locked(self):
+        """File lock held while slots are claimed, by all publishers"""
+        return _FileLock(self.file)
+
+    def _claim(self, name):
+        """Number of the slot for the named device, claimed for us"""
+        pid = os.getpid()
+        headers = [SLOTHEADER.unpack_from(self.map, self._start(number))
+                   for number in range(self.slots)]
+        free = [number for number, (count, owner, slotname)
+                in enumerate(headers) if not _alive(owner)]
+        for number in free:
+            if _untext(headers[number][2]) == name:
+                break
+        else:
+            unused = [number for number in free
+                      if not headers[number][2].strip('\0')]
+            if unused:
+                number = unused[0]
+            elif free:
+                number = free[0]
+            else:
+                raise ValueError('No slot left in the status feed for %s'
+                                 %name)
+        count, owner, slotname = headers[number]
+        if _untext(slotname) != name:
+            # records of another device are not counted on
+            count = 0
+        SLOTHEADER.pack_into(self.map, self._start(number), count, pid,
+                             _text(name, NAMESIZE))
+        return number, count
+
+    def _start(self, number):
+        return FILEHEADER.size + number*slot_size(self.depth)
+
+    def device(self, name):
+        """Feed of the named device, to pass to a ProtocolRun
+
+        The same device gets the same slot. Raises ValueError
+        if all slots are taken by running publishers.
+        """
+        with self.lock:
+            if name not in self.devices:
+                with self._locked():
+                    number, count = self._claim(name)
+                self.devices[name] = DeviceFeed(self, number, count)
+            return self.devices[name]
+
+    def close(self):
+        """Let the slots of the devices go, keeping their last records"""
+        with self.lock:
+            with self._locked():
+                for device in self.devices.values():
+                    struct.pack_into('<I', self.map, device.start + 8, 0)
+            self.devices = {}
+        self.map.close()
+        self.file.close()
+
+
+class _FileLock(object):
+    """Exclusive lock of a whole file, as a context manager"""
+    def __init__(self, f):
+        self.file = f
+
+    def __enter__(self):
+        if fcntl:
+            fcntl.lockf(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        self.file.seek(0)
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.lockf(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class DeviceFeed(object):
+    """Slot of one device in the feed, holding a ring of its records
+
+    count - records written to the slot before, they are counted on
+    """
+    def __init__(self, feed, number, count=0):
+        self.map = feed.map
+        self.depth = feed.depth
+        self.start = FILEHEADER.size + number*slot_size(feed.depth)
+        self.count = count
+        self.last = (-1, NAN, NAN, NAN, NAN, '')
+        self.lock = threading.Lock()
+
+    def _write(self, state, index, u, f, tremain, offset, stage):
+        with self.lock:
+            self.last = (index, u, f, tremain, offset, stage)
+            n = self.count
+            pos = (self.start + SLOTHEADER.size +
+                   (n % self.depth)*RECORD.size)
+            struct.pack_into('<Q', self.map, pos, 2*n + 1)
+            RECORD.pack_into(self.map, pos, 2*n + 1, time.time(), index,
+                             state, u, f, tremain, offset, _text(stage, 24))
+            struct.pack_into('<Q', self.map, pos, 2*n + 2)
+            self.count = n + 1
+            struct.pack_into('<Q', self.map, self.start, self.count)
+
+    def setpoint(self, state):
+        """Values of a protocol state were applied"""
+        self._write(RUNNING, state.index, state.u, state.f, state.tremain,
+                    state.offset, state.stage)
+
+    def event(self, code):
+        """The run changed to the state of the given code, as PAUSED"""
+        self._write(code, *self.last)
+
+
+FeedStatus = namedtuple('FeedStatus', 'device state time index stage u f '
+                        'tremain offset')
+
+
+class StatusReader(object):
+    """Reader of a status feed, in any process
+
+    Raises IOError if there is no feed, ValueError if the file
+    is not a feed of a known version.
+    """
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = default_feed()
+            if filename is None:
+                raise IOError('No status feed set in %s'%FEEDVAR)
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < FILEHEADER.size:
+            raise ValueError('Not a status feed: %s'%filename)
+        magic, version, self.slots, self.depth, recsize = \
+            FILEHEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a status feed: %s'%filename)
+        if (version > VERSION or recsize != RECORD.size or
+            len(self.map) < feed_size(self.slots, self.depth)):
+            raise ValueError('Unsupported version %i of status feed: %s'%
+                             (version, filename))
+
+    def _slot(self, number):
+        start = FILEHEADER.size + number*slot_size(self.depth)
+        count, owner, name = SLOTHEADER.unpack_from(self.map, start)
+        return start, count, name
+
+    def _record(self, start, n):
+        """Record n of the slot, None if it was overwritten"""
+        pos = start + SLOTHEADER.size + (n % self.depth)*RECORD.size
+        for attempt in range(RETRIES):
+            record = RECORD.unpack_from(self.map, pos)
+            seq = struct.unpack_from('<Q', self.map, pos)[0]
+            if record[0] == seq == 2*n + 2:
+                return record
+            if seq > 2*n + 2:
+                return None
+        return None
+
+    def _status(self, name, record):
+        seq, wall, index, state, u, f, tremain, offset, stage = record
+        return FeedStatus(_untext(name), STATES.get(state, state), wall,
+                          index, _untext(stage), u, f, tremain, offset)
+
+    def status(self):
+        """Latest status of every device, as FeedStatus
+
+        time is the wall clock time of the step (see time.time());
+        the time remaining now is tremain - (time.time() - time)
+        while the run is running.
+        """
+        latest = {}
+        for number in range(self.slots):
+            for attempt in range(RETRIES):
+                start, count, name = self._slot(number)
+                if not count:
+                    break
+                record = self._record(start, count - 1)
+                if record is not None:
+                    status = self._status(name, record)
+                    if (status.device not in latest or
+                        latest[status.device].time < status.time):
+                        latest[status.device] = status
+                    break
+        return sorted(latest.values())
+
+    def history(self, number):
+        """Records of the device in the given slot still in the ring,
+        oldest first, as FeedStatus"""
+        start, count, name = self._slot(number)
+        records = []
+        for n in range(max(0, count - self.depth), count):
+            record = self._record(start, n)
+            if record is not None:
+                records.append(self._status(name, record))
+        return records
+
+    def close(self):
+        self.map.close()
+
+
+def watch(filename=None, interval=0.5):
+    """Print the status of all devices every interval s, until Ctrl-C"""
+    reader = StatusReader(filename)
+    try:
+        while True:
+            print ' | '.join(['%s: %s %s %.2f Vpp %.2f Hz %.0f s'%(
+                              item.device, item.state, item.stage, item.u,
+                              item.f, item.tremain)
+                              for item in reader.status()])
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+
+
+if __name__ == '__main__':
+    import sys
+    watch(sys.argv[1] if len(sys.argv) > 1 else None)
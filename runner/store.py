@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Compact storage of protocol rows for editing.
+
+A ProtocolStore keeps every column of PROTOCOLCOLS in its own array
+of native values (arrays of doubles and ints for numbers, lists for text),
+so that protocols of tens of thousands of rows take little memory and
+are converted from strings only once, when typed in or loaded.
+Numeric cells may be empty, as the rows of a grid being edited are.
+
+"""
+from array import array
+
+from runner.protofile import PROTOCOLCOLS
+
+# array type codes of numeric column types
+TYPECODES = {float:'d', int:'l'}
+CONVERTMSG = 'Could not convert item at row %i, col %i to desired type'
+
+
+class ProtocolStore(object):
+    """Rows of a protocol kept by column in native types
+
+    nrows - number of empty rows to start with
+    """
+    def __init__(self, nrows=0):
+        self.clear(nrows)
+
+    def clear(self, nrows=0):
+        """Drop all values, leaving nrows empty rows"""
+        self.columns = []
+        for title, kind in PROTOCOLCOLS:
+            if kind in TYPECODES:
+                self.columns.append(array(TYPECODES[kind], [0]*nrows))
+            else:
+                self.columns.append([''] * nrows)
+        # which numeric cells hold a value, one bit per column
+        self.filled = array('l', [0]*nrows)
+
+    def __len__(self):
+        return len(self.filled)
+
+    def _numeric(self, col):
+        return PROTOCOLCOLS[col][1] in TYPECODES
+
+    def append_rows(self, nrows=1):
+        for col, column in enumerate(self.columns):
+            if self._numeric(col):
+                column.extend([0]*nrows)
+            else:
+                column.extend([''] * nrows)
+        self.filled.extend([0]*nrows)
+
+    def delete_rows(self, pos, nrows=1):
+        for column in self.columns:
+            del column[pos:pos + nrows]
+        del self.filled[pos:pos + nrows]
+
+    def is_empty(self, row, col):
+        if self._numeric(col):
+            return not self.filled[row] & (1 << col)
+        return not self.columns[col][row]
+
+    def is_empty_row(self, row):
+        return all(self.is_empty(row, col) for col in range(len(self.columns)))
+
+    def get(self, row, col):
+        """Value of a cell, None if it is empty"""
+        if self.is_empty(row, col) and self._numeric(col):
+            return None
+        return self.columns[col][row]
+
+    def set(self, row, col, value):
+        """Set a cell to a value of its column type, None empties it"""
+        if value is None or value == '':
+            if self._numeric(col):
+                self.filled[row] &= ~(1 << col)
+            else:
+                self.columns[col][row] = ''
+            return
+        self.columns[col][row] = PROTOCOLCOLS[col][1](value)
+        if self._numeric(col):
+            self.filled[row] |= 1 << col
+
+    def get_text(self, row, col):
+        """Value of a cell formatted for display, '' if it is empty"""
+        value = self.get(row, col)
+        if value is None:
+            return ''
+        elif isinstance(value, float):
+            return '%.12g'%value
+        return str(value)
+
+    def set_text(self, row, col, text):
+        """Set a cell from text
+
+        Raises ValueError if the text does not convert to the column type,
+        leaving the cell as it was.
+        """
+        try:
+            self.set(row, col, text.strip())
+        except ValueError:
+            raise ValueError(CONVERTMSG%(row, col))
+
+    def load(self, rows):
+        """Replace the content with rows of values or of strings
+
+        Raises ValueError naming the item which could not be converted,
+        the content is not changed then.
+        """
+        store = ProtocolStore(len(rows))
+        for rownum, row in enumerate(rows):
+            for colnum, value in enumerate(row):
+                if isinstance(value, basestring):
+                    store.set_text(rownum, colnum, value)
+                else:
+                    store.set(rownum, colnum, value)
+        self.columns = store.columns
+        self.filled = store.filled
+
+    def clean(self):
+        """Remove empty rows from the bottom, return how many were removed"""
+        nrows = len(self)
+        while nrows and self.is_empty_row(nrows - 1):
+            nrows -= 1
+        removed = len(self) - nrows
+        if removed:
+            self.delete_rows(nrows, removed)
+        return removed
+
+    def rows(self):
+        """All rows as lists of values
+
+        Raises ValueError naming the first empty numeric cell.
+        """
+        full = 0
+        for col in range(len(self.columns)):
+            if self._numeric(col):
+                full |= 1 << col
+        for row, filled in enumerate(self.filled):
+            if filled != full:
+                for col in range(len(self.columns)):
+                    if self.is_empty(row, col) and self._numeric(col):
+                        raise ValueError(CONVERTMSG%(row, col))
+        return [list(row) for row in zip(*self.columns)]
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Dedicated thread for all communication with a device.
+
+Calls to the device are submitted to the worker and performed one by one
+in its thread; the caller gets a Future to wait for or to be notified by,
+so a slow device never blocks the user interface.
+
+"""
+import sys
+import threading
+import Queue
+
+
+class Future(object):
+    """Result of a call performed by the worker"""
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._excinfo = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the call to finish and return its result
+
+        Re-raises the exception raised by the call.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Call to the device timed out')
+        if self._excinfo:
+            raise self._excinfo[0], self._excinfo[1], self._excinfo[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the call to finish, return its exception or None"""
+        if not self._done.wait(timeout):
+            raise RuntimeError('Call to the device timed out')
+        if self._excinfo:
+            return self._excinfo[1]
+
+    def add_done_callback(self, fn):
+        """Call fn(future) when done (in the worker thread), or right now"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, result=None, excinfo=None):
+        with self._lock:
+            self._result = result
+            self._excinfo = excinfo
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+
+class DeviceWorker(threading.Thread):
+    """Thread performing submitted calls one by one"""
+    def __init__(self, name='device worker'):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.calls = Queue.Queue()
+        self.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule func(*args, **kwargs) in the worker, return a Future"""
+        future = Future()
+        self.calls.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """Perform func(*args, **kwargs) in the worker and wait for result"""
+        if threading.current_thread() is self:
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def run(self):
+        while True:
+            item = self.calls.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                future._finish(excinfo=sys.exc_info())
+            else:
+                future._finish(result)
+
+    def stop(self, timeout=None):
+        """Finish pending calls and stop the thread"""
+        self.calls.put(None)
+        if threading.current_thread() is not self:
+            self.join(timeout)
@@ -11,7 +11,7 @@ about = {'name':'pyFuncGen',
 
 includes = []
 excludes=[]
-packages = ["devices", "visa", "serial"]
+packages = ["devices", "runner", "visa", "serial"]
 include_files = ['docs']
 
 gui_exe = Executable(script='wxfuncgen.pyw',
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Tests of pyfuncgen, run against the simulated instruments:
+    python -m unittest discover -s tests -t .
+
+"""
+import os
+
+from devices.simulator import ENVVAR
+# never touch real instruments while testing
+os.environ.setdefault(ENVVAR, '')
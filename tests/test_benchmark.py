@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import argparse
+import unittest
+
+import benchmark
+from devices.simulator import LatencyModel
+
+ARGS = dict(devices=list(benchmark.DEVICES), tracers=None, policy='catchup',
+            duration=0.3, dt=0.05, rows=3, points=5, calls=20, servers=2)
+
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.args = argparse.Namespace(**ARGS)
+        self.model = LatencyModel()
+
+    def test_summary(self):
+        self.assertEqual(benchmark.summary([]), {'count':0})
+        result = benchmark.summary([float(i) for i in range(100, 0, -1)])
+        self.assertEqual((result['count'], result['mean'], result['max']),
+                         (100, 50.5, 100.0))
+        self.assertEqual((result['p50'], result['p95'], result['p99']),
+                         (51.0, 96.0, 100.0))
+
+    def test_open_device(self):
+        tracers = []
+        for name in benchmark.DEVICES:
+            fg = benchmark.open_device(name, self.model, tracers)
+            self.assertTrue(fg.dev.model is self.model)
+            self.assertEqual(self.model.transfers, 0)
+            fg.apply(1000, 1.0)
+            self.assertTrue(self.model.transfers > 0)
+        self.assertEqual([tracer.name for tracer in tracers],
+                         list(benchmark.DEVICES))
+
+    def test_compare(self):
+        baseline = {'benchmarks':{'apply':{'calls':100, 'calls_per_s':1000.0,
+                                           'wall':0.1, 'commands':200,
+                                           'drift':0.00001}}}
+        results = {'benchmarks':{'apply':{'calls':50, 'calls_per_s':800.0,
+                                          'wall':0.105, 'commands':300,
+                                          'drift':0.00005, 'new':1.0}}}
+        self.assertEqual(sorted(benchmark.compare(results, baseline, 0.1)),
+                         [('apply/calls_per_s', 1000.0, 800.0),
+                          ('apply/commands', 200, 300)])
+        self.assertEqual(benchmark.compare(baseline, baseline, 0.1), [])
+
+    def test_leaves(self):
+        tree = {'a':{'b':1, 'c':{'d':0.5}, 'e':'text', 'f':True}, 'g':None}
+        self.assertEqual(list(benchmark.leaves(tree)),
+                         [('a/b', 1), ('a/c/d', 0.5)])
+
+    def test_csv(self):
+        results = benchmark.bench_csv(self.args, self.model)
+        self.assertEqual((results['rows'], results['steps']), (3, 15))
+        for name in benchmark.DEVICES:
+            self.assertEqual(results[name]['steps'], 15)
+            self.assertTrue(results[name]['commands'] >= 15)
+
+    def test_apply(self):
+        results = benchmark.bench_apply(self.args, self.model)
+        for name in benchmark.DEVICES:
+            for method in ('apply', 'apply_formatted'):
+                item = results[name][method]
+                self.assertEqual(item['latency']['count'], 20)
+                self.assertTrue(item['commands'] >= 20)
+
+    def test_socket(self):
+        results = benchmark.bench_socket(self.args, self.model)
+        self.assertEqual(results['ask']['latency']['count'], 20)
+        self.assertEqual(results['query_all']['instruments'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
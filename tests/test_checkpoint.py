@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from runner.checkpoint import Checkpoint, TMPEXT, BAKEXT
+from runner.compiler import Protocol
+from runner.execute import ProtocolRun
+
+# 10 steps of 0.03 s
+ROWS = [('Growing', 0.003, 0.5, 10.0, 1.4, 10.0, 6, 'lin'),
+        ('Detaching', 0.002, 1.4, 10.0, 1.4, 5.0, 4, 'lin')]
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'run.ckpt')
+        self.checkpoint = Checkpoint(self.filename)
+        self.protocol = Protocol(ROWS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        self.assertEqual(self.checkpoint.load(), None)
+        self.checkpoint.save('abc', 3, 1.5)
+        data = self.checkpoint.load()
+        self.assertEqual((data['protocol'], data['index'], data['elapsed']),
+                         ('abc', 3, 1.5))
+        self.checkpoint.save('abc', 4, 2.0)
+        self.assertEqual(self.checkpoint.load()['index'], 4)
+        self.assertEqual(os.listdir(self.dir), ['run.ckpt'])
+        self.checkpoint.clear()
+        self.assertEqual(self.checkpoint.load(), None)
+
+    def test_load_falls_back(self):
+        self.checkpoint.save('abc', 3, 1.5)
+        # died while replacing the checkpoint on Windows
+        os.rename(self.filename, self.filename + BAKEXT)
+        self.assertEqual(self.checkpoint.load()['index'], 3)
+        with open(self.filename + TMPEXT, 'wb') as f:
+            f.write(json.dumps({'version':1, 'protocol':'abc', 'index':4,
+                                'elapsed':2.0, 'time':0}))
+        self.assertEqual(self.checkpoint.load()['index'], 4)
+        with open(self.filename, 'wb') as f:
+            f.write('{"version": 1, "prot')
+        self.assertEqual(self.checkpoint.load()['index'], 4)
+        self.checkpoint.save('abc', 5, 2.5)
+        self.assertEqual(self.checkpoint.load()['index'], 5)
+        self.checkpoint.clear()
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_resume_point(self):
+        self.assertEqual(self.checkpoint.resume_point(self.protocol),
+                         (0, None))
+        self.checkpoint.save(self.protocol.digest, 2, 0.1)
+        # the step active at the elapsed time
+        self.assertEqual(self.checkpoint.resume_point(self.protocol),
+                         (3, 0.1))
+        self.checkpoint.save(self.protocol.digest, 7, 0.1)
+        self.assertEqual(self.checkpoint.resume_point(self.protocol),
+                         (7, 0.1))
+        self.checkpoint.save('another protocol', 7, 0.1)
+        self.assertEqual(self.checkpoint.resume_point(self.protocol),
+                         (0, None))
+        # the last step, at the end of the protocol
+        self.checkpoint.save(self.protocol.digest, 9, 100)
+        self.assertEqual(self.checkpoint.resume_point(self.protocol),
+                         (9, self.protocol.duration))
+        self.checkpoint.save(self.protocol.digest, 10, 100)
+        self.assertEqual(self.checkpoint.resume_point(self.protocol),
+                         (0, None))
+
+    def test_resume_run(self):
+        fg = Agilent33220A('test device 1')
+        fg.connect()
+        applied = []
+        def display(state):
+            applied.append(state.index)
+            if state.index == 4 and applied.count(4) == 1:
+                # as if the program died after the step
+                run.stop()
+        run = ProtocolRun(fg, self.protocol, display=display,
+                          checkpoint=self.checkpoint)
+        run.run()
+        self.assertEqual(applied, range(5))
+        index, elapsed = self.checkpoint.resume_point(self.protocol)
+        self.assertEqual(index, 4)
+        self.assertTrue(0.12 <= elapsed < self.protocol.duration)
+        run = ProtocolRun(fg, self.protocol, display=display,
+                          checkpoint=self.checkpoint)
+        stats = run.run(index, elapsed=elapsed)
+        self.assertEqual(applied, range(5) + range(4, 10))
+        self.assertEqual(stats.steps, 6)
+        self.assertAlmostEqual(fg.freq, 5.0)
+        # the finished run is not resumed
+        self.assertEqual(self.checkpoint.load(), None)
+        fg.disconnect()
+        fg.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
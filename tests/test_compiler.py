@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from runner.compiler import Protocol, Stage, three_stages
+
+ROWS = [('Growing', 1, 0.5, 10.0, 1.5, 10.0, 60, 'lin'),
+        ('Resting', 0.5, 1.5, 10.0, 1.5, 10.0, 1, 'lin'),
+        ('Detaching', 1, 1.5, 10.0, 1.5, 5.0, 30, 'exp')]
+
+
+class StageTest(unittest.TestCase):
+    def test_linear_ramp(self):
+        stage = Stage('ramp', 1, 1.0, 100.0, 2.0, 200.0, 11)
+        first, last = stage.state(0), stage.state(10)
+        self.assertEqual((first.u, first.f), (1.0, 100.0))
+        self.assertAlmostEqual(last.u, 2.0)
+        self.assertAlmostEqual(last.f, 200.0)
+        self.assertAlmostEqual(stage.dT, 60/11.0)
+        self.assertAlmostEqual(stage.state(5).tremain, 60 - 5*60/11.0)
+
+    def test_wrong_number_of_states(self):
+        self.assertRaises(ValueError, Stage, 'x', 1, 1, 10, 2, 10, 1)
+        self.assertRaises(ValueError, Stage, 'x', 1, 1, 10, 2, 10, -1)
+        self.assertRaises(ValueError, Stage, 'x', 1, 1, 10, 2, 10, 10,
+                          'nonsense')
+
+    def test_sweep(self):
+        self.assertEqual(Stage('x', 1, 1, 10, 1, 20, 10, 'log').sweep, 'LOG')
+        self.assertEqual(Stage('x', 1, 1, 10, 2, 20, 10).sweep, None)
+        self.assertEqual(Stage('x', 1, 1, 10, 1, 20, 10, 'exp').sweep, None)
+
+
+class ProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.protocol = Protocol(ROWS)
+
+    def test_length_and_duration(self):
+        self.assertEqual(len(self.protocol), 91)
+        self.assertEqual(self.protocol.duration, 150)
+        self.assertEqual(len(list(self.protocol)), 91)
+
+    def test_random_access_matches_iteration(self):
+        states = list(self.protocol)
+        for index in (0, 59, 60, 61, 90, -1):
+            self.assertEqual(self.protocol.state(index), states[index])
+        self.assertEqual(list(self.protocol.iterstates(75)), states[75:])
+        self.assertEqual(list(self.protocol.iterstates(91)), [])
+        self.assertRaises(IndexError, self.protocol.state, 91)
+
+    def test_states_are_continuous(self):
+        states = list(self.protocol)
+        for state, following in zip(states, states[1:]):
+            self.assertAlmostEqual(state.offset + state.dt, following.offset)
+        self.assertEqual(states[60].stage, 'Resting')
+        self.assertEqual(states[60].offset, 60)
+
+    def test_index_at(self):
+        self.assertEqual(self.protocol.index_at(0), 0)
+        self.assertEqual(self.protocol.index_at(59.5), 59)
+        self.assertEqual(self.protocol.index_at(80), 60)
+        self.assertEqual(self.protocol.index_at(92.5), 62)
+        self.assertEqual(self.protocol.index_at(1e6), 90)
+
+    def test_lazy_is_the_same(self):
+        lazy = Protocol(ROWS, lazy=True)
+        self.assertEqual(list(lazy), list(self.protocol))
+        self.assertEqual(lazy.digest, self.protocol.digest)
+
+    def test_digest(self):
+        changed = list(ROWS)
+        changed[1] = ('Resting', 0.5, 1.5, 10.0, 1.5, 10.0, 1, 'lin')
+        self.assertEqual(Protocol(changed).digest, self.protocol.digest)
+        changed[1] = ('Resting', 0.5, 1.4, 10.0, 1.4, 10.0, 1, 'lin')
+        self.assertNotEqual(Protocol(changed).digest, self.protocol.digest)
+
+
+class ThreeStagesTest(unittest.TestCase):
+    def test_rows(self):
+        rows = three_stages(0.1, 2.0, 10, 4, 60, 0, 5, 30)
+        self.assertEqual([row[0] for row in rows], ['Growing', 'Detaching'])
+        self.assertEqual(rows[0][6], 120)
+        self.assertEqual(rows[1][6], 10)
+        self.assertEqual(len(Protocol(rows)), 130)
+
+    def test_adaptive_rows(self):
+        rows = three_stages(0.1, 2.0, 10, 4, 60, 30, 5, 30, adaptive=True)
+        self.assertEqual([row[6] for row in rows], [0, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import Queue
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from runner.daemon import Daemon
+from runner.remote import (Client, RemoteDevice, DaemonError, key_file,
+                           open_socket, encode)
+
+ADDRESS = 'test device 1'
+# 3 s, 30 steps
+ROWS = [['Growing', 0.05, 0.5, 10.0, 1.4, 10.0, 30, 'lin']]
+TIMEOUT = 5.0 # s
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.daemon = Daemon(os.path.join(self.dir, 'daemon.sock')).start()
+        self.client = Client(self.daemon.address)
+        self.events = Queue.Queue()
+        self.client.subscribe(self.events.put)
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon.shutdown()
+        shutil.rmtree(self.dir)
+
+    def wait_for(self, event, **values):
+        """Next event of the kind with the given values"""
+        deadline = time.time() + TIMEOUT
+        while True:
+            message = self.events.get(timeout=max(0, deadline -
+                                                  time.time()))
+            if message['event'] == event and all(
+                message.get(key) == value for key, value in values.items()):
+                return message
+
+    def state(self):
+        status, = self.client.call('status')
+        return status['state']
+
+    def test_device(self):
+        fg = RemoteDevice(ADDRESS, self.client)
+        self.assertEqual(fg.ampldigits, 4)
+        self.assertEqual(fg.freqrange, (1e-6, 2e7))
+        fg.freq = 1234.5
+        self.assertEqual(fg.freq, 1234.5)
+        with fg.batch():
+            fg.apply(500, 1.5)
+            fg.set_display('batch')
+        self.assertEqual((fg.freq, fg.ampl), (500, 1.5))
+        event = self.wait_for('changed', device=ADDRESS)
+        self.assertEqual(event['operations'], [['set', 'freq', [1234.5]]])
+        event = self.wait_for('changed', device=ADDRESS)
+        self.assertEqual([op[1] for op in event['operations']],
+                         ['apply', 'set_display'])
+        self.assertRaises(DaemonError, self.client.call, 'get',
+                          address=ADDRESS, name='dev')
+        fg.close()
+
+    def remote(self):
+        """Whether the instrument is in remote control"""
+        return self.daemon.sessions[ADDRESS].fg.dev.remote
+
+    def test_last_client_returns_to_local(self):
+        first = RemoteDevice(ADDRESS, self.client)
+        first.connect()
+        second = RemoteDevice(ADDRESS, Client(self.daemon.address))
+        second.connect()
+        first.disconnect()
+        self.assertTrue(self.remote())
+        second.close()
+        self.assertFalse(self.remote())
+        self.assertEqual(self.client.call('status')[0]['users'], 0)
+        first.connect()
+        self.assertTrue(self.remote())
+        first.close()
+        second.client.close()
+
+    def test_run_returns_to_local_when_released(self):
+        fg = RemoteDevice(ADDRESS, self.client)
+        self.client.call('run', address=ADDRESS, rows=ROWS[:1])
+        fg.close()
+        # the run goes on
+        self.assertTrue(self.remote())
+        self.wait_for('step', index=1)
+        self.client.call('stop', address=ADDRESS)
+        self.assertFalse(self.remote())
+
+    def test_run_pause_resume(self):
+        steps = self.client.call('run', address=ADDRESS, rows=ROWS)
+        self.assertEqual(steps, 30)
+        self.wait_for('run', state='running')
+        self.wait_for('step', index=2)
+        self.client.call('pause', address=ADDRESS)
+        self.wait_for('run', state='paused')
+        index = self.client.call('status')[0]['index']
+        time.sleep(0.5)
+        # nothing is performed while paused
+        self.assertEqual(self.client.call('status')[0]['index'], index)
+        while not self.events.empty():
+            self.assertNotEqual(self.events.get()['event'], 'step')
+        self.client.call('resume', address=ADDRESS)
+        event = self.wait_for('run', state='finished')
+        self.assertEqual(event['error'], None)
+        self.assertTrue(event['stats'].startswith('30 steps'))
+        self.assertEqual(self.state(), 'finished')
+        fg = RemoteDevice(ADDRESS, self.client)
+        self.assertEqual(fg.output, False)
+        self.assertAlmostEqual(fg.ampl, 1.4)
+
+    def test_stop_paused_run(self):
+        self.client.call('run', address=ADDRESS, rows=ROWS)
+        self.wait_for('step', index=1)
+        self.client.call('pause', address=ADDRESS)
+        started = time.time()
+        self.client.call('stop', address=ADDRESS)
+        self.assertTrue(time.time() - started < 1.0)
+        self.wait_for('run', state='stopped')
+        self.assertEqual(self.state(), 'stopped')
+        self.assertRaises(DaemonError, self.client.call, 'pause',
+                          address=ADDRESS)
+
+    def test_one_run_at_a_time(self):
+        self.client.call('run', address=ADDRESS, rows=ROWS)
+        self.assertRaises(DaemonError, self.client.call, 'run',
+                          address=ADDRESS, rows=ROWS)
+        self.client.call('stop', address=ADDRESS)
+
+    def test_run_out_of_limits(self):
+        rows = [['Too high', 0.05, 0.5, 10.0, 40.0, 10.0, 30, 'lin']]
+        self.assertRaises(DaemonError, self.client.call, 'run',
+                          address=ADDRESS, rows=rows)
+        self.assertEqual(self.state(), 'idle')
+
+
+class TCPDaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.daemon = Daemon(('127.0.0.1', 0)).start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+
+    def request(self, *requests):
+        """Replies to requests sent on a raw connection, None once closed"""
+        sock = open_socket(self.daemon.address)
+        reader = sock.makefile('rb')
+        replies = []
+        for request in requests:
+            try:
+                sock.sendall(encode(request))
+                line = reader.readline()
+            except socket.error:
+                line = ''
+            replies.append(json.loads(line) if line else None)
+        sock.close()
+        return replies
+
+    def test_key_file(self):
+        filename = key_file(self.daemon.address)
+        self.assertEqual(os.stat(filename).st_mode & 0777, 0600)
+        self.daemon.shutdown()
+        self.assertFalse(os.path.exists(filename))
+        self.daemon = Daemon(('127.0.0.1', 0)).start()
+
+    def test_client_sends_the_key(self):
+        client = Client(self.daemon.address)
+        self.assertEqual(client.call('ping'), 'pong')
+        client.close()
+
+    def test_requests_without_key_are_refused(self):
+        reply, closed = self.request({'id':1, 'cmd':'ping'},
+                                     {'id':2, 'cmd':'ping'})
+        self.assertTrue('Not authorized' in reply['error'])
+        self.assertEqual(closed, None)
+        reply, closed = self.request({'id':1, 'cmd':'auth', 'key':'guess'},
+                                     {'id':2, 'cmd':'ping'})
+        self.assertEqual(reply['error'], 'Wrong key')
+        self.assertEqual(closed, None)
+        auth, ping = self.request({'id':1, 'cmd':'auth',
+                                   'key':self.daemon.key},
+                                  {'id':2, 'cmd':'ping'})
+        self.assertEqual(ping['result'], 'pong')
+
+    def test_client_without_key(self):
+        os.remove(key_file(self.daemon.address))
+        self.assertRaises(socket.error, Client, self.daemon.address)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from devices import discovery as discovery_module
+from devices import VISA, SERIAL
+from devices.discovery import (Discovery, DeviceInfo, run_parallel,
+                               probe_visa, probe_serial)
+
+
+class RunParallelTest(unittest.TestCase):
+    def test_results(self):
+        def fail():
+            raise IOError('no device')
+        jobs = {'a':(lambda x: x*2, (2,)), 'b':(fail, ()),
+                'c':(time.sleep, (5,))}
+        start = time.time()
+        self.assertEqual(run_parallel(jobs, 0.1), {'a':4})
+        self.assertTrue(time.time() - start < 1)
+
+    def test_jobs_run_at_once(self):
+        barrier = threading.Semaphore(0)
+        def meet():
+            barrier.release()
+            time.sleep(0.05)
+            return barrier.acquire(False)
+        results = run_parallel(dict((i, (meet, ())) for i in range(3)), 5)
+        self.assertEqual(results, {0:True, 1:True, 2:True})
+
+
+class DiscoveryTest(unittest.TestCase):
+    """Discovery with stand-in enumerators and probes"""
+    def setUp(self):
+        self.listed = []
+        self.probed = []
+        self.saved = (dict(discovery_module.ENUMERATORS),
+                      dict(discovery_module.PROBES))
+        discovery_module.ENUMERATORS.update({VISA:self.list_visa,
+                                             SERIAL:self.list_ports})
+        discovery_module.PROBES.update({VISA:self.probe, SERIAL:self.probe})
+        self.discovery = Discovery(ttl=60, timeout=0.2)
+
+    def tearDown(self):
+        discovery_module.ENUMERATORS.update(self.saved[0])
+        discovery_module.PROBES.update(self.saved[1])
+
+    def list_visa(self):
+        self.listed.append(VISA)
+        return ['GPIB0::10', 'GPIB0::11']
+
+    def list_ports(self):
+        self.listed.append(SERIAL)
+        return ['COM1']
+
+    def probe(self, address, timeout):
+        self.probed.append(address)
+        if address == 'GPIB0::11':
+            time.sleep(timeout*5)
+        return {'GPIB0::10':'Agilent Technologies,33220A,MY1,2.02',
+                'COM1':'THURLBY THANDAR,TGA1230,0,1.00'}.get(address)
+
+    def test_devices_are_identified(self):
+        devices = self.discovery.devices()
+        self.assertEqual([(info.address, info.transport) for info in devices],
+                         [('GPIB0::10', VISA), ('GPIB0::11', VISA),
+                          ('COM1', SERIAL)])
+        self.assertEqual([info.driver for info in devices],
+                         ['Agilent33220A', None, 'TtiTga1230'])
+        self.assertEqual(str(devices[0]),
+                         'GPIB0::10 (Agilent Technologies 33220A)')
+        self.assertEqual(str(devices[1]), 'GPIB0::11')
+
+    def test_results_are_cached(self):
+        self.discovery.devices()
+        self.discovery.devices()
+        self.assertEqual(sorted(self.listed), sorted([VISA, SERIAL]))
+        self.assertEqual(sorted(self.probed), ['COM1', 'GPIB0::10',
+                                               'GPIB0::11'])
+        self.discovery.devices(refresh=True)
+        self.assertEqual(len(self.listed), 4)
+        self.assertEqual(len(self.probed), 6)
+
+    def test_cache_expires(self):
+        self.discovery.ttl = 0
+        self.discovery.addresses([VISA])
+        self.discovery.addresses([VISA])
+        self.assertEqual(self.listed, [VISA, VISA])
+
+    def test_addresses_are_not_probed(self):
+        self.assertEqual(self.discovery.addresses([SERIAL]), ['COM1'])
+        self.assertEqual(self.probed, [])
+
+    def test_excluded_are_not_probed(self):
+        devices = self.discovery.devices([VISA], exclude=['GPIB0::11'])
+        self.assertEqual(self.probed, ['GPIB0::10'])
+        self.assertEqual(devices[1].idn, None)
+
+
+class SimulatedProbeTest(unittest.TestCase):
+    def test_probes(self):
+        info = DeviceInfo('test device 1', VISA,
+                          probe_visa('test device 1', 0.5))
+        self.assertEqual(info.driver, 'Agilent33220A')
+        info = DeviceInfo('SIM1', SERIAL, probe_serial('SIM1', 0.5))
+        self.assertEqual(info.driver, 'TtiTga1230')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy
+
+from devices import drivers, get_driver
+from devices.Agilent33220A import Agilent33220A
+from devices.TtiTga1230 import TtiTga1230
+from devices.binblock import binblock, block_end, parse_binblock
+
+# addresses of simulated devices, by driver
+SIMULATED = {'Agilent33220A':'test device 1', 'TtiTga1230':'SIM1'}
+
+
+class CountingDevice(object):
+    """Instrument counting the transfers to it"""
+    def __init__(self, dev):
+        self.dev = dev
+        self.written = []
+        self.asked = []
+
+    def write(self, cmd):
+        self.written.append(cmd)
+        self.dev.write(cmd)
+
+    def ask(self, query):
+        self.asked.append(query)
+        return self.dev.ask(query)
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+
+class Agilent33220ATest(unittest.TestCase):
+    def setUp(self):
+        self.fg = Agilent33220A('test device 1')
+        self.sim = self.fg.dev
+        self.fg.dev = self.dev = CountingDevice(self.sim)
+        self.fg.connect()
+
+    def tearDown(self):
+        self.fg.disconnect()
+        self.fg.close()
+
+    def test_connect_reads_the_state(self):
+        self.sim.freq = 1234.0
+        self.fg.connect()
+        self.assertEqual(self.fg.freq, 1234.0)
+        self.assertEqual(self.fg.cache['mode'], 'SIN')
+
+    def test_reads_are_cached(self):
+        del self.dev.asked[:]
+        self.fg.freq, self.fg.ampl, self.fg.offset, self.fg.output
+        self.assertEqual(self.dev.asked, [])
+
+    def test_unchanged_values_are_not_written(self):
+        self.fg.freq = 500
+        del self.dev.written[:]
+        self.fg.freq = 500.0000001
+        self.fg.output = self.fg.output
+        self.assertEqual(self.dev.written, [])
+        self.fg.freq = 501
+        self.assertEqual(self.dev.written, ['FREQ 501.000000'])
+        self.assertEqual(self.sim.freq, 501)
+
+    def test_syncinterval(self):
+        fg = Agilent33220A('test device 2', syncinterval=60)
+        fg.connect()
+        fg.dev.freq = 2000.0
+        self.assertEqual(fg.freq, 1000.0)
+        # the interval is over
+        fg.synctime -= 61
+        self.assertEqual(fg.freq, 2000.0)
+        self.assertEqual(fg.cache['freq'], 2000.0)
+        fg.close()
+
+    def test_upload(self):
+        wave = numpy.sin(numpy.linspace(0, 2*numpy.pi, 1000))
+        self.fg.upload(wave)
+        self.assertEqual(list(self.sim.volatile),
+                         list(numpy.rint(wave*8191).astype(int)))
+        self.assertEqual(self.fg.cache['mode'], 'USER')
+        self.assertEqual(self.fg.ask('FUNC?').strip(), 'USER')
+        self.assertRaises(ValueError, self.fg.upload, wave*2)
+        self.assertRaises(ValueError, self.fg.upload, [])
+
+
+class TtiTga1230Test(unittest.TestCase):
+    def test_upload(self):
+        fg = TtiTga1230('SIM1', rtscts=True, xonxoff=False)
+        fg.connect()
+        codes = numpy.arange(-2000, 2000, 4)
+        fg.upload(codes, 'RAMP')
+        self.assertEqual(fg.dev.arbs['RAMP'], list(codes))
+        self.assertEqual(fg.dev.arb, 'RAMP')
+        self.assertEqual(fg.mode, 'ARB')
+        fg.close()
+
+    def test_upload_with_xonxoff(self):
+        fg = TtiTga1230('SIM1')
+        # 0x11 is XON
+        self.assertRaises(IOError, fg.upload, numpy.array([0x11]*8))
+        fg.close()
+
+
+class BinblockTest(unittest.TestCase):
+    def test_message(self):
+        message = binblock(numpy.array([1, -2, 258]), '<i2', 'DATA ', '\n')
+        self.assertTrue(isinstance(message, bytearray))
+        self.assertEqual(str(message), 'DATA #16\x01\x00\xfe\xff\x02\x01\n')
+        self.assertEqual(str(binblock([1, 2], '>i2')), '#14\x00\x01\x00\x02')
+        self.assertEqual(str(binblock([], '<i2', 'X')), 'X#10')
+
+    def test_parse(self):
+        text = 'DATA #210' + '0123456789' + ';:NEXT'
+        self.assertEqual(block_end(text, 5), 19)
+        self.assertEqual(parse_binblock(text, 5), '0123456789')
+        self.assertRaises(ValueError, block_end, text[:15], 5)
+        self.assertRaises(ValueError, block_end, '#0abc', 0)
+
+
+class RegistryTest(unittest.TestCase):
+    def test_capabilities_match_drivers(self):
+        self.assertEqual(sorted([info.name for info in drivers()]),
+                         sorted(SIMULATED))
+        for info in drivers():
+            fg = info.load()(SIMULATED[info.name])
+            self.assertEqual(info.mismatches(fg), [])
+            info.check(fg)
+            fg.close()
+
+    def test_check_finds_mismatches(self):
+        info = get_driver('Agilent33220A')
+        fg = info.load()(SIMULATED[info.name])
+        fg.maxampl = 10
+        fg.supports_sweep = False
+        self.assertEqual(info.mismatches(fg),
+                         [('maxampl', 5, 10), ('sweep', True, False)])
+        self.assertRaises(ValueError, info.check, fg)
+        fg.close()
+
+    def test_unknown_driver(self):
+        self.assertRaises(KeyError, get_driver, 'HP33120A')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from devices.errorqueue import parse_error, CheckedError
+from devices.sockethelper import serve, ConnectionPool, SocketInstrument
+from runner.compiler import Protocol
+from runner.execute import ProtocolRun
+
+
+class ParseErrorTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_error('+0,"No error"\n'), (0, 'No error'))
+        self.assertEqual(parse_error('-222,"Data out of range"'),
+                         (-222, 'Data out of range'))
+        self.assertRaises(ValueError, parse_error, 'OK')
+
+    def test_str(self):
+        self.assertEqual(str(CheckedError(-113, 'Undefined header', 4)),
+                         'Error -113 "Undefined header" at step 4')
+        self.assertEqual(str(CheckedError(-113, 'Undefined header', 4, 6)),
+                         'Error -113 "Undefined header" at steps 4-6')
+
+
+class PipelinedChecksTest(unittest.TestCase):
+    """Checks sent along with the commands, over a raw socket"""
+    def setUp(self):
+        self.server = serve()
+        self.pool = ConnectionPool()
+        self.fg = Agilent33220A(self.server.address)
+        self.fg.dev = SocketInstrument(self.server.address, pool=self.pool)
+        self.fg.connect()
+        self.assertTrue(self.fg.pipelined)
+
+    def tearDown(self):
+        self.fg.close()
+        self.pool.close()
+        self.server.stop()
+
+    def test_clean_replies(self):
+        for index in range(3):
+            self.fg.apply(100 + index, 1.0)
+            self.fg.check(index)
+        self.assertEqual(len(self.fg.checks), 3)
+        self.assertEqual(self.fg.errors(), [])
+        self.assertEqual(len(self.fg.checks), 0)
+
+    def test_error_reply_is_mapped_to_its_step(self):
+        self.fg.apply(100, 1.0)
+        self.fg.check(0)
+        self.fg.write('FREQ:NONSENSE 1')
+        self.fg.check(1)
+        self.fg.apply(200, 1.0)
+        self.fg.check(2)
+        errors = self.fg.errors()
+        self.assertEqual([(err.code, err.first, err.last) for err in errors],
+                         [(-113, 1, 1)])
+
+    def test_queued_errors_are_drained(self):
+        with self.fg.batch():
+            self.fg.write('FREQ:NONSENSE 1')
+            self.fg.write('VOLT:NONSENSE 1')
+            self.fg.write('FREQ 1e12')
+            self.fg.check(5)
+        errors = self.fg.errors()
+        self.assertEqual([(err.code, err.first) for err in errors],
+                         [(-113, 5), (-113, 5), (-222, 5)])
+        self.assertEqual(self.fg.errors(), [])
+        # the queue is empty
+        self.assertEqual(parse_error(self.fg.ask('SYST:ERR?'))[0], 0)
+
+    def test_checks_do_not_disturb_queries(self):
+        self.fg.apply(300, 1.0)
+        self.fg.check(0)
+        self.assertEqual(float(self.fg.ask('FREQ?')), 300)
+        self.assertEqual(self.fg.errors(), [])
+
+    def test_run(self):
+        rows = [('Growing', 0.002, 0.5, 10.0, 1.4, 10.0, 4, 'lin')]
+        run = ProtocolRun(self.fg, Protocol(rows), verify=0)
+        run.run()
+        self.assertEqual(run.deviceerrors, [])
+
+
+class UnpipelinedChecksTest(unittest.TestCase):
+    """Error queue read by errors(), over VISA"""
+    def setUp(self):
+        self.fg = Agilent33220A('test device 1')
+        self.fg.connect()
+        self.assertFalse(self.fg.pipelined)
+
+    def tearDown(self):
+        self.fg.close()
+
+    def test_clean(self):
+        self.fg.apply(100, 1.0)
+        self.fg.check(0)
+        self.assertEqual(self.fg.errors(), [])
+
+    def test_errors_are_mapped_to_the_checks_since_last_read(self):
+        self.fg.check(0)
+        self.fg.write('FREQ:NONSENSE 1')
+        self.fg.check(1)
+        self.fg.write('FREQ 1e12')
+        self.fg.check(2)
+        errors = self.fg.errors()
+        self.assertEqual([(err.code, err.first, err.last) for err in errors],
+                         [(-113, 0, 2), (-222, 0, 2)])
+        self.assertEqual(self.fg.errors(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from runner.compiler import Protocol
+from runner.orchestra import Orchestrator, FINISHED, FAILED, STOPPED
+
+ROWS = [('Growing', 0.002, 0.5, 10.0, 1.4, 10.0, 4, 'lin')]
+
+
+class OrchestratorTest(unittest.TestCase):
+    def tearDown(self):
+        for fg in self.orchestra.devices:
+            fg.close()
+
+    def test_runs_on_all_devices(self):
+        self.orchestra = Orchestrator()
+        shown = []
+        self.orchestra.display = lambda fg, state: shown.append(state.index)
+        protocol = Protocol(ROWS)
+        for address in ('test device 1', 'test device 2'):
+            self.orchestra.add_device(Agilent33220A, address, protocol)
+        statuses = self.orchestra.run()
+        self.assertEqual([status.state for status in statuses],
+                         [FINISHED, FINISHED])
+        self.assertEqual(sorted(shown), sorted(range(4)*2))
+        for fg in self.orchestra.devices:
+            self.assertAlmostEqual(fg.dev.ampl, 1.4)
+
+    def test_failed_device_does_not_stop_the_others(self):
+        self.orchestra = Orchestrator()
+        protocol = Protocol(ROWS)
+        self.orchestra.add_device(Agilent33220A, 'test device 1', protocol)
+        def opener():
+            raise IOError('could not connect to device')
+        self.orchestra.add(opener, protocol, 'broken')
+        first, second = self.orchestra.run()
+        self.assertEqual(first.state, FINISHED)
+        self.assertEqual(second.state, FAILED)
+        self.assertTrue(isinstance(second.error, IOError))
+
+    def test_stop(self):
+        self.orchestra = Orchestrator()
+        rows = [('Growing', 1, 0.5, 10.0, 1.4, 10.0, 60, 'lin')]
+        self.orchestra.add_device(Agilent33220A, 'test device 1',
+                                  Protocol(rows))
+        self.orchestra.start()
+        self.orchestra.stop()
+        self.orchestra.join(5)
+        self.assertFalse(self.orchestra.alive())
+        self.assertEqual(self.orchestra.statuses[0].state, STOPPED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from runner import planner
+from devices import get_driver
+from runner.compiler import Protocol, Stage, resolution
+
+ROWS = [('Growing', 1, 0.5, 10.0, 1.5, 10.0, 5000, 'lin'),
+        ('Detaching', 1, 1.5, 10.0, 1.5, 5.0, 30, 'log')]
+
+
+class PlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.fg = Agilent33220A('test device 1')
+        self.fg.connect()
+
+    def tearDown(self):
+        self.fg.disconnect()
+        self.fg.close()
+
+    def test_planned_states_match_compiled(self):
+        protocol = Protocol(ROWS)
+        planned = list(planner.iterplanned(protocol, self.fg))
+        self.assertEqual(len(planned), len(protocol))
+        for (state, fstr, ustr), expected in zip(planned, protocol):
+            self.assertEqual(state.index, expected.index)
+            self.assertEqual(state.stage, expected.stage)
+            self.assertAlmostEqual(state.u, expected.u)
+            self.assertAlmostEqual(state.f, expected.f)
+            self.assertAlmostEqual(state.offset, expected.offset)
+            self.assertEqual(fstr, self.fg.freqacc%expected.f)
+            self.assertEqual(ustr, self.fg.amplacc%expected.u)
+
+    def test_planned_from_the_middle(self):
+        protocol = Protocol(ROWS)
+        planned = list(planner.iterplanned(protocol, self.fg, 4990))
+        self.assertEqual([item[0].index for item in planned],
+                         range(4990, len(protocol)))
+
+    def test_planned_values_are_clipped(self):
+        rows = [('Too high', 1, 1.0, 1e3, 20.0, 1e3, 10, 'lin'),
+                ('Too fast', 1, 1.0, 1e3, 1.0, 1e9, 10, 'lin')]
+        planned = list(planner.iterplanned(Protocol(rows), self.fg, offset=1))
+        fmin, fmax = self.fg.freqrange
+        self.assertEqual(planned[9][0].u, 20.0)
+        self.assertEqual(planned[9][2],
+                         self.fg.amplacc%(2*(self.fg.maxampl - 1)))
+        self.assertEqual(planned[19][0].f, 1e9)
+        self.assertEqual(planned[19][1], self.fg.freqacc%fmax)
+        # the same values as apply() sets
+        self.fg.offset = 1
+        self.fg.apply(1e9, 20.0)
+        self.assertEqual((self.fg.dev.freq, self.fg.dev.ampl),
+                         (float(planned[19][1]), float(planned[9][2])))
+
+    def test_validate(self):
+        planner.validate(Protocol(ROWS), self.fg, offset=0)
+        rows = [('Too high', 1, 1.0, 1e3, 20.0, 1e3, 10, 'lin'),
+                ('Too fast', 1, 1.0, 1e3, 1.0, 1e9, 10, 'lin')]
+        try:
+            planner.validate(Protocol(rows), self.fg, offset=0)
+        except planner.LimitError, err:
+            self.assertEqual(err.total, 14)
+            self.assertEqual(len(err.violations), planner.MAXREPORTED)
+            self.assertEqual(err.violations[0][1], 'Too high')
+            self.assertTrue('amplitude' in err.violations[0][2])
+        else:
+            self.fail('LimitError not raised')
+
+    def test_validate_with_offset(self):
+        rows = [('Offset', 1, 4.0, 1e3, 4.0, 1e3, 1, 'lin')]
+        planner.validate(Protocol(rows), self.fg, offset=0)
+        self.assertRaises(planner.LimitError, planner.validate,
+                          Protocol(rows), self.fg, offset=3.5)
+
+
+class AdaptiveTest(unittest.TestCase):
+    def test_values_stay_within_tolerance(self):
+        tolerance = resolution(get_driver('Agilent33220A'))
+        self.assertEqual(tolerance, (1e-4, 1e-6))
+        stage = Stage('Growing', 10, 1.0, 10.0, 1.01, 10.0, 0, 'exp',
+                      tolerance=tolerance, mindt=0.1)
+        self.assertEqual(stage.Ngrid, 6000)
+        self.assertTrue(2 < len(stage) < stage.Ngrid)
+        exact = Stage('Growing', 10, 1.0, 10.0, 1.01, 10.0, 6000, 'exp')
+        for i in range(len(stage) - 1):
+            state = stage.state(i)
+            # every grid point until the next kept one
+            first = int(round(state.offset / exact.dT))
+            last = int(round((state.offset + state.dt) / exact.dT))
+            for k in range(first, last):
+                self.assertTrue(abs(exact.ramp(1.0, 1.01, k/5999.0) -
+                                    state.u) <= tolerance[0])
+        end = stage.state(len(stage) - 1)
+        self.assertEqual((end.u, end.f), (1.01, 10.0))
+        self.assertAlmostEqual(end.offset + end.dt, 600)
+
+    def test_protocol_saves_steps(self):
+        rows = [('Growing', 10, 1.0, 10.0, 1.01, 10.0, 0, 'lin'),
+                ('Resting', 10, 1.01, 10.0, 1.01, 10.0, 0, 'lin')]
+        protocol = Protocol(rows, tolerance=(1e-3, 1e-3), mindt=1.0)
+        self.assertEqual(protocol.Ngrid, 1200)
+        self.assertEqual(len(protocol), 12)
+        self.assertEqual(protocol.saved, 1188)
+        self.assertEqual(len(list(planner.iterplans(protocol))), 2)
+        self.assertEqual(len(list(protocol)), 12)
+
+    def test_needs_tolerance(self):
+        self.assertRaises(ValueError, Protocol,
+                          [('Growing', 10, 1.0, 10.0, 1.01, 10.0, 0, 'lin')])
+
+
+if __name__ == '__main__':
+    unittest.main()
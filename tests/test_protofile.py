@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from runner import protofile
+from runner.compiler import Protocol
+from runner.protofile import BinaryProtocol, HEADER, RECORD
+
+ROWS = [['Growing', 1/3.0, 0.5, 10.0, 1.4, 10.0, 6, 'lin'],
+        ['Detaching', 0.002, 1.4, 10.0, 1.4, 5.0, 4, 'exp']]
+
+
+class ProtofileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.csvname = os.path.join(self.dir, 'protocol.csv')
+        self.binname = os.path.join(self.dir, 'protocol.pfg')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        protofile.write_protocol(self.csvname, ROWS)
+        rows = protofile.read_protocol(self.csvname)
+        self.assertEqual(rows, ROWS)
+        protofile.write_protocol(self.binname, rows)
+        self.assertTrue(protofile.is_binary(self.binname))
+        self.assertFalse(protofile.is_binary(self.csvname))
+        with protofile.read_protocol(self.binname) as binrows:
+            self.assertTrue(isinstance(binrows, BinaryProtocol))
+            self.assertEqual(len(binrows), 2)
+            self.assertEqual(list(binrows), ROWS)
+            self.assertEqual(binrows[-1], ROWS[-1])
+            self.assertRaises(IndexError, binrows.__getitem__, 2)
+            protocol = Protocol(binrows)
+            expected = Protocol(ROWS)
+            self.assertEqual(protocol.digest, expected.digest)
+            self.assertEqual(len(protocol), len(expected))
+            for i in range(len(expected)):
+                self.assertEqual(vars(protocol.state(i)),
+                                 vars(expected.state(i)))
+
+    def test_convert_file(self):
+        protofile.write_csv(self.csvname, ROWS)
+        protofile.convert_file(self.csvname, self.binname)
+        back = os.path.join(self.dir, 'back.csv')
+        protofile.convert_file(self.binname, back)
+        with open(self.csvname, 'rb') as f, open(back, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_old_csv_is_linear(self):
+        protofile.write_csv(self.csvname, [row[:7] for row in ROWS])
+        self.assertEqual([row[7] for row in protofile.read_csv(self.csvname)],
+                         ['lin', 'lin'])
+
+    def test_bad_csv(self):
+        protofile.write_csv(self.csvname, [ROWS[0][:5]])
+        self.assertRaises(ValueError, protofile.read_protocol, self.csvname)
+        protofile.write_csv(self.csvname, [['Growing', 'long'] + ROWS[0][2:]])
+        self.assertRaises(ValueError, protofile.read_protocol, self.csvname)
+
+    def test_empty_binary(self):
+        protofile.write_binary(self.binname, [])
+        with BinaryProtocol(self.binname) as rows:
+            self.assertEqual(list(rows), [])
+
+    def test_long_name(self):
+        rows = [['x'*33] + ROWS[0][1:]]
+        self.assertRaises(ValueError, protofile.write_binary, self.binname,
+                          rows)
+
+    def test_truncated_file(self):
+        protofile.write_binary(self.binname, ROWS)
+        with open(self.binname, 'rb') as f:
+            data = f.read()
+        self.assertEqual(len(data), HEADER.size + 2*RECORD.size)
+        for size in (HEADER.size - 1, HEADER.size + RECORD.size):
+            with open(self.binname, 'wb') as f:
+                f.write(data[:size])
+            self.assertRaises(ValueError, BinaryProtocol, self.binname)
+
+    def test_bad_magic(self):
+        protofile.write_binary(self.binname, ROWS)
+        with open(self.binname, 'r+b') as f:
+            f.write('PFGX')
+        self.assertFalse(protofile.is_binary(self.binname))
+        self.assertRaises(ValueError, BinaryProtocol, self.binname)
+
+    def test_unknown_version(self):
+        protofile.write_binary(self.binname, ROWS)
+        with open(self.binname, 'r+b') as f:
+            f.write(HEADER.pack(protofile.MAGIC, protofile.VERSION + 1,
+                                RECORD.size, 2))
+        self.assertRaises(ValueError, BinaryProtocol, self.binname)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from devices.pulse import BURST, HOST
+from tests.test_drivers import CountingDevice
+
+
+class BurstPulseTest(unittest.TestCase):
+    def setUp(self):
+        self.fg = Agilent33220A('test device 1')
+        self.sim = self.fg.dev
+        self.fg.dev = self.dev = CountingDevice(self.sim)
+        self.sim.trigsource = 'IMM'
+        self.fg.connect()
+        self.fg.apply(1000, 1.0)
+        del self.dev.written[:]
+
+    def tearDown(self):
+        self.fg.close()
+
+    def test_burst(self):
+        result = self.fg.pulse(ncycles=10)
+        self.assertEqual(self.dev.written,
+            ["OUTP OFF",
+             "BURS:MODE TRIG;:BURS:NCYC 10;:TRIG:SOUR BUS;:BURS:STAT ON;"
+             ":OUTP ON;*TRG",
+             "OUTP OFF;:BURS:STAT OFF;:TRIG:SOUR IMM"])
+        self.assertEqual([n for t, n in self.sim.bursts], [10])
+        self.assertEqual((result.method, result.ncycles), (BURST, 10))
+        self.assertAlmostEqual(result.width, 0.01)
+
+    def test_state_is_restored(self):
+        self.fg.pulse(ncycles=10)
+        self.assertEqual((self.sim.output, self.sim.burststate,
+                          self.sim.trigsource, self.sim.shape),
+                         (0, 0, 'IMM', 'SIN'))
+        self.assertEqual((self.sim.freq, self.sim.ampl), (1000, 1.0))
+        self.assertEqual(self.fg.output, 0)
+        # the cache is right, so the output is switched on again
+        self.fg.output = True
+        self.assertEqual(self.sim.output, 1)
+
+    def test_bus_trigger_is_kept(self):
+        self.fg.sweep(100, 1000, 1.0)
+        self.fg.pulse(ncycles=10)
+        self.assertEqual((self.sim.sweepstate, self.sim.trigsource),
+                         (0, 'BUS'))
+        self.assertFalse(self.dev.written[-1].endswith('TRIG:SOUR BUS'))
+        self.assertEqual(len(self.sim.bursts), 1)
+
+    def test_duration_is_rounded_to_cycles(self):
+        result = self.fg.pulse(duration=0.0104)
+        self.assertEqual(result.ncycles, 10)
+        self.assertAlmostEqual(result.error, -0.0004)
+
+    def test_timed_pulses(self):
+        # more cycles than a burst can have
+        self.fg.freq = 1e6
+        result = self.fg.pulse(duration=0.06)
+        self.assertEqual(result.method, HOST)
+        self.fg.apply(0, 1.0, mode='DC')
+        result = self.fg.pulse(duration=0.01)
+        self.assertEqual(result.method, HOST)
+        self.assertEqual(self.sim.bursts, [])
+        self.assertEqual(self.sim.output, 0)
+
+    def test_wrong_pulses(self):
+        self.assertRaises(ValueError, self.fg.pulse)
+        self.assertRaises(ValueError, self.fg.pulse, 0.01, 10)
+        self.assertRaises(ValueError, self.fg.pulse, ncycles=0)
+        self.assertRaises(ValueError, self.fg.pulse, ncycles=50001)
+        self.fg.apply(0, 1.0, mode='DC')
+        self.assertRaises(ValueError, self.fg.pulse, ncycles=10)
+        self.assertEqual(self.sim.bursts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from devices.pulse import PulseResult, BURST
+from runner.compiler import Protocol
+from runner.execute import ProtocolRun
+from runner.recorder import (Recorder, read_log, default_log, LOGVAR,
+                             SETPOINT, OUTPUT, PULSE, ERROR, EVENT, DROPPED)
+
+ROWS = [('Growing', 0.002, 0.5, 10.0, 1.4, 10.0, 4, 'lin')]
+
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'run.pfr')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        recorder = Recorder(self.filename)
+        log = recorder.device(2)
+        protocol = Protocol(ROWS)
+        for state in protocol:
+            log.setpoint(state)
+        log.output(True)
+        log.pulse(PulseResult(0.5, 0.4999, method=BURST))
+        log.error(ValueError('too high'), 3)
+        log.event(u'r\xe9sum\xe9')
+        recorder.close()
+        records = read_log(self.filename)
+        self.assertEqual(list(records['kind']),
+                         [SETPOINT]*4 + [OUTPUT, PULSE, ERROR, EVENT])
+        self.assertTrue((records['device'] == 2).all())
+        setpoints = records[records['kind'] == SETPOINT]
+        self.assertEqual(list(setpoints['index']), range(4))
+        self.assertEqual(list(setpoints['u']), [state.u for state in protocol])
+        self.assertEqual(setpoints['text'][0], 'Growing')
+        self.assertEqual(records['u'][4], 1)
+        self.assertEqual((records['u'][5], records['f'][5],
+                          records['text'][5]), (0.5, 0.4999, BURST))
+        self.assertEqual((records['index'][6], records['text'][6]),
+                         (3, 'too high'))
+        self.assertEqual(records['text'][7].decode('utf-8'), u'r\xe9sum\xe9')
+        self.assertTrue((records['mono'][1:] >= records['mono'][:-1]).all())
+
+    def test_appends(self):
+        for n in range(2):
+            recorder = Recorder(self.filename)
+            recorder.device(n).event('start')
+            recorder.close()
+        self.assertEqual(list(read_log(self.filename)['device']), [0, 1])
+
+    def test_full_buffer_drops(self):
+        recorder = Recorder(self.filename, capacity=4, interval=60)
+        # the disk does not keep up
+        recorder.flush = lambda: None
+        for index in range(10):
+            recorder.log(EVENT, index=index)
+        del recorder.flush
+        recorder.close()
+        records = read_log(self.filename)
+        self.assertEqual(list(records['kind']), [EVENT]*4 + [DROPPED])
+        self.assertEqual(records['index'][-1], 6)
+
+    def test_flush_from_threads(self):
+        recorder = Recorder(self.filename, capacity=64, interval=0.001)
+        class SlowFile(object):
+            # a busy disk, keeping the writers in write() for a while
+            def __init__(self, f):
+                self.file = f
+            def write(self, data):
+                time.sleep(0.0005)
+                self.file.write(data)
+            def __getattr__(self, name):
+                return getattr(self.file, name)
+        recorder.file = SlowFile(recorder.file)
+        stop = threading.Event()
+        def flush():
+            while not stop.is_set():
+                recorder.flush()
+        threads = [threading.Thread(target=flush) for n in range(3)]
+        for thread in threads:
+            thread.start()
+        for index in range(5000):
+            recorder.log(EVENT, index=index)
+            if index % 20 == 0:
+                time.sleep(0.0001)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        recorder.close()
+        records = read_log(self.filename)
+        events = records[records['kind'] == EVENT]['index']
+        # each record once, in order, whatever was dropped
+        self.assertTrue((events[1:] > events[:-1]).all())
+        dropped = records[records['kind'] == DROPPED]['index'].sum()
+        self.assertEqual(len(events) + dropped, 5000)
+
+    def test_run(self):
+        recorder = Recorder(self.filename)
+        fg = Agilent33220A('test device 1')
+        fg.connect()
+        ProtocolRun(fg, Protocol(ROWS), log=recorder.device(0)).run()
+        fg.disconnect()
+        fg.close()
+        recorder.close()
+        records = read_log(self.filename)
+        self.assertEqual(list(records['kind']),
+                         [EVENT, SETPOINT, OUTPUT] + [SETPOINT]*3 + [EVENT])
+        self.assertEqual(list(records['text'][[0, -1]]), ['start', 'finish'])
+
+    def test_default_log(self):
+        saved = os.environ.pop(LOGVAR, None)
+        try:
+            self.assertEqual(default_log(), None)
+            os.environ[LOGVAR] = self.filename
+            self.assertEqual(default_log(), self.filename)
+        finally:
+            os.environ.pop(LOGVAR, None)
+            if saved is not None:
+                os.environ[LOGVAR] = saved
+
+    def test_not_a_log(self):
+        with open(self.filename, 'wb') as f:
+            f.write('not a log at all')
+        self.assertRaises(ValueError, read_log, self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from runner.compiler import Protocol
+from runner.execute import ProtocolRun
+from runner.scheduler import DeadlineScheduler, RunStats, CATCHUP, SKIP
+
+# 10 steps of 0.03 s
+ROWS = [('Detaching', 0.005, 1.4, 10.0, 1.4, 5.0, 10, 'lin')]
+
+
+class FakeClock(object):
+    """Clock advanced by sleeping on it, and by hand"""
+    def __init__(self, t=100.0):
+        self.t = t
+        self.slept = []
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, dt):
+        self.slept.append(dt)
+        self.t += dt
+
+
+class DeadlineSchedulerTest(unittest.TestCase):
+    def scheduler(self, policy=CATCHUP):
+        self.clock = FakeClock()
+        return DeadlineScheduler(policy, self.clock, self.clock.sleep)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, DeadlineScheduler, 'later')
+
+    def test_deadlines_are_absolute(self):
+        scheduler = self.scheduler()
+        scheduler.start()
+        # time spent on the step does not delay the next deadline
+        self.clock.t += 0.3
+        self.assertFalse(scheduler.wait(1.0))
+        self.assertAlmostEqual(self.clock.t, 101.0)
+        self.assertAlmostEqual(self.clock.slept[-1], 0.7)
+        self.clock.t += 0.5
+        scheduler.wait(2.0)
+        self.assertAlmostEqual(self.clock.t, 102.0)
+
+    def test_overdue_step_is_not_waited_for(self):
+        scheduler = self.scheduler()
+        scheduler.start()
+        self.clock.t += 5
+        self.assertFalse(scheduler.wait(1.0))
+        self.assertEqual(self.clock.slept, [])
+        self.assertEqual(scheduler.delay(1.0), 0.0)
+        self.assertAlmostEqual(scheduler.delay(6.0), 1.0)
+
+    def test_start_elapsed_and_t0(self):
+        scheduler = self.scheduler()
+        scheduler.start(elapsed=30, t0=90.0)
+        self.assertAlmostEqual(scheduler.elapsed(), 40.0)
+        self.assertAlmostEqual(scheduler.deadline(30), 90.0)
+
+    def test_pause_shifts_deadlines(self):
+        scheduler = self.scheduler()
+        scheduler.start()
+        self.clock.t += 1
+        scheduler.pause()
+        self.assertTrue(scheduler.paused)
+        self.clock.t += 10
+        self.assertAlmostEqual(scheduler.elapsed(), 1.0)
+        scheduler.resume()
+        self.assertFalse(scheduler.paused)
+        self.assertAlmostEqual(scheduler.elapsed(), 1.0)
+        self.assertAlmostEqual(scheduler.deadline(2.0), self.clock.t + 1.0)
+
+    def test_skip_drops_overdue_steps(self):
+        scheduler = self.scheduler(SKIP)
+        scheduler.start()
+        self.clock.t += 2.5
+        self.assertTrue(scheduler.overdue(2.0))
+        self.assertFalse(scheduler.overdue(3.0))
+        self.assertFalse(scheduler.overdue(None))
+        self.assertEqual(scheduler.stats.skipped, 1)
+
+    def test_catchup_drops_nothing(self):
+        scheduler = self.scheduler(CATCHUP)
+        scheduler.start()
+        self.clock.t += 10
+        self.assertFalse(scheduler.overdue(2.0))
+        self.assertEqual(scheduler.stats.skipped, 0)
+
+    def test_stats(self):
+        scheduler = self.scheduler()
+        scheduler.start()
+        self.clock.t += 0.001
+        scheduler.mark(0)
+        self.clock.t += 1.003
+        scheduler.mark(1)
+        stats = scheduler.finish(1)
+        self.assertEqual(stats.steps, 2)
+        self.assertAlmostEqual(stats.jittermean, 0.0025)
+        self.assertAlmostEqual(stats.jittermax, 0.004)
+        self.assertAlmostEqual(stats.drift, 0.004)
+        self.assertEqual(stats.as_dict()['steps'], 2)
+
+    def test_wait_returns_on_event(self):
+        scheduler = DeadlineScheduler()
+        scheduler.start()
+        event = threading.Event()
+        threading.Timer(0.05, event.set).start()
+        self.assertTrue(scheduler.wait(60, event))
+        self.assertTrue(scheduler.elapsed() < 10)
+
+
+class RunStatsTest(unittest.TestCase):
+    def test_empty(self):
+        stats = RunStats()
+        self.assertEqual((stats.jittermean, stats.jitterrms), (0.0, 0.0))
+        self.assertEqual(str(stats), '0 steps (0 skipped), jitter mean 0.0 ms, '
+                         'rms 0.0 ms, max 0.0 ms, drift --')
+
+    def test_jitter(self):
+        stats = RunStats()
+        for jitter in (0.001, 0.003, 0.002):
+            stats.add(jitter)
+        stats.drift = 0.005
+        self.assertAlmostEqual(stats.jittermean, 0.002)
+        self.assertAlmostEqual(stats.jitterrms, (14e-6/3)**0.5)
+        self.assertAlmostEqual(stats.jittermax, 0.003)
+        self.assertTrue(str(stats).endswith('max 3.0 ms, drift 5.0 ms'))
+
+
+class PolicyRunTest(unittest.TestCase):
+    """Protocol runs on a device slower than the steps"""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.fg = Agilent33220A('test device 1')
+        self.fg.connect()
+        apply_formatted = self.fg.apply_formatted
+        def slow_apply(fstr, ustr, mode='SIN'):
+            apply_formatted(fstr, ustr, mode)
+            self.clock.t += 0.05
+        self.fg.apply_formatted = slow_apply
+
+    def tearDown(self):
+        self.fg.close()
+
+    def run_protocol(self, policy):
+        scheduler = DeadlineScheduler(policy, self.clock, self.clock.sleep)
+        shown = []
+        run = ProtocolRun(self.fg, Protocol(ROWS), scheduler, sweep=False,
+                          display=lambda state: shown.append(state.index))
+        return run.run(), shown
+
+    def test_catchup(self):
+        stats, shown = self.run_protocol(CATCHUP)
+        self.assertEqual(shown, range(10))
+        self.assertEqual((stats.steps, stats.skipped), (10, 0))
+        # each step is 0.02 s later than the previous one
+        self.assertAlmostEqual(stats.jittermax, 0.18)
+        self.assertAlmostEqual(stats.jittermean, 0.09)
+        self.assertAlmostEqual(stats.drift, 0.2)
+        self.assertEqual(self.clock.slept, [])
+
+    def test_skip(self):
+        stats, shown = self.run_protocol(SKIP)
+        self.assertTrue(stats.skipped > 0)
+        self.assertEqual(stats.steps + stats.skipped, 10)
+        self.assertEqual(len(shown), stats.steps)
+        self.assertEqual(shown, sorted(shown))
+        # the end values are always applied
+        self.assertEqual(shown[-1], 9)
+        self.assertAlmostEqual(self.fg.freq, 5.0)
+        # dropping steps keeps the run on time
+        self.assertTrue(stats.jittermax <= 0.05)
+        self.assertTrue(stats.drift < 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
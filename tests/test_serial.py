@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from devices.serialhelper import open_serial, LineReader
+from devices.TtiTga1230 import TtiTga1230
+
+
+def arrive(port, data):
+    """Data coming from the simulated device on its own"""
+    with port.ready:
+        port.outbuffer += data
+        port.ready.notify_all()
+
+
+def received(port, timeout=1.0):
+    """Wait until the reader took all data from the port"""
+    deadline = time.time() + timeout
+    while port.inWaiting() and time.time() < deadline:
+        time.sleep(0.005)
+    time.sleep(0.02)
+
+
+class LineReaderTest(unittest.TestCase):
+    background = False
+
+    def setUp(self):
+        self.port = open_serial('SIM1', timeout=0.05)
+        self.reader = LineReader(self.port, background=self.background)
+
+    def tearDown(self):
+        self.reader.stop()
+        self.port.close()
+
+    def test_lines(self):
+        arrive(self.port, 'one\r\ntwo\nthr')
+        self.assertEqual(self.reader.readline(1), 'one')
+        self.assertEqual(self.reader.readline(1), 'two')
+        self.assertRaises(IOError, self.reader.readline, 0.1)
+        arrive(self.port, 'ee\n')
+        self.assertEqual(self.reader.readline(1), 'three')
+
+    def test_flush_discards_partial_reply(self):
+        arrive(self.port, 'stale\nhalf a st')
+        if self.background:
+            received(self.port)
+        else:
+            self.reader._receive()
+        self.reader.flush()
+        arrive(self.port, 'fresh\n')
+        self.assertEqual(self.reader.readline(1), 'fresh')
+
+    def test_flush_discards_unread_data(self):
+        arrive(self.port, 'stale\n')
+        self.reader.flush()
+        self.assertEqual(self.port.inWaiting(), 0)
+        self.assertRaises(IOError, self.reader.readline, 0.1)
+
+
+class BackgroundLineReaderTest(LineReaderTest):
+    background = True
+
+
+class TtiTga1230Test(unittest.TestCase):
+    def test_default_timeout(self):
+        fg = TtiTga1230('SIM1')
+        self.assertEqual(fg.portconfigs['timeout'], 0.1)
+        fg.close()
+
+    def test_query(self):
+        for background in (False, True):
+            fg = TtiTga1230('SIM1', background=background)
+            fg.connect()
+            fg.freq = 1234
+            arrive(fg.dev, 'stray repl')
+            self.assertEqual(float(fg.query('WAVFREQ?')), 1234)
+            fg.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+import unittest
+
+from devices.simulator import (ENVVAR, LatencyModel, SimulatedAgilent33220A,
+                               SimulatedIOError, SimulatedTGA1230,
+                               simulation_config)
+
+
+class LatencyModelTest(unittest.TestCase):
+    def test_counters(self):
+        model = LatencyModel()
+        model.transfer('dev', 'FREQ 1000;:VOLT 1;*TRG')
+        model.transfer('dev', '<read>')
+        model.transfer('port', 'WAVFREQ 10\nAMPL 1\n')
+        self.assertEqual((model.transfers, model.commands), (3, 5))
+        self.assertEqual(model.nbytes, 22 + 18)
+        model.reset_counters()
+        self.assertEqual((model.transfers, model.commands, model.nbytes),
+                         (0, 0, 0))
+
+    def failures(self, model, n=200):
+        failed = []
+        for i in xrange(n):
+            try:
+                model.transfer('dev', '*TRG')
+            except SimulatedIOError:
+                failed.append(i)
+        return failed
+
+    def test_seeded_failures_repeat(self):
+        failed = self.failures(LatencyModel(failrate=0.1, seed=3))
+        self.assertEqual(failed, self.failures(LatencyModel(failrate=0.1,
+                                                            seed=3)))
+        self.assertTrue(0 < len(failed) < 60)
+        self.assertEqual(len(self.failures(LatencyModel(failrate=1), 5)), 5)
+        self.assertEqual(self.failures(LatencyModel()), [])
+
+    def test_latency(self):
+        model = LatencyModel(latency=0.01, jitter=0.001, seed=1)
+        start = time.time()
+        for i in xrange(10):
+            model.transfer('dev', '*TRG')
+        self.assertTrue(0.08 < time.time() - start < 0.5)
+
+    def test_config_from_environment(self):
+        saved = os.environ.get(ENVVAR)
+        try:
+            os.environ[ENVVAR] = 'latency=0.005, seed=1,verbose=1,foo,bar=2'
+            self.assertEqual(simulation_config(), {'latency':0.005, 'seed':1,
+                                                   'verbose':True})
+            os.environ[ENVVAR] = ''
+            self.assertEqual(simulation_config(), {})
+            del os.environ[ENVVAR]
+            self.assertEqual(simulation_config(), None)
+        finally:
+            if saved is not None:
+                os.environ[ENVVAR] = saved
+
+
+class SimulatedAgilentTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedAgilent33220A('test device 1', LatencyModel())
+
+    def test_values_are_clipped_and_reported(self):
+        self.sim.write('FREQ 1e9;:VOLT:OFFS 2')
+        self.assertEqual(self.sim.freq, 2e7)
+        self.sim.write('APPL:SIN 1000,20')
+        self.assertEqual(self.sim.ampl, 2*(5 - 2.0))
+        self.assertEqual(len(self.sim.errors), 2)
+        self.assertTrue(self.sim.ask('SYST:ERR?').startswith('-222,'))
+        self.sim.ask('SYST:ERR?')
+        self.assertEqual(self.sim.ask('SYST:ERR?'), '+0,"No error"')
+
+    def test_wrong_commands(self):
+        self.sim.write('FOO 1;:FREQ abc')
+        self.assertEqual([error[:4] for error in self.sim.errors],
+                         ['-113', '-104'])
+        self.assertEqual(self.sim.freq, 1000.0)
+        # the error queue is bounded
+        for i in xrange(30):
+            self.sim.write('FOO')
+        self.assertEqual(len(self.sim.errors), 20)
+        self.sim.write('*CLS')
+        self.assertEqual(self.sim.errors, [])
+
+    def test_read_without_reply(self):
+        self.assertRaises(SimulatedIOError, self.sim.read)
+        self.assertEqual(self.sim.ask('*IDN?;*OPC?').split(';')[-1], '1')
+
+
+class SimulatedTGATest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedTGA1230('SIM1', LatencyModel(), timeout=0.05)
+
+    def test_commands_and_queries(self):
+        self.sim.write('DCOFFS 5\nAMPL 40\nWAVFREQ 1e9\nMODE FOO\n')
+        self.assertEqual((self.sim.offset, self.sim.ampl, self.sim.freq),
+                         (5.0, 30.0, 10e6))
+        self.assertEqual(self.sim.mode, 'SINE')
+        self.sim.write('AMPL?\nMODE?\n')
+        self.assertEqual(self.sim.readline(), '30.0000\r\n')
+        self.assertEqual(self.sim.readline(), 'SINE\r\n')
+
+    def test_read_times_out(self):
+        start = time.time()
+        self.assertEqual(self.sim.read(), '')
+        self.assertEqual(self.sim.readline(), '')
+        self.assertTrue(0.09 <= time.time() - start < 1)
+        # a partial line is returned after the timeout
+        self.sim.outbuffer = 'ON'
+        self.assertEqual(self.sim.readline(), 'ON')
+
+    def test_read_waits_for_the_reply(self):
+        self.sim.timeout = None
+        threading.Timer(0.05, self.sim.write, ['OUTPUT?\n']).start()
+        self.assertEqual(self.sim.readline(), 'OFF\r\n')
+
+    def test_close_wakes_the_reader(self):
+        self.sim.timeout = None
+        threading.Timer(0.05, self.sim.close).start()
+        self.assertRaises(ValueError, self.sim.read)
+
+
+if __name__ == '__main__':
+    unittest.main()
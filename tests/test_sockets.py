@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from devices.sockethelper import (serve, is_query, ConnectionPool,
+                                  SocketInstrument, query_all)
+
+
+class IsQueryTest(unittest.TestCase):
+    def test_headers(self):
+        self.assertTrue(is_query('FREQ?'))
+        self.assertTrue(is_query('*OPC?;:SYST:ERR?'))
+        self.assertTrue(is_query('FREQ 100;:VOLT? MAX'))
+        self.assertFalse(is_query('FREQ 100;:VOLT 1'))
+
+    def test_strings(self):
+        self.assertFalse(is_query("DISP:TEXT 'Ready?'"))
+        self.assertFalse(is_query('DISP:TEXT "a?;b?"'))
+        self.assertTrue(is_query("DISP:TEXT 'Ready?';:FREQ?"))
+
+
+class SocketInstrumentTest(unittest.TestCase):
+    def setUp(self):
+        self.server = serve()
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_connection_is_reused(self):
+        dev = SocketInstrument(self.server.address, pool=self.pool)
+        sock = dev.sock
+        dev.write("DISP:TEXT 'Ready?'")
+        self.assertEqual(dev.ask('FREQ?').strip(), '+1.000000000000000E+03')
+        dev.close()
+        dev = SocketInstrument(self.server.address, pool=self.pool)
+        self.assertTrue(dev.sock is sock)
+        dev.close()
+
+    def test_connection_with_replies_due_is_dropped(self):
+        dev = SocketInstrument(self.server.address, pool=self.pool)
+        sock = dev.sock
+        dev.write('FREQ?')
+        dev.close()
+        dev = SocketInstrument(self.server.address, pool=self.pool)
+        self.assertFalse(dev.sock is sock)
+        self.assertEqual(dev.ask_many(['VOLT?', 'OUTP?']),
+                         ['+1.000000000000000E-01', '0'])
+        dev.close()
+
+    def test_driver(self):
+        fg = Agilent33220A(self.server.address)
+        fg.connect()
+        fg.apply(500, 1.5)
+        fg.set_display('Ready?')
+        self.assertEqual(float(fg.ask('FREQ?')), 500)
+        self.assertEqual(query_all([fg.dev], 'VOLT?'), ['+1.500000000000000E+00'])
+        fg.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from runner import statusfeed
+from runner.compiler import Protocol
+from runner.execute import ProtocolRun
+from runner.statusfeed import StatusFeed, StatusReader
+
+ROWS = [('Growing', 0.002, 0.5, 10.0, 1.4, 10.0, 4, 'lin')]
+
+
+class StatusFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'status.feed')
+        self.protocol = Protocol(ROWS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        feed = StatusFeed(self.filename)
+        reader = StatusReader(self.filename)
+        self.assertEqual(reader.status(), [])
+        device = feed.device('GPIB0::10')
+        self.assertTrue(feed.device('GPIB0::10') is device)
+        for state in self.protocol:
+            device.setpoint(state)
+        status, = reader.status()
+        last = self.protocol.state(-1)
+        self.assertEqual((status.device, status.state, status.index,
+                          status.stage), (u'GPIB0::10', 'running', 3,
+                                          u'Growing'))
+        self.assertEqual((status.u, status.f, status.tremain, status.offset),
+                         (last.u, last.f, last.tremain, last.offset))
+        device.event(statusfeed.PAUSED)
+        status, = reader.status()
+        self.assertEqual((status.state, status.index), ('paused', 3))
+        self.assertEqual([item.index for item in reader.history(0)],
+                         [0, 1, 2, 3, 3])
+        reader.close()
+        feed.close()
+
+    def test_ring(self):
+        feed = StatusFeed(self.filename, depth=4)
+        device = feed.device('dev')
+        for state in self.protocol:
+            device.setpoint(state)
+            device.setpoint(state)
+        reader = StatusReader(self.filename)
+        self.assertEqual([item.index for item in reader.history(0)],
+                         [2, 2, 3, 3])
+        reader.close()
+        feed.close()
+
+    def test_two_publishers(self):
+        first = StatusFeed(self.filename)
+        second = StatusFeed(self.filename)
+        a = first.device('A')
+        b = second.device('B')
+        # the same device published by both programs
+        a2 = second.device('A')
+        self.assertEqual(len(set([a.start, b.start, a2.start])), 3)
+        a.setpoint(self.protocol.state(0))
+        b.setpoint(self.protocol.state(1))
+        a2.setpoint(self.protocol.state(2))
+        reader = StatusReader(self.filename)
+        self.assertEqual([(item.device, item.index)
+                          for item in reader.status()],
+                         [(u'A', 2), (u'B', 1)])
+        reader.close()
+        first.close()
+        second.close()
+
+    def test_slot_of_a_closed_publisher_is_reused(self):
+        feed = StatusFeed(self.filename)
+        device = feed.device('A')
+        feed.device('B')
+        start = device.start
+        for state in self.protocol:
+            device.setpoint(state)
+        feed.close()
+        feed = StatusFeed(self.filename)
+        device = feed.device('A')
+        self.assertEqual((device.start, device.count), (start, 4))
+        device.setpoint(self.protocol.state(0))
+        reader = StatusReader(self.filename)
+        self.assertEqual([item.index for item in reader.history(0)],
+                         [0, 1, 2, 3, 0])
+        reader.close()
+        feed.close()
+
+    def test_slot_of_a_dead_publisher_is_claimed(self):
+        feed = StatusFeed(self.filename, slots=2)
+        feed.device('A')
+        feed.device('B')
+        self.assertRaises(ValueError, feed.device, 'C')
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        # as if B was published by the process which is gone
+        struct.pack_into('<I', feed.map, feed.devices['B'].start + 8,
+                         process.pid)
+        other = StatusFeed(self.filename)
+        self.assertEqual(other.device('C').start, feed.devices['B'].start)
+        self.assertEqual(other.device('C').count, 0)
+        other.close()
+        feed.close()
+
+    def test_layout_of_the_file_is_kept(self):
+        StatusFeed(self.filename, slots=3, depth=5).close()
+        feed = StatusFeed(self.filename)
+        self.assertEqual((feed.slots, feed.depth), (3, 5))
+        feed.close()
+        with open(self.filename, 'r+b') as f:
+            f.write('NOTAFEED')
+        self.assertRaises(ValueError, StatusFeed, self.filename)
+        self.assertRaises(ValueError, StatusReader, self.filename)
+
+    def test_run(self):
+        feed = StatusFeed(self.filename)
+        fg = Agilent33220A('test device 1')
+        fg.connect()
+        ProtocolRun(fg, self.protocol, feed=feed.device('dev')).run()
+        fg.disconnect()
+        fg.close()
+        reader = StatusReader(self.filename)
+        status, = reader.status()
+        self.assertEqual((status.state, status.index), ('finished', 3))
+        reader.close()
+        feed.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from runner.store import ProtocolStore
+
+ROWS = [['Growing', 1/3.0, 0.5, 10.0, 1.4, 10.0, 6, 'lin'],
+        ['Detaching', 0.002, 1.4, 10.0, 1.4, 5.0, 4, 'exp']]
+
+
+class ProtocolStoreTest(unittest.TestCase):
+    def test_load_values_and_strings(self):
+        store = ProtocolStore()
+        store.load(ROWS)
+        self.assertEqual(store.rows(), ROWS)
+        store.load([[str(value) for value in row] for row in ROWS])
+        self.assertEqual(store.rows()[1], ROWS[1])
+        self.assertEqual(store.get_text(0, 1), '0.333333333333')
+        self.assertEqual(store.get_text(0, 6), '6')
+
+    def test_failed_load_keeps_the_content(self):
+        store = ProtocolStore()
+        store.load(ROWS)
+        try:
+            store.load([ROWS[0], ['Bad', 'long'] + ROWS[1][2:]])
+        except ValueError, err:
+            self.assertEqual(str(err), 'Could not convert item at row 1, '
+                             'col 1 to desired type')
+        else:
+            self.fail('ValueError not raised')
+        self.assertEqual(store.rows(), ROWS)
+
+    def test_empty_cells(self):
+        store = ProtocolStore(2)
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.is_empty_row(0))
+        self.assertEqual((store.get(0, 1), store.get(0, 0)), (None, ''))
+        self.assertEqual(store.get_text(0, 1), '')
+        # zero is a value, not an empty cell
+        store.set_text(0, 2, ' 0 ')
+        self.assertFalse(store.is_empty(0, 2))
+        self.assertEqual(store.get(0, 2), 0.0)
+        store.set_text(0, 2, '')
+        self.assertTrue(store.is_empty(0, 2))
+        store.set(0, 0, 'Growing')
+        store.set(0, 0, None)
+        self.assertTrue(store.is_empty_row(0))
+
+    def test_wrong_text_keeps_the_cell(self):
+        store = ProtocolStore(1)
+        store.set_text(0, 6, '10')
+        self.assertRaises(ValueError, store.set_text, 0, 6, 'ten')
+        self.assertEqual(store.get(0, 6), 10)
+
+    def test_rows_need_every_number(self):
+        store = ProtocolStore()
+        store.load(ROWS)
+        store.set(1, 5, None)
+        try:
+            store.rows()
+        except ValueError, err:
+            self.assertTrue('row 1, col 5' in str(err))
+        else:
+            self.fail('ValueError not raised')
+
+    def test_append_delete_and_clean(self):
+        store = ProtocolStore()
+        store.load(ROWS)
+        store.append_rows(3)
+        self.assertEqual(len(store), 5)
+        store.set(3, 7, 'lin')
+        self.assertEqual(store.clean(), 1)
+        self.assertEqual(len(store), 4)
+        store.delete_rows(2, 2)
+        self.assertEqual(store.clean(), 0)
+        self.assertEqual(store.rows(), ROWS)
+        store.delete_rows(0)
+        self.assertEqual(store.rows(), ROWS[1:])
+        store.clear(3)
+        self.assertEqual(store.clean(), 3)
+        self.assertEqual(len(store), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
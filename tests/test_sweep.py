@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from runner.compiler import Protocol
+from runner.execute import ProtocolRun
+
+# 10 steps of 0.03 s, frequency only
+SWEEPROWS = [('Detaching', 0.005, 1.4, 10.0, 1.4, 5.0, 10, 'lin')]
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.fg = Agilent33220A('test device 1')
+        self.fg.connect()
+        self.sim = self.fg.dev
+
+    def tearDown(self):
+        self.fg.close()
+
+    def test_sweep(self):
+        self.fg.sweep(100, 1000, 2.5, 'log', 1.5)
+        self.assertEqual((self.sim.sweepstate, self.sim.spacing,
+                          self.sim.sweeptime), (1, 'LOG', 2.5))
+        self.assertEqual((self.sim.fstart, self.sim.fstop), (100, 1000))
+        self.assertEqual((self.sim.ampl, self.sim.output), (1.5, 1))
+        # triggered right away
+        self.assertNotEqual(self.sim.sweepstarted, None)
+        self.assertEqual(self.fg.cache['sweep'], 1)
+        self.assertTrue(100 <= self.fg.freq <= 1000)
+        self.fg.stop_sweep()
+        self.assertEqual(self.sim.sweepstate, 0)
+        self.assertEqual(self.fg.cache['sweep'], 0)
+
+    def test_apply_ends_the_sweep(self):
+        self.fg.sweep(100, 1000, 2.5)
+        self.fg.apply(500, 1.0)
+        self.assertEqual(self.sim.sweepstate, 0)
+        self.assertEqual(self.fg.freq, 500)
+
+    def test_wrong_sweeps(self):
+        self.assertRaises(ValueError, self.fg.sweep, 100, 1000, 1, 'exp')
+        self.assertRaises(ValueError, self.fg.sweep, 100, 1000, 1000)
+        self.assertRaises(ValueError, self.fg.sweep, 100, 1000, 0)
+
+
+class SweepRunTest(unittest.TestCase):
+    """Frequency ramps offloaded to the sweep engine by ProtocolRun"""
+    def setUp(self):
+        self.fg = Agilent33220A('test device 1')
+        self.fg.connect()
+        self.sweeps = []
+        self.applied = []
+        sweep, apply_formatted = self.fg.sweep, self.fg.apply_formatted
+        def recorded_sweep(fstart, fstop, duration, spacing='LIN', u=None):
+            self.sweeps.append((fstart, fstop, round(duration, 6), spacing))
+            sweep(fstart, fstop, duration, spacing, u)
+        def recorded_apply(fstr, ustr, mode='SIN'):
+            self.applied.append(float(fstr))
+            apply_formatted(fstr, ustr, mode)
+        self.fg.sweep = recorded_sweep
+        self.fg.apply_formatted = recorded_apply
+        self.fg.apply = None
+
+    def tearDown(self):
+        self.fg.close()
+
+    def run_protocol(self, rows, **kwargs):
+        protocol = Protocol(rows)
+        shown = []
+        run = ProtocolRun(self.fg, protocol,
+                          display=lambda state: shown.append(state.index),
+                          **kwargs)
+        run.run()
+        self.assertEqual(shown, range(len(protocol)))
+        return protocol
+
+    def test_ramp_is_one_sweep(self):
+        protocol = self.run_protocol(SWEEPROWS)
+        self.assertEqual(self.sweeps,
+                         [(10.0, protocol.state(9).f, 0.27, 'LIN')])
+        # the last step sets the end values
+        self.assertEqual(self.applied, [5.0])
+        self.assertEqual(self.fg.dev.sweepstate, 0)
+        self.assertAlmostEqual(self.fg.freq, 5.0)
+
+    def test_long_ramp_is_split(self):
+        self.fg.sweeptimerange = (1e-3, 0.1)
+        protocol = self.run_protocol(SWEEPROWS)
+        self.assertEqual([sweep[:3] for sweep in self.sweeps],
+                         [(protocol.state(i).f, protocol.state(i + 3).f, 0.09)
+                          for i in (0, 3, 6)])
+        self.assertEqual(self.applied, [5.0])
+
+    def test_fallback_to_steps(self):
+        # steps too short for the sweep engine
+        self.fg.sweeptimerange = (1e-3, 0.01)
+        self.run_protocol(SWEEPROWS)
+        self.assertEqual(self.sweeps, [])
+        self.assertEqual(len(self.applied), 10)
+
+    def test_only_frequency_ramps_are_swept(self):
+        rows = [('Growing', 0.005, 0.5, 10.0, 1.4, 10.0, 10, 'lin'),
+                ('Both', 0.005, 1.4, 10.0, 1.0, 5.0, 10, 'lin'),
+                ('Exp', 0.005, 1.0, 5.0, 1.0, 10.0, 10, 'exp')]
+        self.run_protocol(rows)
+        self.assertEqual(self.sweeps, [])
+        self.assertEqual(len(self.applied), 30)
+
+    def test_sweep_disabled(self):
+        self.run_protocol(SWEEPROWS, sweep=False)
+        self.assertEqual(self.sweeps, [])
+        self.assertEqual(len(self.applied), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from devices.transaction import (CommandQueue, NoTransaction, Transaction,
+                                 transaction)
+from tests.test_drivers import CountingDevice
+
+
+class QueueDevice(object):
+    """Device sending the commands of its transactions as lists"""
+    def __init__(self):
+        self.queue = CommandQueue()
+        self.sent = []
+        self.rolledback = 0
+
+    def write(self, cmd):
+        if self.queue.active:
+            self.queue.commands.append(cmd)
+        else:
+            self.sent.append([cmd])
+
+    def batch(self):
+        return Transaction(self)
+
+    def begin(self):
+        self.queue.begin()
+
+    def commit(self):
+        commands = self.queue.end()
+        if commands:
+            self.sent.append(commands)
+
+    def rollback(self):
+        self.queue.rollback()
+        self.rolledback += 1
+
+
+class CommandQueueTest(unittest.TestCase):
+    def test_nesting(self):
+        queue = CommandQueue()
+        self.assertFalse(queue.active)
+        queue.begin()
+        queue.begin()
+        queue.commands.append('A')
+        self.assertTrue(queue.active)
+        self.assertEqual(queue.end(), [])
+        self.assertTrue(queue.active)
+        self.assertEqual(queue.end(), ['A'])
+        self.assertFalse(queue.active)
+        self.assertEqual(queue.commands, [])
+        # unbalanced ends do not make the depth negative
+        self.assertEqual(queue.end(), [])
+        self.assertFalse(queue.active)
+
+    def test_take_and_rollback(self):
+        queue = CommandQueue()
+        queue.begin()
+        queue.commands.extend(['A', 'B'])
+        self.assertEqual(queue.take(), ['A', 'B'])
+        self.assertTrue(queue.active)
+        queue.commands.append('C')
+        queue.begin()
+        queue.rollback()
+        self.assertEqual((queue.depth, queue.commands), (0, []))
+
+
+class TransactionTest(unittest.TestCase):
+    def test_commands_are_sent_together(self):
+        device = QueueDevice()
+        with transaction(device) as dev:
+            self.assertTrue(dev is device)
+            device.write('A')
+            with device.batch():
+                device.write('B')
+            self.assertEqual(device.sent, [])
+            device.write('C')
+        self.assertEqual(device.sent, [['A', 'B', 'C']])
+        device.write('D')
+        self.assertEqual(device.sent[-1], ['D'])
+
+    def test_exception_discards_commands(self):
+        device = QueueDevice()
+        def fail():
+            with device.batch():
+                device.write('A')
+                raise IOError('lost')
+        self.assertRaises(IOError, fail)
+        self.assertEqual((device.sent, device.rolledback), ([], 1))
+        self.assertFalse(device.queue.active)
+
+    def test_no_transaction(self):
+        device = object()
+        self.assertTrue(isinstance(transaction(device), NoTransaction))
+        with transaction(device):
+            pass
+
+
+class AgilentBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.fg = Agilent33220A('test device 1')
+        self.sim = self.fg.dev
+        self.fg.dev = self.dev = CountingDevice(self.sim)
+        self.fg.connect()
+        del self.dev.written[:]
+
+    def tearDown(self):
+        self.fg.close()
+
+    def test_one_write(self):
+        with self.fg.batch():
+            self.fg.apply(1000, 1.0)
+            self.fg.write("*TRG")
+            self.fg.output = False
+        self.assertEqual(len(self.dev.written), 1)
+        self.assertTrue(self.dev.written[0].endswith(";*TRG;:OUTP OFF"))
+        self.assertEqual((self.sim.freq, self.sim.ampl, self.sim.output),
+                         (1000, 1.0, 0))
+
+    def test_query_sends_queued_commands(self):
+        with self.fg.batch():
+            self.fg.write("FREQ 1234")
+            self.assertEqual(float(self.fg.ask("FREQ?")), 1234)
+        self.assertEqual(self.dev.written, ["FREQ 1234"])
+
+    def test_rollback_forgets_the_state(self):
+        def fail():
+            with self.fg.batch():
+                self.fg.freq = 2000
+                raise IOError('lost')
+        self.assertRaises(IOError, fail)
+        self.assertEqual(self.dev.written, [])
+        self.assertNotEqual(self.sim.freq, 2000)
+        # the cache is re-read, not taken from the discarded commands
+        self.assertEqual(self.fg.freq, self.sim.freq)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from devices.Agilent33220A import Agilent33220A
+from runner.worker import DeviceWorker
+
+
+class DeviceWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.worker = DeviceWorker()
+        self.fg = Agilent33220A('test device 1')
+
+    def tearDown(self):
+        self.worker.stop(5)
+
+    def test_submit(self):
+        future = self.worker.submit(self.fg.connect)
+        self.assertEqual(future.result(5), None)
+        future = self.worker.submit(self.fg.apply, 500, 1.5)
+        future.result(5)
+        self.assertEqual(self.worker.call(getattr, self.fg, 'freq'), 500)
+        self.assertTrue(future.done())
+
+    def test_calls_are_performed_in_order(self):
+        threads = []
+        done = []
+        for n in range(5):
+            future = self.worker.submit(
+                lambda n=n: threads.append(threading.current_thread()) or n)
+            future.add_done_callback(lambda fut: done.append(fut.result()))
+        future.result(5)
+        self.assertEqual(done, range(5))
+        self.assertEqual(set(threads), set([self.worker]))
+
+    def test_error_delivery(self):
+        self.fg.dev = None
+        future = self.worker.submit(self.fg.connect)
+        errors = []
+        future.add_done_callback(lambda fut: errors.append(fut.exception()))
+        self.assertTrue(isinstance(future.exception(5), AttributeError))
+        self.assertRaises(AttributeError, future.result)
+        self.assertEqual(errors, [future.exception()])
+        # the worker goes on
+        self.assertEqual(self.worker.call(lambda: 'alive'), 'alive')
+
+    def test_stop_with_timeout(self):
+        self.worker.submit(time.sleep, 0.5)
+        started = time.time()
+        self.worker.stop(0.1)
+        self.assertTrue(time.time() - started < 1)
+        self.assertTrue(self.worker.is_alive())
+        self.worker.join(5)
+        self.assertFalse(self.worker.is_alive())
+
+    def test_result_timeout(self):
+        future = self.worker.submit(time.sleep, 0.5)
+        self.assertRaises(RuntimeError, future.result, 0.01)
+
+    def test_disconnect_with_queued_jobs(self):
+        # as wxfuncgen does: the jobs are given the device they act on,
+        # the window lets it go right away and closes it after them
+        class Window(object):
+            fg = self.fg
+        window = Window()
+        self.worker.call(window.fg.connect)
+        gate = threading.Event()
+        self.worker.submit(gate.wait, 5)
+        fg = window.fg
+        jobs = [self.worker.submit(fg.apply, 100 + n, 1.0) for n in range(3)]
+        window.fg = None
+        closed = self.worker.submit(lambda fg: (fg.disconnect(), fg.close()),
+                                    fg)
+        gate.set()
+        for future in jobs + [closed]:
+            self.assertEqual(future.exception(5), None)
+        self.assertEqual(self.fg.dev.freq, 102)
+        self.assertEqual(self.fg.dev.remote, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,8 @@
 
     Needs two parameters - a class to instantiate 
     a function generator representation, and a function returning list of 
-    currently available/connected devices.
+    currently available/connected devices, called as
+    devlist(refresh, probe, exclude) like devices.discovery.Discovery.devices.
     
     The function generator object is expected to provide the following API:
         dev - actual lower-level representation of the device, 
@@ -26,7 +27,6 @@
 """
 
 from __future__ import division
-import csv
 from math import sqrt
 
 import wx
@@ -34,16 +34,16 @@ import wx.grid
 
 from wxgui.funcgengui import FuncGenFrame
 from wxgui.wxres import getAppIcon
-
-PROTOCOLCOLS = [
-                ('Stage', str),
-                ('t, min', float), 
-                ('start U, Vpp', float), 
-                ('start F, Hz', float), 
-                ('end U, Vpp', float), 
-                ('end F, Hz', float),
-                ('No of points', int),
-                ]
+from wxgui.protocoltable import ProtocolTable
+from devices.transaction import transaction
+from runner.checkpoint import Checkpoint
+from runner.compiler import Protocol, resolution
+from runner.execute import ProtocolRun
+from runner.protofile import read_csv, write_protocol, is_binary, BinaryProtocol
+from runner.recorder import Recorder, default_log
+from runner.statusfeed import StatusFeed, default_feed, STOPPED
+from runner.store import ProtocolStore
+from runner.worker import DeviceWorker
 
 # these are attributes/methods of device class that are 
 # expected to be implemented
@@ -66,13 +66,31 @@ FG_API = set(('clear_display',
               ))
 
 
+CHECKPOINT = 'wxfuncgen.ckpt'
+# time to let the device calls finish when the window is closed, s
+CLOSETIMEOUT = 5.0
+
+
 class AgilentFrame(FuncGenFrame):
-    """GUI to control Agilent Function Generator"""
+    """GUI to control Agilent Function Generator
+    
+    All calls to the device are performed in a separate worker thread,
+    results are passed back to the GUI thread with wx.CallAfter.
+    """
     def __init__(self, devclass, devlist, *args, **kwargs):
         FuncGenFrame.__init__(self, *args, **kwargs)
         self.fg = None
+        self.devname = None
         self.devclass = devclass
         self.devlist = devlist
+        self.addresses = []
+        self.worker = DeviceWorker()
+        self.run = None
+        self.running = False
+        self.recorder = None
+        self.statusfeed = None
+        # in the directory the program was started from
+        self.checkpoint = Checkpoint(CHECKPOINT)
         
         self.SetTitle('wxFuncGen')
         self.init_device_choice()
@@ -84,8 +102,6 @@ class AgilentFrame(FuncGenFrame):
         
         self.timer = wx.Timer(self, -1)
         self.Bind(wx.EVT_TIMER, self.advance, self.timer)
-        self.pulsetimer = wx.Timer(self, -1)
-        self.Bind(wx.EVT_TIMER, self.output_off, self.pulsetimer)
         
         self.Bind(wx.EVT_CLOSE, self.OnClose)
         
@@ -104,123 +120,258 @@ class AgilentFrame(FuncGenFrame):
         self.activewhenrun = [self.stopBtn, self.pauseBtn]
         
         
-    def init_device_choice(self):
-        """Init device choise combo box"""
-        self.deviceChoice.SetItems(self.devlist())
-        self.deviceChoice.SetSelection(0)
+    def init_device_choice(self, refresh=False):
+        """Init device choise combo box
+        
+        Devices are listed right away and identified in the worker thread,
+        except for the connected one.
+        """
+        self.show_devices(self.devlist(refresh=refresh, probe=False))
+        exclude = []
+        if self.fg:
+            exclude.append(self.devname)
+        self.call(self.devlist, refresh=False, probe=True, exclude=exclude,
+                  callback=self.show_devices, onerror=lambda exc: None)
+        
+    def show_devices(self, devices):
+        """Show devices in the choice, keeping the selected one"""
+        selected = self.get_address()
+        self.addresses = [info.address for info in devices]
+        self.deviceChoice.SetItems([str(info) for info in devices])
+        if selected in self.addresses:
+            self.deviceChoice.SetSelection(self.addresses.index(selected))
+        else:
+            self.deviceChoice.SetSelection(0)
+    
+    def get_address(self):
+        """Address of the device chosen, None if there is none"""
+        index = self.deviceChoice.GetSelection()
+        if 0 <= index < len(self.addresses):
+            return self.addresses[index]
         
     def init_grid(self):
-        """Init protocol grid"""
-        self.protocolGrid.CreateGrid(3, len(PROTOCOLCOLS))
+        """Init protocol grid
+        
+        The grid shows a virtual table, only the visible cells are drawn.
+        """
+        self.gridtable = ProtocolTable(ProtocolStore(3), onerror=self.OnError)
+        self.protocolGrid.SetTable(self.gridtable, True)
         self.protocolGrid.EnableDragRowSize(0)
-        for i, item in enumerate(PROTOCOLCOLS):
-            title, format = item
-            self.protocolGrid.SetColLabelValue(i, title)
+        
+    def call(self, func, *args, **kwargs):
+        """Perform func(*args, **kwargs) in the device worker thread
+        
+        Optional keyword arguments (not passed to func):
+            callback - called in GUI thread with the result of func
+            onerror - called in GUI thread with the exception raised by func,
+                by default the error is shown to the user
+        """
+        callback = kwargs.pop('callback', None)
+        onerror = kwargs.pop('onerror', None)
+        future = self.worker.submit(func, *args, **kwargs)
+        future.add_done_callback(
+            lambda fut: wx.CallAfter(self._call_done, fut, callback, onerror))
+        return future
+        
+    def _call_done(self, future, callback, onerror):
+        if not self: # frame is already destroyed
+            return
+        exc = future.exception()
+        if exc is not None:
+            if onerror:
+                onerror(exc)
+            else:
+                self.OnError('Device error:\n%s'%exc)
+        elif callback:
+            callback(future.result())
         
     def OnClose(self, evt):
+        self.timer.Stop()
+        self.running = False
         if self.fg:
-            self.fg.clear_display()
+            self.worker.submit(self.fg.clear_display)
             self.disconnect()
+        # a device stuck in a timeout does not freeze the window
+        self.worker.stop(CLOSETIMEOUT)
+        if self.recorder:
+            self.recorder.close()
+        if self.statusfeed:
+            self.statusfeed.close()
         evt.Skip()
         
+    def runlog(self):
+        """Log of what is applied to the device in this session, if one is set
+        
+        The log file is given by the PYFUNCGEN_RUNLOG environment variable,
+        see runner.recorder; it is appended to, and shown in the title.
+        """
+        filename = default_log()
+        if not filename:
+            return None
+        if self.recorder is None:
+            self.recorder = Recorder(filename)
+            self.basetitle = '%s (recording to %s)'%(self.basetitle, filename)
+            self.SetTitle(self.basetitle)
+        return self.recorder.device(0)
+        
+    def feed(self):
+        """Status feed of the device for other programs, if one is set
+        
+        The feed file is given by the PYFUNCGEN_STATUSFEED environment 
+        variable, see runner.statusfeed.
+        """
+        filename = default_feed()
+        if not filename:
+            return None
+        if self.statusfeed is None:
+            self.statusfeed = StatusFeed(filename)
+        return self.statusfeed.device(self.devname)
+        
     def OnDevListRefresh(self, evt):
-        self.init_device_choice()
+        self.init_device_choice(refresh=True)
         evt.Skip()
         
     def OnToggleConnect(self, evt):
         """Handler for Connect/Dicsonnect device button."""
         evt.Skip()
         if self.connectBtn.GetValue():# button was pressed
-            self.connect()
-            self.OnApply(evt)
+            self.connect(self.apply_values)
         else: #button was depressed
             self.disconnect()
 
-    def connect(self):
-        devname = self.deviceChoice.GetStringSelection()
-        self.fg = self.devclass(devname)        
-        if FG_API.issubset(set(dir(self.fg))) and bool(self.fg.dev):
-            self.fg.connect()
-            if not self.connectBtn.GetValue():
-                self.connectBtn.SetValue(True)
-            self.connectBtn.SetLabel('Disconnect')
-            self.amplCtrl.SetDigits(self.fg.ampldigits)
-            self.amplCtrl.SetRange(self.fg.minampl, 2*self.fg.maxampl)
-            self.freqCtrl.SetDigits(self.fg.freqdigits)
-            self.freqCtrl.SetRange(*self.fg.freqrange)
-            u = self.fg.ampl
-            f = self.fg.freq
-            self.amplCtrl.SetValue(u)
-            self.freqCtrl.SetValue(f)
-            self.update_display('manual')
-            if self.fg.output:
-                self.toggleOutputBtn.SetValue(True)
-                self.toggleOutputBtn.SetLabel("Output OFF")
-            else:
-                self.toggleOutputBtn.SetValue(False)
-                self.toggleOutputBtn.SetLabel("Output ON")
-#            title = self.GetTitle()
-            self.SetTitle('%s - %s'%(self.basetitle, self.fg.whoami()))
-            return True
-        else:
+    def connect(self, then=None):
+        """Connect to the chosen device, call then() when connected"""
+        devname = self.get_address()
+        self.connectBtn.Enable(False)
+        self.call(self._open, devname,
+                  callback=lambda info: self.connected(info, devname, then),
+                  onerror=lambda exc: self.connected(None, devname, then))
+        
+    def _open(self, devname):
+        """Create and connect the device, return it with its state
+        
+        Called in the worker thread.
+        """
+        fg = self.devclass(devname)
+        if not (FG_API.issubset(set(dir(fg))) and bool(fg.dev)):
+            return None
+        fg.connect()
+        return fg, fg.ampl, fg.freq, fg.output, fg.whoami()
+        
+    def connected(self, info, devname, then=None):
+        """Set up the GUI for a freshly connected device"""
+        self.connectBtn.Enable(True)
+        if not info:
             self.fg = None
             self.OnError('Can not connect to device %s'%devname)
             self.connectBtn.SetValue(0)
-            return False
+            return
+        self.fg, u, f, output, name = info
+        self.devname = devname
+        if not self.connectBtn.GetValue():
+            self.connectBtn.SetValue(True)
+        self.connectBtn.SetLabel('Disconnect')
+        self.amplCtrl.SetDigits(self.fg.ampldigits)
+        self.amplCtrl.SetRange(self.fg.minampl, 2*self.fg.maxampl)
+        self.freqCtrl.SetDigits(self.fg.freqdigits)
+        self.freqCtrl.SetRange(*self.fg.freqrange)
+        self.amplCtrl.SetValue(u)
+        self.freqCtrl.SetValue(f)
+        self.show_output(output)
+        log = self.runlog()
+        if log:
+            log.event(devname)
+        self.SetTitle('%s - %s'%(self.basetitle, name))
+        self.call(self.update_display, self.fg, 'manual')
+        if then:
+            then()
 
     def disconnect(self):
-        self.fg.disconnect()
-        self.fg.close()
+        fg = self.fg
         self.fg = None
+        self.call(self._close, fg)
         self.connectBtn.SetValue(False)
         self.connectBtn.SetLabel('Connect')
         self.SetTitle(self.basetitle)
+        
+    def _close(self, fg):
+        fg.disconnect()
+        fg.close()
     
     def OnApply(self, evt):
         evt.Skip()
+        self.apply_values()
+        
+    def apply_values(self):
+        """Apply values from the manual controls to the device"""
         u = self.amplCtrl.GetValue()
         f = self.freqCtrl.GetValue()
         if self.fg:
-            self.fg.apply(f,u)
-            self.update_display('manual')
+            self.call(self._apply, self.fg, f, u)
         else:
             self.OnError('Could not apply values.\nCheck if the device is connected.')
         
+    def _apply(self, fg, f, u):
+        with transaction(fg):
+            fg.apply(f,u)
+            self.update_display(fg, 'manual')
+        
     def OnToggleOutput(self, evt):
         evt.Skip()
-        if self.toggleOutputBtn.GetValue():
-            if not self.output_on():
-                self.toggleOutputBtn.SetValue(False)
-                self.OnError("Could not turn output on.\nCheck device state.")
-        else:
-            if not self.output_off():
-                self.toggleOutputBtn.SetValue(True)
-                self.OnError("Could not turn output off.\nCheck device state.")
+        self.set_output(self.toggleOutputBtn.GetValue())
     
     def OnPulse(self, evt):
+        """Apply a pulse, timed by the device if it can"""
+        if not self.fg:
+            self.OnError('Could not apply pulse.\nCheck if the device is connected.')
+            return
         pulse = self.pulseCtrl.GetValue()
-        self.output_on()
-        self.pulsetimer.Start(pulse, True)
+        def failed(exc):
+            self.show_output(False)
+            self.OnError('Could not apply pulse.\nCheck device state.')
+        self.show_output(True)
+        self.call(self.fg.pulse, pulse/1000, callback=self.pulse_done,
+                  onerror=failed)
+        
+    def pulse_done(self, result):
+        self.show_output(False)
+        log = self.runlog()
+        if log:
+            log.pulse(result)
+        print 'Pulse: %s'%result
         
     def output_on(self):
-        try:
-            self.fg.output = True
-        except:
-            return False
+        self.set_output(True)
+        
+    def output_off(self, evt=None):
+        self.set_output(False)
+        
+    def set_output(self, value):
+        """Switch the output of the device, show the new state when done"""
+        if value:
+            mesg = "Could not turn output on.\nCheck device state."
         else:
+            mesg = "Could not turn output off.\nCheck device state."
+        log = self.runlog()
+        def done(result):
+            self.show_output(value)
+            if log:
+                log.output(value)
+        def failed(exc):
+            self.show_output(not value)
+            if log:
+                log.error(exc)
+            self.OnError(mesg)
+        self.call(setattr, self.fg, 'output', bool(value),
+                  callback=done, onerror=failed)
+        
+    def show_output(self, value):
+        if value:
             self.toggleOutputBtn.SetValue(True)
             self.toggleOutputBtn.SetLabel('Output OFF')
-            return True
-        
-    def output_off(self, evt=None):
-        try:
-            self.fg.output = False
-        except:
-            return False
         else:
             self.toggleOutputBtn.SetValue(False)
             self.toggleOutputBtn.SetLabel('Output ON')
-            return True
         
     def OnAddRow(self, evt):
         """Handler for Add Row button."""
@@ -258,67 +409,71 @@ class AgilentFrame(FuncGenFrame):
         """Start executing protocol from the grid.
         
         several different timers one after another was too problematic,
-        so the dirty hack is to inflate lists of parameters and flatten it
-        to 1-dimensional list of "states" which all have the same structure. 
+        so the protocol is compiled into 1-dimensional stream of "states"
+        which all have the same structure and are produced on demand.
         """
+        evt.Skip()
         #check that device is connected - simply checks the widget state
         if not self.connectBtn.GetValue():
             #trying to connect if not yet connected
-            if not self.connect():
-                evt.Skip()
-                return
+            self.connect(self.start_protocol)
+        else:
+            self.start_protocol()
             
-        #check if the timer is already running or paused
-        if self.timer.IsRunning() or self.pauseBtn.GetValue():
-            evt.Skip()
+    def start_protocol(self):
+        #check if the protocol is already running or paused
+        if self.running or self.pauseBtn.GetValue():
             return
         
         data = self.get_grid_data()
-        if len(data) == 0:
+        if not data:
             self.OnError("No protocol specified")
             return
-        out = []
-        
+        try:
+            # adaptive stages (0 points) follow the resolution of the device
+            protocol = Protocol(data, tolerance=resolution(self.fg))
+        except ValueError, err:
+            self.OnError(str(err))
+            return
+        if protocol.saved:
+            print 'Adaptive steps: %i instead of %i, %i commands saved'%(
+                  protocol.Nstates, protocol.Ngrid, protocol.saved)
+        index, elapsed = self.checkpoint.resume_point(protocol)
+        if elapsed is not None:
+            answer = wx.MessageBox('The last run of this protocol was '
+                                   'interrupted at %i:%02i.\nResume it?'%(
+                                   elapsed//60, elapsed%60), 'Resume',
+                                   wx.YES_NO|wx.ICON_QUESTION, self)
+            if answer != wx.YES:
+                index, elapsed = 0, None
+        self.run = ProtocolRun(self.fg, protocol, display=self.show_state,
+                               log=self.runlog(), checkpoint=self.checkpoint,
+                               feed=self.feed())
+        
+        self.running = True
         for item in self.inactivewhenrun:
             item.Enable(False)
         for item in self.activewhenrun:
             item.Enable(True)
         
-        for row in data:
-            stage, T, Ustart, Fstart, Uend, Fend, Nstates = row
-            if Nstates < 1:
-                self.OnError('Number of states is incorrect')
-                return
-            elif Nstates == 1:
-                if Ustart == Uend and Fstart == Fend:
-                    dU = 0
-                    dF = 0
-                    dT = T*60
-                else:
-                    self.OnError("Number of states is incorrect")
-                    return
-            else:
-                dU = (Uend - Ustart) / (Nstates - 1)
-                dF = (Fend - Fstart) / (Nstates - 1)
-                dT = T * 60 / Nstates
-            # inflating the (multi)dimensional list of heterogeneous 
-            # values into combined 1-dim list of states
-            Us = [Ustart + dU*i for i in range(Nstates)]
-            Fs = [Fstart + dF*i for i in range(Nstates)]
-            Tremain = [T*60 - dT*i for i in range(Nstates)]
-            item = zip([stage,]*Nstates, Us, Fs, Tremain, [dT,]*Nstates)
-            out.extend(item)
-
-        self.protocol = iter(out[1:]) #returns empty iterator when len(out)==1
-        stage0, u0, f0, Tremain0, dT0 = out[0]
-        self.fg.apply(f0, u0)
-        self.output_on()
-        self.update_display(stage0, Tremain0, dT0)
-        self.timer.Start(dT0*1000)
+        self.call(self._start_run, index, elapsed, callback=self.run_started, 
+                  onerror=self.run_failed)
         
-        evt.Skip()
+    def _start_run(self, index=0, elapsed=None):
+        self.run.validate()
+        self.run.start(index, elapsed=elapsed)
+        
+    def run_started(self, result):
+        self.show_output(True)
+        self.start_timer()
+        
+    def run_failed(self, exc):
+        self.OnError(str(exc))
+        self.end_run()
         
     def OnStop(self, evt):
+        if self.run.feed:
+            self.run.feed.event(STOPPED)
         self.finish()
         evt.Skip()
         
@@ -327,16 +482,15 @@ class AgilentFrame(FuncGenFrame):
             self.pauseBtn.SetLabel("CONTINUE")
             print 'pausing'
             self.timer.Stop()
+            self.call(self.run.pause)
             if not self.leaveOutPauseCb.GetValue():
-                if not self.output_off():
-                    self.OnError("Could not turn output off.\nCheck device state.")
+                self.output_off()
         else:
             self.pauseBtn.SetLabel("PAUSE")
             print 'continuing'
-            self.timer.Start()
+            self.call(self.run.resume, callback=lambda result: self.start_timer())
             if not self.leaveOutPauseCb.GetValue():
-                if not self.output_on():
-                    self.OnError("Could not turn output on.\nCheck device state.")
+                self.output_on()
         
     def OnError(self, mesg):
         if mesg:
@@ -347,33 +501,63 @@ class AgilentFrame(FuncGenFrame):
         self.clean_rows()
         evt.Skip()
         
+    def start_timer(self):
+        """Start the timer to fire at the deadline of the next step"""
+        self.timer.Start(max(1, int(self.run.delay()*1000)), True)
+        
     def advance(self, evt):
         """Perform next step of iteration"""
-        try:
-            stage, u, f, Tremain, dT = self.protocol.next()
-        except StopIteration:
-            self.finish()
-            self.update_display('manual')
+        self.call(self.run.step, callback=self.advanced, onerror=self.run_failed)
+        
+    def advanced(self, more):
+        """Wait for the next step, or finish"""
+        if not self.running or self.pauseBtn.GetValue():
+            return
+        if more:
+            self.start_timer()
         else:
-            self.fg.apply(f, u)
-            self.timer.Start(dT*1000) 
-            self.update_display(stage, Tremain, dT)
+            self.finish()
+            self.call(self.update_display, self.run.fg, 'manual')
     
+    def show_state(self, state):
+        self.update_display(self.run.fg, state.stage, state.tremain, state.dt)
+        
     def finish(self):
         """Finishes the execution of the protocol"""
         self.timer.Stop()
+        self.running = False
         if not self.leaveOutFinishCb.GetValue():
             self.output_off()
-        wx.MessageBox('Finished', 'Info')
+        # after the step possibly being performed
+        self.call(self.checkpoint.clear)
+        run = self.run
+        self.call(lambda: run.scheduler.stats, callback=self.show_stats)
+        self.end_run()
+        
+    def show_stats(self, stats):
+        print 'Timing: %s'%stats
+        wx.MessageBox('Finished\n%s'%stats, 'Info')
+        
+    def end_run(self):
+        """Bring the GUI back from the protocol execution mode"""
+        self.timer.Stop()
+        self.running = False
+        if self.pauseBtn.GetValue():
+            self.pauseBtn.SetValue(False)
+            self.pauseBtn.SetLabel("PAUSE")
         for item in self.inactivewhenrun:
             item.Enable(True)
         for item in self.activewhenrun:
             item.Enable(False)
         
-    def update_display(self, mesg, t=None, dt=None):
-        """Updates display of function generator"""
-        f = self.fg.freq
-        u = self.fg.ampl
+    def update_display(self, fg, mesg, t=None, dt=None):
+        """Updates display of function generator fg and the GUI
+        
+        Talks to the device, so must be called in the worker thread;
+        fg is passed in, as self.fg may be gone by then (disconnected).
+        """
+        f = fg.freq
+        u = fg.ampl
         if u:
             U = '%.2f'%u
         else:
@@ -392,7 +576,13 @@ class AgilentFrame(FuncGenFrame):
             DT = '--'
         line1 = "%s - %s"%(mesg, T)
         line2 = '%s Vpp | %s Hz'%(U,F)
-        self.fg.set_display(line1, line2)
+        fg.set_display(line1, line2)
+        wx.CallAfter(self.show_values, mesg, T, DT, u, f)
+        
+    def show_values(self, mesg, T, DT, u, f):
+        """Shows current values in the GUI"""
+        if not self: # frame is already destroyed
+            return
         self.stageDisplay.SetLabel(mesg)
         self.timeDisplay.SetLabel(T)
         self.intervalDisplay.SetLabel(DT)
@@ -404,86 +594,78 @@ class AgilentFrame(FuncGenFrame):
     def get_grid_data(self):
         """Returns data from the table as list of rows"""
         self.clean_rows()
-        gridtable = self.protocolGrid.GetTable()
-        Nrow = gridtable.GetNumberRows()
-        rows = []
-        for row in range(Nrow):
-            line = []
-            for col in range(len(PROTOCOLCOLS)):
-                strval = gridtable.GetValue(row, col)
-                try:
-                    val = PROTOCOLCOLS[col][1](strval)
-                except ValueError:
-                    msg = 'Could not convert item at row %i, col %i to desired type'
-                    self.OnError(msg%(row, col))
-                    return
-                line.append(val)
-            rows.append(line)
-        return rows
+        try:
+            return self.gridtable.rows()
+        except ValueError, err:
+            self.OnError(str(err))
         
     def set_grid_data(self, data):
         """Puts the data into the protocol grid."""
-        self.protocolGrid.ClearGrid()
-        rownumdata = len(data)
-        rownumgrid = self.protocolGrid.GetNumberRows()
-        if rownumdata > rownumgrid:
-            toadd = rownumdata - rownumgrid
-            self.protocolGrid.AppendRows(toadd)
-        for rownum, row in enumerate(data):
-            for colnum, value in enumerate(row):
-                self.protocolGrid.SetCellValue(rownum, colnum, value)
+        try:
+            self.gridtable.load(data)
+        except ValueError, err:
+            self.OnError(str(err))
+            return
         self.clean_rows()
                     
     def read_data(self, filename):
-        """Reads data from CSV file"""
-        data = []
-        with open(filename, 'rb') as f:
-            reader = csv.reader(f, dialect='excel')
-            for row in reader:
-                if len(row) != len(PROTOCOLCOLS):
-                    self.OnError('Error in file formatting: %s'%filename)
-                    return
-                data.append(row)
-        return data
+        """Reads data from CSV or binary protocol file
+        
+        Files without the last (ramp shape) column are accepted as linear.
+        """
+        try:
+            if is_binary(filename):
+                with BinaryProtocol(filename) as rows:
+                    return list(rows)
+            return read_csv(filename)
+        except ValueError, err:
+            self.OnError(str(err))
     
     def write_data(self, filename, data):
-        """Writes data to CSV file"""
-        with open(filename, 'wb') as f:
-            writer = csv.writer(f, dialect='excel')
-            writer.writerows(data)
+        """Writes data to CSV file, or binary one if named *.pfg"""
+        try:
+            write_protocol(filename, data)
+        except ValueError, err:
+            self.OnError(str(err))
     
     def clean_rows(self):
         """Removes empty rows from the bottom of the grid."""
-        table = self.protocolGrid.GetTable()
-        Nrows = table.GetNumberRows()
-        for row in range(Nrows-1, -1, -1):
-            empty = True
-            for col in range(len(PROTOCOLCOLS)):
-                if not table.IsEmptyCell(row, col):
-                    empty = False
-            if empty:
-                self.protocolGrid.DeleteRows(row)
-            else:
-                break
+        self.gridtable.clean()
         
 if __name__ == "__main__":
     
-    from devices import implemented
+    from devices import implemented, get_driver, mark, report_startup
+    from devices.discovery import discovery, DeviceInfo
+    from runner.remote import running, Client, RemoteDevice
     agilentApp = wx.App(False)
+    mark('choice of generator')
     start_dlg = wx.SingleChoiceDialog(None,
                                       message='Choose a Function Generator',
                                       caption='Generator choice',
                                       choices=implemented)
     
     if start_dlg.ShowModal() == wx.ID_OK:
-        device = start_dlg.GetStringSelection()
+        driver = get_driver(start_dlg.GetStringSelection())
         start_dlg.Destroy()
-        # somehow the imports must be in that particular order
-        exec("from devices.%s import get_devices"%device)
-        exec("from devices.%s import %s as device"%(device, device))
+        transports = [driver.transport]
+        if running():
+            # the daemon owns the devices, share them with other programs
+            client = Client()
+            def devclass(address):
+                return RemoteDevice(address, client, driver.name)
+            def devlist(**kwargs):
+                return [DeviceInfo(item['address'], driver.transport, 
+                                   item['idn'])
+                        for item in client.call('list', driver=driver.name,
+                                                **kwargs)]
+        else:
+            devclass = driver.load()
+            def devlist(**kwargs):
+                return discovery.devices(transports, **kwargs)
         
-        frame = AgilentFrame(device, get_devices, parent=None, id=-1)
+        frame = AgilentFrame(devclass, devlist, parent=None, id=-1)
         frame.Show()
+        report_startup('main window')
         agilentApp.MainLoop()
     else:
         start_dlg.Destroy()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Virtual table of the protocol grid.
+
+The grid asks the table only for the cells it shows, so protocols of any
+length are displayed at once; values live in a runner.store.ProtocolStore.
+
+"""
+import wx
+import wx.grid
+
+from runner.protofile import PROTOCOLCOLS
+from runner.store import ProtocolStore
+
+
+class ProtocolTable(wx.grid.PyGridTableBase):
+    """Grid table over a ProtocolStore
+
+    onerror - called with the message when a typed value is not accepted
+    """
+    def __init__(self, store=None, onerror=None):
+        wx.grid.PyGridTableBase.__init__(self)
+        if store is None:
+            store = ProtocolStore()
+        self.store = store
+        self.onerror = onerror
+
+    def GetNumberRows(self):
+        return len(self.store)
+
+    def GetNumberCols(self):
+        return len(PROTOCOLCOLS)
+
+    def GetColLabelValue(self, col):
+        return PROTOCOLCOLS[col][0]
+
+    def IsEmptyCell(self, row, col):
+        return self.store.is_empty(row, col)
+
+    def GetValue(self, row, col):
+        return self.store.get_text(row, col)
+
+    def SetValue(self, row, col, value):
+        try:
+            self.store.set_text(row, col, value)
+        except ValueError, err:
+            if self.onerror:
+                self.onerror(str(err))
+
+    def _notify(self, msgid, *args):
+        view = self.GetView()
+        if view:
+            view.ProcessTableMessage(wx.grid.GridTableMessage(self, msgid,
+                                                              *args))
+
+    def AppendRows(self, numRows=1):
+        self.store.append_rows(numRows)
+        self._notify(wx.grid.GRIDTABLE_NOTIFY_ROWS_APPENDED, numRows)
+        return True
+
+    def DeleteRows(self, pos=0, numRows=1):
+        self.store.delete_rows(pos, numRows)
+        self._notify(wx.grid.GRIDTABLE_NOTIFY_ROWS_DELETED, pos, numRows)
+        return True
+
+    def Clear(self):
+        self.store.clear(len(self.store))
+        self._notify(wx.grid.GRIDTABLE_REQUEST_VIEW_GET_VALUES)
+
+    def load(self, rows):
+        """Replace the content with rows, raise ValueError if they are bad"""
+        before = len(self.store)
+        self.store.load(rows)
+        self._resized(before)
+
+    def clean(self):
+        """Remove empty rows from the bottom"""
+        before = len(self.store)
+        self.store.clean()
+        self._resized(before)
+
+    def _resized(self, before):
+        """Tell the grid the number of rows changed from before"""
+        after = len(self.store)
+        if after > before:
+            self._notify(wx.grid.GRIDTABLE_NOTIFY_ROWS_APPENDED,
+                         after - before)
+        elif after < before:
+            self._notify(wx.grid.GRIDTABLE_NOTIFY_ROWS_DELETED,
+                         after, before - after)
+        self._notify(wx.grid.GRIDTABLE_REQUEST_VIEW_GET_VALUES)
+
+    def rows(self):
+        """All rows as lists of values, see ProtocolStore.rows()"""
+        return self.store.rows()